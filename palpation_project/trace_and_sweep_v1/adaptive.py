@@ -0,0 +1,119 @@
+"""
+adaptive trace points (trace_mode = "adaptive"): probe a coarse grid first, then only refine where the surface isn't flat
+
+every cell of the coarse grid gets its center probed, if that is further than tolerance from the bilinear fit
+of the cell's corners the cell is split in 4 (in 2 for line traces) and the children are checked the same way,
+until cells are no larger than d_min
+flat regions end up with a few coarse points, steep or curved ones with points at most d_min apart
+features narrower than the coarse spacing that no probe lands near (a single point spike) can still be missed,
+adaptive_benchmark.py shows how much that costs on a recorded trace
+"""
+
+import numpy as np
+
+from config import xspan, yspan, adaptive_d_coarse, adaptive_d_min, adaptive_tolerance
+
+
+class AdaptiveGrid:
+    def __init__(self, xspan=xspan, yspan=yspan, d_coarse=adaptive_d_coarse, d_min=adaptive_d_min,
+                 tolerance=adaptive_tolerance):
+        assert d_coarse >= d_min > 0
+        self.xspan = xspan
+        self.yspan = yspan
+        self.d_coarse = d_coarse
+        self.d_min = d_min
+        self.tolerance = tolerance
+
+        self.heights = {}    # (x, y) -> recorded z
+        self.leaves = []     # (x0, y0, x1, y1) cells that were not split, for interpolate
+        self.yielded = set()
+        self.n_seen = 0
+        self.spacing = None  # [mm] grid spacing around the point yielded last, for the start height prediction
+
+    @staticmethod
+    def key(x, y):
+        return round(float(x), 6), round(float(y), 6)
+
+    def coarse_axis(self, span):
+        n = max(int(np.ceil(span / self.d_coarse - 1e-9)), 1)
+        return [float(v) for v in np.linspace(0, span, n + 1)]
+
+    def points(self, positions):
+        """
+        generator of (x, y) to measure, coarse grid first (serpentine), then refinement level by level
+        the heights are read from positions, so every yielded point has to be appended to it as [x, y, z]
+        before the next one is asked for (Kuka.trace does that)
+        the sequence only depends on the recorded heights, so a resumed trace gets the same points in the same order
+        """
+        xs = self.coarse_axis(self.xspan)
+        ys = self.coarse_axis(self.yspan) if self.yspan > 0 else [0.]
+        self.spacing = xs[1] - xs[0] if len(xs) > 1 else self.d_coarse
+        for j, x in enumerate(xs):
+            for y in (ys if j % 2 == 0 else ys[::-1]):
+                yield from self.measure(x, y, positions)
+
+        if self.yspan > 0:
+            cells = [(xs[i], ys[k], xs[i + 1], ys[k + 1]) for i in range(len(xs) - 1) for k in range(len(ys) - 1)]
+        else:
+            cells = [(xs[i], 0., xs[i + 1], 0.) for i in range(len(xs) - 1)]
+
+        while cells:
+            children = []
+            for cell in cells:
+                yield from self.refine(cell, positions, children)
+            cells = children
+
+    def measure(self, x, y, positions):
+        if self.key(x, y) not in self.yielded:
+            self.yielded.add(self.key(x, y))
+            yield x, y
+        self.sync(positions)
+
+    def sync(self, positions):
+        for x, y, z in positions[self.n_seen:]:
+            self.heights[self.key(x, y)] = float(z)
+        self.n_seen = len(positions)
+
+    def refine(self, cell, positions, children):
+        x0, y0, x1, y1 = cell
+        if max(x1 - x0, y1 - y0) <= self.d_min + 1e-9:
+            self.leaves.append(cell)
+            return
+
+        xm, ym = (x0 + x1) / 2, (y0 + y1) / 2
+        self.spacing = max(x1 - x0, y1 - y0) / 2
+        yield from self.measure(xm, ym, positions)
+        if abs(self.heights[self.key(xm, ym)] - self.fit(cell, xm, ym)) <= self.tolerance:
+            self.leaves.append(cell)
+            return
+
+        if y1 == y0:
+            children += [(x0, y0, xm, y0), (xm, y0, x1, y0)]
+            return
+        # corners of the 4 children
+        for x, y in [(xm, y0), (x1, ym), (xm, y1), (x0, ym)]:
+            yield from self.measure(x, y, positions)
+        children += [(x0, y0, xm, ym), (xm, y0, x1, ym), (x0, ym, xm, y1), (xm, ym, x1, y1)]
+
+    def fit(self, cell, x, y):
+        """
+        bilinear interpolation of the cell's corner heights at x, y (linear for line traces)
+        """
+        x0, y0, x1, y1 = cell
+        h = self.heights
+        tx = (x - x0) / (x1 - x0)
+        if y1 == y0:
+            return (1 - tx) * h[self.key(x0, y0)] + tx * h[self.key(x1, y0)]
+        ty = (y - y0) / (y1 - y0)
+        return ((1 - tx) * (1 - ty) * h[self.key(x0, y0)] + tx * (1 - ty) * h[self.key(x1, y0)]
+                + (1 - tx) * ty * h[self.key(x0, y1)] + tx * ty * h[self.key(x1, y1)])
+
+    def interpolate(self, x, y):
+        """
+        height of the refined surface at x, y from the leaf cell containing it, None outside the grid
+        """
+        for cell in self.leaves:
+            x0, y0, x1, y1 = cell
+            if x0 <= x <= x1 and y0 <= y <= y1:
+                return self.fit(cell, x, y)
+        return None
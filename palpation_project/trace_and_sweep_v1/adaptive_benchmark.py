@@ -0,0 +1,74 @@
+"""
+compares uniform grid traces with adaptive ones (adaptive.py) on simulated surfaces
+reports probed points, moves, simulated robot time and the error of the traced surface against the true one
+(checked on a 0.25 mm grid, between points the traced surface is the bilinear fit of each cell's corners)
+a uniform grid is an AdaptiveGrid whose coarse spacing is already d_min, so both are interpolated the same way
+both a recorded (rough) trace and a smooth simulated one are run, adaptive only saves points without losing
+accuracy on the smooth one
+"""
+
+import os
+import numpy as np
+
+from adaptive import AdaptiveGrid
+from sim_surface import SimSurface, SimKuka
+
+os.chdir(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+
+class BumpSurface:
+    """
+    slightly tilted flat surface with one round bump on it, like a nodule in otherwise flat tissue
+    """
+    def __init__(self, xspan=40, yspan=40, z0=-6, tilt=.02, bump_height=4, bump_x=26, bump_y=14, bump_sigma=3):
+        self.xspan = xspan
+        self.yspan = yspan
+        self.z0 = z0
+        self.tilt = tilt
+        self.bump_height = bump_height
+        self.bump_x = bump_x
+        self.bump_y = bump_y
+        self.bump_sigma = bump_sigma
+
+    def height(self, x, y):
+        r2 = (x - self.bump_x)**2 + (y - self.bump_y)**2
+        return self.z0 + self.tilt * x + self.bump_height * np.exp(-r2 / (2 * self.bump_sigma**2))
+
+
+def run(grid: AdaptiveGrid, surface):
+    kuka = SimKuka(surface)
+    positions = []
+    for x, y in grid.points(positions):
+        kuka.spacing = grid.spacing
+        z, e0 = kuka.measure_point(x, y, positions)
+        # same record as Kuka.trace
+        positions.append([x, y, z + (e0 - kuka.g_state.encoder_value) / 1000])
+        kuka.async_move(x, y, 0)
+
+    errors = []
+    for x in np.arange(0, grid.xspan + 1e-9, .25):
+        for y in (np.arange(0, grid.yspan + 1e-9, .25) if grid.yspan > 0 else [0]):
+            errors.append(grid.interpolate(x, y) - surface.height(x, y))
+    errors = np.abs(errors)
+    return len(positions), kuka.n_moves, kuka.move_time, errors.max(), np.sqrt(np.mean(errors**2))
+
+
+if __name__ == "__main__":
+    line = SimSurface.most_recent()
+    x_line = line.positions[:, 0]
+    cases = {
+        f"recorded line trace ({len(line.positions)} points)": (line, float(x_line.max()), 0.),
+        "simulated 40x40 mm bump": (BumpSurface(), 40., 40.),
+    }
+    for name, (surface, xspan, yspan) in cases.items():
+        print(name)
+        grids = {
+            "uniform d=1": AdaptiveGrid(xspan, yspan, d_coarse=1, d_min=1),
+            "uniform d=2": AdaptiveGrid(xspan, yspan, d_coarse=2, d_min=2),
+            "adaptive d_coarse=8 d_min=1 tolerance=.2": AdaptiveGrid(xspan, yspan, d_coarse=8, d_min=1, tolerance=.2),
+            "adaptive d_coarse=8 d_min=1 tolerance=.1": AdaptiveGrid(xspan, yspan, d_coarse=8, d_min=1, tolerance=.1),
+        }
+        for grid_name, grid in grids.items():
+            points, moves, move_time, max_error, rms_error = run(grid, surface)
+            print(f"    {grid_name}: {points} points, {moves} moves, {move_time:.0f} s robot time, "
+                  f"max error {max_error:.3f} mm, rms error {rms_error:.3f} mm")
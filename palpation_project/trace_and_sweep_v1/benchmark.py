@@ -0,0 +1,194 @@
+"""
+end to end trace and sweep benchmark against the dummy kuka and dummy labview (see simulate.py)
+
+for every grid in GRIDS runs Kuka.trace then Kuka.sweep over TCP and reports
+points per second, moves per point, where the time went (fixed sleeps, waiting for kuka,
+waiting for labview, everything else) and peak python memory
+results are saved to benchmark_results/ as json (not committed, they are per machine and per run)
+benchmark_results/baseline.json is committed: every run is compared with it, and
+    python trace_and_sweep_v1/benchmark.py baseline
+saves the run as the new baseline (do that and commit it when the trace loop changes)
+"""
+
+import datetime
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from threading import Thread
+
+from kuka import Kuka
+from labview import LabviewTCP
+from global_state import GlobalState
+from probing import LinearProbe, BisectProbe
+from dummy_kuka_server import DummyKukaServer
+from dummy_labview_client import DummyLabviewClient
+from sim_surface import SimSurface
+
+BENCH_SPEED = 500        # [mm/s] dummy kuka speed
+BENCH_LATENCY = .002     # [s] dummy kuka latency per move
+BENCH_LABVIEW_PORT = 5013
+BASELINE = "baseline.json"
+
+# dz is the step for the linear probe and the resolution for the bisect probe
+GRIDS = [
+    {"xspan": 10, "yspan": 0, "d": 1, "dz": 1, "probe": "linear"},
+    {"xspan": 10, "yspan": 0, "d": 1, "dz": 1, "probe": "bisect"},
+    {"xspan": 20, "yspan": 0, "d": 2, "dz": .5, "probe": "linear"},
+    {"xspan": 20, "yspan": 0, "d": 2, "dz": .5, "probe": "bisect"},
+    {"xspan": 4, "yspan": 4, "d": 2, "dz": 1, "probe": "bisect"},
+]
+
+
+def timings(kuka: Kuka, wall):
+    return {
+        "wall": wall,
+        "sleeping": kuka.time_sleeping,
+        "network": kuka.time_network,
+        "labview": kuka.time_labview,
+        "other": wall - kuka.time_sleeping - kuka.time_network - kuka.time_labview,
+    }
+
+
+def reset_counters(kuka: Kuka):
+    kuka.n_moves = 0
+    kuka.time_sleeping = kuka.time_network = kuka.time_labview = 0.
+
+
+def run_grid(grid, surface: SimSurface):
+    server = DummyKukaServer(port=0, speed=BENCH_SPEED, latency=BENCH_LATENCY)
+    server.start()
+    labview_client = DummyLabviewClient(server, surface, port=BENCH_LABVIEW_PORT)
+    labview_client.start()
+
+    g_state = GlobalState()
+    kuka = Kuka(g_state, host=server.host, port=server.port)
+    kuka.use_path = True  # the dummy server implements "path"
+    if grid["probe"] == "linear":
+        kuka.probe = LinearProbe(dz=grid["dz"])
+    else:
+        kuka.probe = BisectProbe(resolution=grid["dz"])
+    labview = LabviewTCP(g_state, host="localhost", port=BENCH_LABVIEW_PORT, framing="newline")
+    receive_labview_data = Thread(target=labview.receive_data, daemon=True)
+    receive_labview_data.start()
+
+    result = dict(grid)
+    try:
+        tracemalloc.start()
+        t0 = time.perf_counter()
+        kuka.trace(xspan=grid["xspan"], yspan=grid["yspan"], d=grid["d"])
+        wall = time.perf_counter() - t0
+        _, peak = tracemalloc.get_traced_memory()
+        n_points = len(kuka.load_data())
+        result["trace"] = {
+            "points": n_points,
+            "points_per_s": n_points / wall,
+            "moves_per_point": kuka.n_moves / n_points,
+            "time": timings(kuka, wall),
+            "peak_memory_bytes": peak,
+        }
+
+        reset_counters(kuka)
+        tracemalloc.reset_peak()
+        labview_client.sweep_mode = True
+        t0 = time.perf_counter()
+        kuka.sweep()
+        wall = time.perf_counter() - t0
+        _, peak = tracemalloc.get_traced_memory()
+        result["sweep"] = {
+            "sweeps": labview_client.n_sweeps,
+            "moves": kuka.n_moves,
+            "time": timings(kuka, wall),
+            "timeline": kuka.timeline.summary(),
+            "peak_memory_bytes": peak,
+        }
+    finally:
+        tracemalloc.stop()
+        kuka.disconnect()
+        labview.disconnect()
+        labview_client.done = True
+        # the next grid reuses the labview port
+        receive_labview_data.join(timeout=5)
+
+    return result
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        return None
+
+
+def print_result(result):
+    trace, sweep = result["trace"], result["sweep"]
+    t = trace["time"]
+    print(f"{result['probe']:>6} xspan={result['xspan']} yspan={result['yspan']} d={result['d']} dz={result['dz']}: "
+          f"{trace['points_per_s']:.2f} points/s, {trace['moves_per_point']:.1f} moves/point, "
+          f"sleeping {t['sleeping']:.1f}s network {t['network']:.1f}s labview {t['labview']:.1f}s other {t['other']:.1f}s, "
+          f"peak {trace['peak_memory_bytes'] / 1e6:.1f} MB | sweep {sweep['time']['wall']:.1f}s", end="")
+    gap = sweep.get("timeline", {}).get("mean_idle_gap")
+    print(f", {gap:.2f}s idle between sweeps" if gap is not None else "")
+
+
+def compare(results, baseline):
+    """
+    prints points/s and sweep time of every grid next to the baseline run's
+    """
+    print(f"compared with the baseline from {baseline['time']} (commit {baseline['commit']}):")
+    old = {tuple(result[k] for k in GRIDS[0]): result for result in baseline["results"]}
+    for result in results:
+        before = old.get(tuple(result[k] for k in GRIDS[0]))
+        if before is None:
+            print(f"{result['probe']:>6} xspan={result['xspan']} yspan={result['yspan']} d={result['d']}: not in the baseline")
+            continue
+        print(f"{result['probe']:>6} xspan={result['xspan']} yspan={result['yspan']} d={result['d']} dz={result['dz']}: "
+              f"{before['trace']['points_per_s']:.2f} -> {result['trace']['points_per_s']:.2f} points/s, "
+              f"sweep {before['sweep']['time']['wall']:.1f} -> {result['sweep']['time']['wall']:.1f}s")
+
+
+if __name__ == "__main__":
+    here = os.path.dirname(os.path.abspath(__file__))
+    surface = SimSurface.most_recent(folder=os.path.join(here, "..", "surface_data"))
+
+    results = []
+    with tempfile.TemporaryDirectory() as work_dir:
+        # trace saves to / sweep loads from ./surface_data, keep that out of the real data
+        os.makedirs(os.path.join(work_dir, "surface_data"))
+        os.chdir(work_dir)
+        for grid in GRIDS:
+            results.append(run_grid(grid, surface))
+        os.chdir(here)
+
+    print()
+    for result in results:
+        print_result(result)
+
+    formatted_time = datetime.datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
+    report = {
+        "time": formatted_time,
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "dummy_kuka": {"speed": BENCH_SPEED, "latency": BENCH_LATENCY},
+        "results": results,
+    }
+    folder = os.path.join(here, "benchmark_results")
+    os.makedirs(folder, exist_ok=True)
+    baseline_path = os.path.join(folder, BASELINE)
+    if os.path.isfile(baseline_path):
+        print()
+        with open(baseline_path) as f:
+            compare(results, json.load(f))
+
+    paths = [os.path.join(folder, f"benchmark_{formatted_time}.json")]
+    if sys.argv[1:] == ["baseline"]:
+        paths.append(baseline_path)
+    for path in paths:
+        with open(path, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"saved {path}")
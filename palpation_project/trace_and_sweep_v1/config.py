@@ -7,9 +7,72 @@ d = 1      # [mm] between each point
 zspan = 30 # [mm] of maximum z travel (to prevent running into table)
 dz = 1     # [mm] of z increment (how far it will move down on each iteration before checking if encoder_value has changed)
 encoder_value_delta_threshold = 10 # [nm] amount encoder value must change to detect surface
+record_settle = True   # record as soon as the encoder settles after contact (False: fixed 1s wait, then one encoder_value)
+settle_samples = 20    # encoder samples in a row that must be stable (~.1s at 200 Hz), the recorded value is their mean
+settle_tolerance = 5   # [nm] max std of those samples, and max drift between the means of their first and second half
+                       # (a guess, not measured on the rig: if the encoder noise is above it every record hits settle_timeout)
+settle_timeout = 1     # [s] record anyway after this long, from the newest samples; = the old fixed wait, so a record
+                       # that doesn't settle (noise above settle_tolerance) takes as long as before, never longer
+probe_mode = "linear"  # "linear" (step down by dz) or "bisect" (coarse steps, retract, then bisect)
+probe_coarse_dz = 4    # [mm] step size of the coarse descent in bisect mode, it can press this far past contact
+                       # so only use bisect with a VCA that has at least this much travel left at contact
+probe_resolution = 1   # [mm] bisect mode stops once contact height is known within this (encoder_deflection refines the rest)
+predict_start = True   # start each descent just above the surface predicted from already recorded points (False: always start at z=0)
+predict_margin = 2     # [mm] gap to leave above the predicted surface
+predict_radius = 3     # [d] recorded points within this many grid spacings are used for the prediction
+predict_max_uncertainty = 3 # [mm] start from z=0 instead when the prediction is less certain than this
+trace_resume = False   # continue the last interrupted trace with the same trace_mode/xspan/yspan/d instead of starting over
+trace_resume_max_age = 2 # [h] only resume traces interrupted (last point recorded) less than this long ago (older ones may be another sample)
+skip_trace = False     # main.py goes straight to the sweep, on the most recent surface data
+
+# scan params (trace_mode = "scan" / "hybrid")
+trace_mode = "probe"   # "probe" (stop and probe at every point), "scan" (one continuous move per row),
+                       # "hybrid" (constant height segments that follow the surface, probing only where the VCA leaves its range)
+                       # or "adaptive" (probe a coarse grid, then refine only where the surface isn't flat, smooth samples only, see readme)
+scan_preload = 3       # [mm] how far below the contact height at the start of a row to hold the VCA during the row
+scan_encoder_latency = 0 # [s] labview -> python delay, subtracted from encoder sample timestamps
+scan_segment = 10      # [mm] "hybrid": rows are scanned in moves up to this long, the VCA is checked between them
+scan_segment_margin = .5 # "hybrid": segments are cut short to use only this share of the VCA travel left at the local slope
+scan_max_deflection = 6 # [mm] "hybrid": VCA deflection beyond this counts as saturated (bottomed out)
+scan_recenter = 1      # [mm] "hybrid": between segments z follows the surface once the VCA drifted this far from scan_preload
+
+# adaptive params (trace_mode = "adaptive", d is not used)
+adaptive_d_coarse = 8  # [mm] spacing of the first, coarse grid
+adaptive_d_min = 1     # [mm] cells are split until they are no larger than this
+adaptive_tolerance = .2 # [mm] a cell is split when its center is further than this from the fit of its corners
 
 # sweep params
 n_sweep_points = 3 # number of points to perform sweep on after tracing is complete
+sweep_selection = "even"  # "even" (evenly spaced through the trace, as before) or "features" (points where the surface is most interesting, sweep_selection.py, opt in: it changes where sweeps happen)
+sweep_min_spacing = 5  # [mm] "features": no two sweep points closer than this
+sweep_anomaly_radius = 3 # [mm] "features": a point's height anomaly is against the mean height within this radius
+sweep_weight_curvature = 1 # "features": how much curvature, slope and height anomaly count in a point's score
+sweep_weight_slope = 1
+sweep_weight_anomaly = 1
+sweep_optimize_order = True # visit the sweep points in the order with the least travel instead of trace order
+sweep_clearance = True # move between sweep points just above the recorded surface instead of up at z_offset (50mm)
+sweep_clearance_margin = 5 # [mm] how far above the highest recorded surface point under a transit to move (never below 2)
+sweep_pipeline = True # send the move to the next sweep point the moment labview reports "finished" (needs kuka_path_command)
+
+# surface model (surface_model.py, heightmap built from the trace for z / normal / slope queries)
+surface_model_resolution = .25 # [mm] heightmap grid spacing
+surface_model_iterations = 500 # relaxation passes filling the heightmap between trace points
+
+# surface registration (registration.py, reuse the stored trace of a re-mounted sample instead of tracing it again)
+register_surface = False      # with skip_trace: probe a few points and move the stored surface to where the sample is now
+registration_points = 8       # how many points to probe (5-10)
+registration_tolerance = .3   # [mm] rms height residual of the fit above which the sample is traced again instead
+registration_max_offset = 10  # [mm] how far the sample may have moved in x / y
+registration_max_rotation = 10 # [deg] how far it may have turned in the xy plane
+
+# job queue (jobs.py, several samples back to back without pressing enter in between)
+jobs_file = "jobs.json"            # job list jobs.py runs when none is given
+job_reports_folder = "job_reports" # per job reports and the queue checkpoint, relative to where jobs.py is run
+job_travel_height = 50             # [mm] jobs.py lifts to this z before moving over to the next sample's origin
+
+# instrumentation (instrumentation.py, timed spans around moves / probe steps / records / labview waits)
+instrument = False # save a chrome trace / perfetto timeline and latency histograms after every run
+instrument_folder = "instrumentation" # where they're saved, relative to where main.py is run
 
 #########    SHOULDN'T HAVE TO CHANGE THESE    #########
 
@@ -17,7 +80,32 @@ n_sweep_points = 3 # number of points to perform sweep on after tracing is compl
 WIFI_HOST = '0.0.0.0'        # Accept connections from any IP
 WIFI_PORT = 5003             # Port to receive Wi-Fi data
 BUFFER_SIZE = 1024           # Size of buffer for receiving data
+labview_framing = "packet"   # "packet": one recv = one message (the labview code as it is), "newline": labview ends every message with \n
+labview_ready_signal = False # send "ready n" to labview when kuka is in place at sweep point n (labview code must start the sweep on it)
+labview_mode_signal = False  # send "mode trace" / "mode sweep" when kuka starts a trace / sweep (labview code must switch modes on it)
+encoder_buffer_size = 65536  # number of (timestamp, encoder_value) samples kept for window queries
 
 # for kuka tcp connection
 KUKA_HOST = '172.31.1.147'   # KUKA iiwa robot IP address
 KUKA_PORT = 30004           # KUKA listening port
+kuka_move_ack = True         # kuka program replies "reached" after each move (set False for programs that don't)
+kuka_move_timeout = 10       # [s] max time to wait for "reached", the run stops with a TimeoutError after that
+encoder_fresh_timeout = .5   # [s] after "reached", max wait for an encoder value received after the move ended
+kuka_path_command = False    # kuka program accepts "path" (several waypoints in one message), False sends them as separate moves
+kuka_speed = 50              # [mm/s] tcp speed limit, for move time estimates (motion.py)
+kuka_acceleration = 250      # [mm/s^2] tcp acceleration, for move time estimates
+kuka_latency = .1            # [s] fixed time per move on top of the motion (wifi + motion planning)
+move_wait_margin = 1.5       # without kuka_move_ack, wait the estimated move time times this after each move
+move_model_file = "move_model.json" # calibrated speed / acceleration / latency (motion.py), replaces the 3 above if it exists
+move_model_calibrate = False # measure kuka's move times at the start of main.py and save them to move_model_file
+
+# robot link daemon (robot_link.py), keeps the kuka and labview connections open between runs
+use_robot_link = False       # attach to a running robot_link.py instead of connecting to kuka / labview directly
+robot_link_dir = None        # folder for the daemon's unix sockets, None for the system temp folder
+robot_link_ports = (30104, 5103) # localhost ports for kuka / labview clients where there are no unix sockets (windows)
+robot_link_keepalive = 2     # [s] kuka connection idle this long -> tcp keepalive probes check it's still there (nothing is sent to the program)
+robot_link_heartbeat_command = None # command the daemon sends kuka when idle, e.g. "send_coordinates" for programs that answer it
+                             # with "x y z a b c" (the palpation program on 30004 doesn't), None: only tcp keepalive
+robot_link_heartbeat = 2     # [s] kuka idle this long (and no client attached) -> send robot_link_heartbeat_command
+robot_link_timeout = 5       # [s] no heartbeat reply (or kuka connect) for this long = connection lost, reconnect
+robot_link_backoff_max = 30  # [s] longest wait between kuka reconnect attempts (starts at .5s, doubles)
@@ -0,0 +1,134 @@
+"""
+stand-in for the TCP_vca_sweep program on the kuka, for testing without the robot
+
+accepts the same "move x y z" / "exit" commands, waits as long as the robot would take
+to do the move (fixed latency + distance / speed) and replies "reached"
+
+"send_coordinates" replies "x y z a b c" with the current tcp position (a, b, c always 0)
+"path n x y z dwell ..." runs n waypoints back to back with the latency only once,
+stopping dwell seconds and replying "reached i" at waypoints with dwell > 0, then "reached" at the end
+
+run this, then point Kuka at it: Kuka(g_state, host="localhost")
+"""
+
+import socket
+from threading import Thread
+import time
+import math
+
+from config import KUKA_PORT
+
+DUMMY_HOST = 'localhost'
+SPEED = 50        # [mm/s] simulated linear speed of the tcp
+LATENCY = .02     # [s] simulated fixed overhead per move (network + motion planning)
+
+
+class DummyKukaServer:
+    def __init__(self, host=DUMMY_HOST, port=KUKA_PORT, speed=SPEED, latency=LATENCY):
+        self.host = host
+        self.port = port
+        self.speed = speed
+        self.latency = latency
+        self.position = [0, 0, 0]
+        # current move, for current_position() while it runs
+        self.move_start = [0, 0, 0]
+        self.move_t0 = 0  # when the tcp starts moving
+        self.move_t1 = 0  # when it arrives
+        self.n_moves = 0
+        self.done = False
+
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.socket.bind((self.host, self.port))
+        # port=0 picks a free port, report the real one
+        self.port = self.socket.getsockname()[1]
+        self.socket.listen(1)
+
+    def travel_time(self, x, y, z):
+        x0, y0, z0 = self.position
+        distance = math.sqrt((x - x0)**2 + (y - y0)**2 + (z - z0)**2)
+        return distance / self.speed
+
+    def move_time(self, x, y, z):
+        return self.latency + self.travel_time(x, y, z)
+
+    def current_position(self):
+        """
+        where the tcp is right now, interpolated along the current move (constant speed)
+        """
+        t = time.monotonic()
+        if t >= self.move_t1:
+            return list(self.position)
+        frac = max(t - self.move_t0, 0) / max(self.move_t1 - self.move_t0, 1e-9)
+        return [p0 + frac * (p1 - p0) for p0, p1 in zip(self.move_start, self.position)]
+
+    def run_move(self, x, y, z, latency):
+        """
+        blocks for as long as the move takes: latency, then travel at constant speed
+        """
+        travel_time = self.travel_time(x, y, z)
+        self.move_start = self.position
+        self.move_t0 = time.monotonic() + latency
+        self.move_t1 = self.move_t0 + travel_time
+        self.position = [x, y, z]
+        time.sleep(latency + travel_time)
+        self.n_moves += 1
+
+    def serve(self):
+        print(f"dummy kuka listening on {self.host}:{self.port}")
+        conn, addr = self.socket.accept()
+        print(f"dummy kuka connected to {addr}")
+
+        buffer = b""
+        try:
+            with conn:
+                while not self.done:
+                    data = conn.recv(1024)
+                    if not data:
+                        break
+                    buffer += data
+                    while b"\n" in buffer:
+                        line, buffer = buffer.split(b"\n", 1)
+                        self.handle(conn, line.decode().strip())
+        except Exception as e:
+            print(f"dummy kuka exception: {e}")
+        finally:
+            self.done = True
+            self.socket.close()
+            print("dummy kuka closed")
+
+    def handle(self, conn, cmd):
+        parts = cmd.split()
+        if not parts:
+            return
+        if parts[0] == "exit":
+            self.done = True
+        elif parts[0] == "move":
+            x, y, z = (float(v) for v in parts[1:4])
+            self.run_move(x, y, z, self.latency)
+            conn.sendall("reached\n".encode())
+        elif parts[0] == "path":
+            n = int(parts[1])
+            values = [float(v) for v in parts[2:2 + 4 * n]]
+            for i in range(n):
+                x, y, z, dwell = values[4 * i:4 * i + 4]
+                self.run_move(x, y, z, self.latency if i == 0 else 0)
+                if dwell > 0:
+                    conn.sendall(f"reached {i}\n".encode())
+                    time.sleep(dwell)
+            conn.sendall("reached\n".encode())
+        elif parts[0] == "send_coordinates":
+            x, y, z = self.current_position()
+            conn.sendall(f"{x} {y} {z} 0 0 0\n".encode())
+        else:
+            print(f"dummy kuka command not recognized: {cmd=}")
+
+    def start(self):
+        thread = Thread(target=self.serve, daemon=True)
+        thread.start()
+        return thread
+
+
+if __name__ == "__main__":
+    server = DummyKukaServer()
+    server.serve()
@@ -0,0 +1,142 @@
+"""
+stand-in for the labview code, for testing without the VCA
+
+connects to python like labview does and streams encoder values computed from a recorded surface
+and where the dummy kuka server currently is (VCA pushed in by surface height - tcp z)
+
+in sweep mode (what the operator switches labview to after the trace) it also acts out a sweep
+every time the robot stops in contact with the surface at a new point: "start", "sweeping", "finished"
+a sweep starts sweep_trigger after the robot stopped, or right away when python sends "ready n" (labview_ready_signal)
+"mode sweep" / "mode trace" from python (labview_mode_signal) switches sweep mode on and off like the operator would
+"""
+
+import select
+import socket
+from threading import Thread
+import time
+import numpy as np
+
+from config import WIFI_PORT
+from dummy_kuka_server import DummyKukaServer
+from sim_surface import SimSurface
+
+E0 = 50000.        # [nm] encoder_value with the VCA free
+NOISE = 2.         # [nm] std of gaussian noise added to every encoder value
+RATE = 200         # [Hz] encoder values sent per second
+SWEEP_TRIGGER = .2 # [s] how long the robot must sit in contact before a sweep starts
+SWEEP_TIME = .5    # [s] how long a simulated sweep takes
+SETTLE_TAU = 0.    # [s] time constant of the VCA settling into a new compression (first order lag), 0 for an ideal VCA
+CONTACT_TOLERANCE = .1 # [mm] sweeps start at recorded surface heights, so count the tcp this close above the surface as touching
+
+
+class DummyLabviewClient:
+    def __init__(self, kuka: DummyKukaServer, surface: SimSurface, host='localhost', port=WIFI_PORT,
+                 e0=E0, noise=NOISE, rate=RATE, sweep_trigger=SWEEP_TRIGGER, sweep_time=SWEEP_TIME, settle_tau=SETTLE_TAU):
+        self.kuka = kuka
+        self.surface = surface
+        self.host = host
+        self.port = port
+        self.e0 = e0
+        self.noise = noise
+        self.rate = rate
+        self.sweep_trigger = sweep_trigger
+        self.sweep_time = sweep_time
+        self.settle_tau = settle_tau
+        self.compression = 0.
+        self.t_last = None
+
+        self.sweep_mode = False
+        self.ready = False   # python sent "ready n", kuka is in place
+        self.done = False
+        self.n_sent = 0
+        self.n_sweeps = 0
+        self.rng = np.random.default_rng()
+
+    def encoder_value(self):
+        x, y, z = self.kuka.current_position()
+        compression = max(self.surface.height(x, y) - z, 0)
+        t = time.monotonic()
+        if self.t_last is None or self.settle_tau <= 0:
+            self.compression = compression
+        else:
+            self.compression += (compression - self.compression) * (1 - np.exp(-(t - self.t_last) / self.settle_tau))
+        self.t_last = t
+        return self.e0 - self.compression * 1000 + self.rng.normal(0, self.noise)
+
+    def in_contact(self):
+        x, y, z = self.kuka.current_position()
+        return self.surface.height(x, y) > z - CONTACT_TOLERANCE
+
+    def connect(self):
+        # python may not be listening yet
+        while not self.done:
+            try:
+                return socket.create_connection((self.host, self.port))
+            except ConnectionRefusedError:
+                time.sleep(.05)
+
+    def receive(self, conn, buffer):
+        """
+        reads whatever python sent without blocking, returns what's left of an unfinished line
+        """
+        while select.select([conn], [], [], 0)[0]:
+            data = conn.recv(1024)
+            if not data:
+                break
+            buffer += data
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            if line.startswith(b"ready"):
+                self.ready = True
+            elif line.strip() in (b"mode sweep", b"mode trace"):
+                self.sweep_mode = line.strip() == b"mode sweep"
+        return buffer
+
+    def run(self):
+        conn = self.connect()
+        print(f"dummy labview connected to {self.host}:{self.port}")
+
+        sent_sweep_state = False
+        last_swept = None
+        sweep_end = None
+        received = b""
+        try:
+            with conn:
+                while not self.done and not self.kuka.done:
+                    messages = [f"{self.encoder_value():.1f}"]
+                    received = self.receive(conn, received)
+
+                    if not self.sweep_mode:
+                        sent_sweep_state = False
+                        last_swept = None
+                    else:
+                        t = time.monotonic()
+                        if not sent_sweep_state:
+                            messages.append("finished")
+                            sent_sweep_state = True
+                        if sweep_end is not None:
+                            if t >= sweep_end:
+                                messages.append("finished")
+                                self.n_sweeps += 1
+                                sweep_end = None
+                        elif ((self.ready or t > self.kuka.move_t1 + self.sweep_trigger) and self.in_contact()
+                              and self.kuka.position != last_swept):
+                            last_swept = list(self.kuka.position)
+                            self.ready = False
+                            messages += ["start", "sweeping"]
+                            sweep_end = t + self.sweep_time
+
+                    conn.sendall("".join(m + "\n" for m in messages).encode())
+                    self.n_sent += 1
+                    time.sleep(1 / self.rate)
+        except Exception as e:
+            print(f"dummy labview exception: {e}")
+        finally:
+            self.done = True
+            print("dummy labview closed")
+
+    def start(self):
+        thread = Thread(target=self.run, daemon=True)
+        thread.start()
+        return thread
+
@@ -0,0 +1,212 @@
+"""
+asyncio version of the trace/sweep workflow (see main_async.py)
+
+the kuka link, the labview link, trace/sweep and the console all run on one event loop
+instead of one OS thread each, and state changes are awaited instead of polled
+
+AsyncKuka runs the same Kuka workflows (the *_steps generators), only the socket reads, sleeps and
+labview waits are coroutines. Kuka and LabviewTCP stay the blocking versions.
+"""
+
+import asyncio
+import inspect
+import socket
+import time
+
+from config import KUKA_HOST, KUKA_PORT
+from config import WIFI_HOST, WIFI_PORT, BUFFER_SIZE, labview_framing, labview_ready_signal, labview_mode_signal
+from config import use_robot_link
+from global_state import GlobalState
+from instrumentation import tracer
+from kuka import Kuka
+from labview import handle_message, labview_signal
+from robot_link import open_link
+
+
+async def wait_state(g_state: GlobalState, predicate, timeout=None):
+    """
+    awaitable version of g_state.wait_for: resolves as soon as an attribute change makes predicate(g_state) true
+    returns False on timeout
+    """
+    if predicate(g_state):
+        return True
+
+    loop = asyncio.get_running_loop()
+    changed = loop.create_future()
+
+    def on_change(name, old, new):
+        if predicate(g_state):
+            # may be called from another thread (blocking LabviewTCP), so hand over to the loop
+            loop.call_soon_threadsafe(lambda: changed.done() or changed.set_result(True))
+
+    g_state.add_listener(on_change)
+    try:
+        # re-check, the state may have changed before the listener was added
+        if predicate(g_state):
+            return True
+        await asyncio.wait_for(changed, timeout)
+        return True
+    except asyncio.TimeoutError:
+        return False
+    finally:
+        g_state.remove_listener(on_change)
+
+
+class AsyncKuka(Kuka):
+    """
+    Kuka on the event loop: only the I/O primitives below are coroutines, every workflow is a Kuka *_steps generator
+    run by run_steps here, so kuka.trace() / kuka.sweep() / ... return coroutines to await
+    """
+    def __init__(self, g_state: GlobalState, host = KUKA_HOST, port = KUKA_PORT, link = use_robot_link):
+        super().__init__(g_state, no_connect=True, host=host, port=port, link=link)
+        self.reader = None
+        self.writer = None
+
+    async def run_steps(self, steps):
+        """
+        Kuka.run_steps awaiting every step that returns an awaitable, and flushing what it sent
+        """
+        try:
+            step = next(steps)
+            while True:
+                name, *args = step
+                try:
+                    result = getattr(self, name)(*args)
+                    if inspect.isawaitable(result):
+                        result = await result
+                    if self.writer is not None and not self.writer.is_closing():
+                        await self.writer.drain()
+                except BaseException as e:
+                    step = steps.throw(e)
+                else:
+                    step = steps.send(result)
+        except StopIteration as stop:
+            return stop.value
+
+    async def connect(self):
+        if self.link:
+            self.reader, self.writer = await open_link("kuka")
+            print("Connected to KUKA robot through the robot link")
+        else:
+            self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+            self.writer.get_extra_info("socket").setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            print(f"Connected to KUKA robot at {self.host}:{self.port}")
+        self.g_state.kuka_connected = True
+        self.g_state.kuka_state = "idle"
+
+    async def disconnect(self):
+        try:
+            self.writer.write("exit\n".encode())
+            await self.writer.drain()
+            self.writer.close()
+        finally:
+            print("kuka disconnected")
+            self.g_state.kuka_connected = False
+            self.g_state.kuka_state = None
+
+    def send_command(self, cmd):
+        # fire_path calls this from g_state listeners, AsyncLabview sets labview_state on the loop so that's safe
+        self.writer.write((cmd + "\n").encode())
+
+    async def read_line(self, deadline):
+        try:
+            line = await asyncio.wait_for(self.reader.readline(), max(deadline - time.monotonic(), 0))
+        except asyncio.TimeoutError:
+            return None
+        if not line:
+            raise ConnectionError("kuka closed the connection")
+        return line.decode().strip().lower()
+
+    async def sleep(self, seconds):
+        t0 = time.perf_counter()
+        await asyncio.sleep(seconds)
+        self.time_sleeping += time.perf_counter() - t0
+
+    async def wait_for_labview(self, predicate, timeout=None, name="labview wait"):
+        t0 = time.perf_counter()
+        try:
+            with tracer.span(name, "labview"):
+                return await wait_state(self.g_state, predicate, timeout)
+        finally:
+            self.time_labview += time.perf_counter() - t0
+
+
+class AsyncLabview:
+    """
+    labview TCP server on the event loop, start() returns right away instead of blocking on accept
+    with link it attaches to robot_link.py instead
+    """
+    def __init__(self, g_state: GlobalState, host = WIFI_HOST, port = WIFI_PORT, ready_signal = labview_ready_signal,
+                 link = use_robot_link, mode_signal = labview_mode_signal, framing = labview_framing):
+        self.g_state = g_state
+        self.host = host
+        self.port = port
+        self.ready_signal = ready_signal
+        self.mode_signal = mode_signal
+        self.framing = framing
+        self.link = link
+        self.server = None
+        self.writer = None
+        self.connection = None  # task running receive_data for the connected client
+
+    async def start(self):
+        if self.link:
+            reader, writer = await open_link("labview")
+            print("Connected to labview through the robot link")
+            self.connection = asyncio.ensure_future(self.receive_data(reader, writer))
+            return
+        self.server = await asyncio.start_server(self.receive_data, self.host, self.port)
+        # port=0 picks a free port, report the real one
+        self.port = self.server.sockets[0].getsockname()[1]
+        print(f"Waiting for labview TCP connection on port {self.port}...")
+
+    async def stop(self):
+        self.g_state.end_labview_connection = True
+        if self.server is not None:
+            self.server.close()
+        if self.writer is not None:
+            # closing the connection makes the pending read return, so receive_data ends normally
+            self.writer.close()
+            await self.connection
+
+    def on_state_change(self, name, old, new):
+        """
+        passes the signals labview acts on to it (see labview_signal)
+        """
+        message = labview_signal(name, new, self.ready_signal, self.mode_signal)
+        if message is not None and self.writer is not None:
+            self.writer.write(f"{message}\n".encode())
+
+    async def receive_data(self, reader, writer):
+        if self.g_state.labview_connected:
+            print(f"already connected to labview, refusing {writer.get_extra_info('peername')}")
+            writer.close()
+            return
+
+        print(f"Connected to labview TCP client: {writer.get_extra_info('peername')}")
+        self.writer = writer
+        self.connection = asyncio.current_task()
+        self.g_state.labview_state = None
+        self.g_state.labview_connected = True
+        self.g_state.add_listener(self.on_state_change)
+        try:
+            while not self.g_state.end_labview_connection:
+                if self.framing == "newline":
+                    data = await reader.readline()
+                else:
+                    data = await reader.read(BUFFER_SIZE)
+                if not data:
+                    break
+                t = time.monotonic()
+                for message in data.split(b"\n"):
+                    handle_message(self.g_state, message, t)
+        except Exception as e:
+            print(f"Exception: {e}")
+        finally:
+            print("Ending labview TCP connection")
+            self.g_state.remove_listener(self.on_state_change)
+            writer.close()
+            self.writer = None
+            self.g_state.labview_connected = False
+            self.g_state.labview_state = None
+            self.g_state.encoder_value = None
@@ -1,8 +1,64 @@
+import threading
+
+from labview_stream import SampleRingBuffer
+
+
 class GlobalState:
+    """
+    state shared between the kuka, labview and main threads
+    setting any attribute wakes up every thread blocked in wait_for and calls the listeners,
+    so threads react to state changes immediately instead of polling with time.sleep
+    """
     def __init__(self):
+        object.__setattr__(self, "_condition", threading.Condition())
+        object.__setattr__(self, "_listeners", [])
+
         self.kuka_state = None
         self.kuka_connected = False
         self.labview_state = None
         self.labview_connected = False
         self.end_labview_connection = False
+        self.sweep_ready = None # index of the last sweep point kuka got in place at, None when not sweeping
         self.encoder_value = None
+        self.encoder_buffer = SampleRingBuffer() # timestamped history of encoder_value
+
+    def __setattr__(self, name, value):
+        with self._condition:
+            old = getattr(self, name, None)
+            object.__setattr__(self, name, value)
+            self._condition.notify_all()
+            listeners = list(self._listeners)
+
+        for callback in listeners:
+            callback(name, old, value)
+
+    def wait_for(self, predicate, timeout=None):
+        """
+        block until predicate(g_state) is true
+        returns the last predicate result, so False means it timed out
+        """
+        with self._condition:
+            return self._condition.wait_for(lambda: predicate(self), timeout)
+
+    def snapshot(self):
+        """
+        consistent copy of every attribute, taken while no other thread can change them
+        the labview thread appends to encoder_buffer without the lock, so that is copied out as an (n, 2) array
+        of (timestamp, encoder_value) instead of handing out the live buffer
+        """
+        with self._condition:
+            state = {k: v for k, v in vars(self).items() if not k.startswith("_")}
+            state["encoder_buffer"] = self.encoder_buffer.latest()
+            return state
+
+    def add_listener(self, callback):
+        """
+        callback(name, old, new) is called from the setting thread after every attribute change
+        keep it short, encoder_value changes for every labview message
+        """
+        with self._condition:
+            self._listeners.append(callback)
+
+    def remove_listener(self, callback):
+        with self._condition:
+            self._listeners.remove(callback)
@@ -0,0 +1,182 @@
+"""
+where the time goes in a run: spans (timed sections) around moves, probe steps, records and labview waits,
+and counters for labview messages (instrument = True in config.py)
+
+    with tracer.span("move", "kuka", z=z):
+        ...
+    tracer.count("encoder messages")
+
+with instrument off span returns one shared do-nothing context and count returns right away,
+so the calls can stay in the hot paths
+
+tracer.save() writes instrumentation/<name>.trace.json, a chrome trace (open it in ui.perfetto.dev or chrome://tracing,
+one row per thread, spans nested by time) and instrumentation/<name>.summary.json with count / mean / percentiles
+and a histogram of every span name, tracer.report() prints the same summary
+"""
+
+import datetime
+import json
+import os
+import threading
+import time
+import numpy as np
+
+from config import instrument, instrument_folder
+
+COUNTER_INTERVAL = .1  # [s] counters are written to the timeline at most this often each
+HISTOGRAM_EDGES = [0, 1e-4, 1e-3, 1e-2, 1e-1, 1, 10, float("inf")]  # [s]
+HISTOGRAM_LABELS = ["<.1ms", ".1-1ms", "1-10ms", "10-100ms", ".1-1s", "1-10s", ">10s"]
+
+
+class NullSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+NULL_SPAN = NullSpan()
+
+
+class Span:
+    __slots__ = ("tracer", "name", "category", "args", "t0")
+
+    def __init__(self, tracer, name, category, args):
+        self.tracer = tracer
+        self.name = name
+        self.category = category
+        self.args = args
+
+    def __enter__(self):
+        self.t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.tracer.add_span(self.name, self.category, self.t0, time.perf_counter(), self.args)
+        return False
+
+
+class Tracer:
+    def __init__(self, enabled=instrument):
+        self.enabled = enabled
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.t0 = time.perf_counter()
+            self.spans = []           # (name, category, thread id, t0, t1, args)
+            self.counters = {}        # name -> total
+            self.counter_samples = [] # (name, t, total)
+            self.counter_last = {}    # name -> when it was last sampled
+            self.threads = {}         # thread id -> thread name
+
+    def span(self, name, category="kuka", **args):
+        if not self.enabled:
+            return NULL_SPAN
+        return Span(self, name, category, args)
+
+    def add_span(self, name, category, t0, t1, args):
+        thread = threading.current_thread()
+        with self.lock:
+            self.threads.setdefault(thread.ident, thread.name)
+            self.spans.append((name, category, thread.ident, t0, t1, args))
+
+    def count(self, name, n=1):
+        if not self.enabled:
+            return
+        t = time.perf_counter()
+        with self.lock:
+            total = self.counters[name] = self.counters.get(name, 0) + n
+            if t - self.counter_last.get(name, -COUNTER_INTERVAL) >= COUNTER_INTERVAL:
+                self.counter_last[name] = t
+                self.counter_samples.append((name, t, total))
+
+    def durations(self):
+        """
+        {span name: array of durations [s]}
+        """
+        with self.lock:
+            spans = list(self.spans)
+        durations = {}
+        for name, _, _, t0, t1, _ in spans:
+            durations.setdefault(name, []).append(t1 - t0)
+        return {name: np.array(values) for name, values in durations.items()}
+
+    def summary(self):
+        spans = {}
+        for name, values in self.durations().items():
+            p50, p90, p99 = np.percentile(values, [50, 90, 99])
+            spans[name] = {
+                "count": len(values),
+                "total": float(values.sum()),
+                "mean": float(values.mean()),
+                "p50": float(p50),
+                "p90": float(p90),
+                "p99": float(p99),
+                "max": float(values.max()),
+                "histogram": dict(zip(HISTOGRAM_LABELS, np.histogram(values, HISTOGRAM_EDGES)[0].tolist())),
+            }
+        with self.lock:
+            counters = dict(self.counters)
+        return {"wall": time.perf_counter() - self.t0, "spans": spans, "counters": counters}
+
+    def chrome_trace(self):
+        """
+        {"traceEvents": [...]} in the chrome trace event format, times in microseconds since reset
+        """
+        with self.lock:
+            spans = list(self.spans)
+            samples = list(self.counter_samples)
+            threads = dict(self.threads)
+            counters = dict(self.counters)
+            t_end = time.perf_counter()
+
+        pid = os.getpid()
+        us = lambda t: (t - self.t0) * 1e6
+        events = [{"name": "thread_name", "ph": "M", "pid": pid, "tid": tid, "args": {"name": name}}
+                  for tid, name in threads.items()]
+        # outer spans first when they start at the same time, so viewers nest them properly
+        for name, category, tid, t0, t1, args in sorted(spans, key=lambda s: (s[3], -s[4])):
+            events.append({"name": name, "cat": category, "ph": "X", "ts": us(t0), "dur": (t1 - t0) * 1e6,
+                           "pid": pid, "tid": tid, "args": args})
+        for name, t, total in samples:
+            events.append({"name": name, "ph": "C", "ts": us(t), "pid": pid, "args": {name: total}})
+        for name, total in counters.items():
+            events.append({"name": name, "ph": "C", "ts": us(t_end), "pid": pid, "args": {name: total}})
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def save(self, name=None, folder=instrument_folder):
+        """
+        writes <name>.trace.json and <name>.summary.json to folder, returns their paths (None if instrument is off)
+        """
+        if not self.enabled:
+            return None
+        if name is None:
+            name = "run_" + datetime.datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
+        os.makedirs(folder, exist_ok=True)
+        trace_path = os.path.join(folder, f"{name}.trace.json")
+        summary_path = os.path.join(folder, f"{name}.summary.json")
+        with open(trace_path, "w") as f:
+            json.dump(self.chrome_trace(), f)
+        with open(summary_path, "w") as f:
+            json.dump(self.summary(), f, indent=2)
+        print(f"saved instrumentation to {trace_path} (open in ui.perfetto.dev) and {summary_path}")
+        return trace_path, summary_path
+
+    def report(self):
+        if not self.enabled:
+            return None
+        summary = self.summary()
+        print(f"{'span':>16} {'count':>6} {'mean':>8} {'p50':>8} {'p90':>8} {'p99':>8} {'max':>8} [ms]   histogram")
+        for name, s in sorted(summary["spans"].items(), key=lambda item: -item[1]["total"]):
+            histogram = " ".join(f"{label}:{n}" for label, n in s["histogram"].items() if n)
+            print(f"{name:>16} {s['count']:>6} " + " ".join(f"{s[k] * 1000:8.2f}" for k in ("mean", "p50", "p90", "p99", "max"))
+                  + f"        {histogram}")
+        for name, total in summary["counters"].items():
+            print(f"{name}: {total} ({total / summary['wall']:.1f}/s)")
+        return summary
+
+
+tracer = Tracer()
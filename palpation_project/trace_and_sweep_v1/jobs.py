@@ -0,0 +1,261 @@
+"""
+runs a queue of samples back to back, without pressing enter before / between the trace and sweep of each one
+    python trace_and_sweep_v1/jobs.py [jobs file]      (jobs_file in config.py if not given)
+
+the jobs file is a json list with one job per sample, anything left out comes from config.py
+    [
+        {"name": "sample_a", "origin": [0, 0], "xspan": 60, "yspan": 0, "d": 1, "n_sweep_points": 3},
+        {"name": "sample_b", "origin": [0, 80], "trace_mode": "adaptive", "xspan": 40, "yspan": 40},
+        {"name": "sample_c", "origin": [0, 160], "skip_trace": true}
+    ]
+    name            unique, letters / digits / _ / -, also the surface store prefix the sample's traces are saved under
+    origin          [mm] x, y in kuka's frame where the sample's trace starts, every move of the job is shifted by it
+    trace_mode, xspan, yspan, d, n_sweep_points   as in config.py, n_sweep_points = 0 only traces
+    skip_trace      sweep an earlier trace of this sample instead of tracing it again
+    surface_run     with skip_trace, the run id to sweep (the most recent run with the job's name if not given)
+    register        with skip_trace, probe a few points first and move that trace to where the sample is now
+                    (registration.py), the sample is traced again if it doesn't fit
+
+between jobs kuka lifts to job_travel_height, moves over to the next origin and goes down to z=0 there,
+there is no stop for the operator
+labview has to be in trace mode for a trace and sweep mode for a sweep: with labview_mode_signal it is switched
+by python, otherwise the sweep waits (with no time limit) until someone switches it over
+
+checkpointing: the queue's progress is written to job_reports/<jobs file name>.state.json after every stage,
+run again it skips jobs that are done, sweeps jobs whose trace was finished from that trace and resumes an interrupted
+trace where it stopped (trace_resume), jobs whose settings changed since are started over
+a failed job is recorded as failed and the queue goes on with the next one, failed jobs are retried on the next run
+
+every job gets a report, job_reports/<name>.json: its settings, the surface run swept, points traced,
+how long trace / sweep took, the registration fit, the sweep timeline and the error if it failed
+"""
+
+import datetime
+import json
+import os
+import re
+import sys
+import time
+import traceback
+from threading import Thread
+
+from config import xspan, yspan, d, trace_mode, n_sweep_points, skip_trace, register_surface, move_model_calibrate
+from config import jobs_file, job_reports_folder, job_travel_height, labview_mode_signal
+from kuka import Kuka
+from labview import LabviewTCP
+from global_state import GlobalState
+from surface_store import SurfaceStore
+from instrumentation import tracer
+
+JOB_DEFAULTS = {"origin": [0, 0], "trace_mode": trace_mode, "xspan": xspan, "yspan": yspan, "d": d,
+                "n_sweep_points": n_sweep_points, "skip_trace": skip_trace, "surface_run": None,
+                "register": register_surface}
+
+
+def load_jobs(path=jobs_file):
+    """
+    jobs from a jobs file, each a dict with every key of JOB_DEFAULTS filled in
+    """
+    with open(path) as f:
+        entries = json.load(f)
+
+    jobs = []
+    for entry in entries:
+        name = entry.get("name")
+        if not isinstance(name, str) or not re.fullmatch(r"[\w-]+", name):
+            raise ValueError(f"job names must be letters, digits, _ or -, got {name!r}")
+        if name in (job["name"] for job in jobs):
+            raise ValueError(f"two jobs are named {name!r}")
+        unknown = set(entry) - set(JOB_DEFAULTS) - {"name"}
+        if unknown:
+            raise ValueError(f"job {name}: unknown settings {sorted(unknown)}")
+        job = {"name": name, **JOB_DEFAULTS, **entry}
+        if job["trace_mode"] not in ("probe", "adaptive", "scan", "hybrid"):
+            raise ValueError(f"job {name}: unknown trace_mode {job['trace_mode']!r}")
+        jobs.append(job)
+    return jobs
+
+
+class JobQueue:
+    def __init__(self, kuka: Kuka, jobs, state_path, folder=job_reports_folder):
+        self.kuka = kuka
+        if not labview_mode_signal:
+            # nobody may be there to switch labview over right away, a queued sweep waits for it instead of failing
+            kuka.labview_state_timeout = None
+        self.jobs = jobs
+        self.folder = folder
+        self.state_path = state_path
+        self.state = {}  # {job name: {"job": settings, "status": "pending" / "traced" / "done" / "failed", "trace_run": run id}}
+        if os.path.isfile(state_path):
+            with open(state_path) as f:
+                self.state = json.load(f)
+
+    @classmethod
+    def from_file(cls, kuka: Kuka, path=jobs_file, folder=job_reports_folder):
+        name = os.path.splitext(os.path.basename(path))[0]
+        return cls(kuka, load_jobs(path), os.path.join(folder, f"{name}.state.json"), folder)
+
+    def checkpoint(self, name, **progress):
+        self.state[name].update(progress)
+        os.makedirs(self.folder, exist_ok=True)
+        # write then rename, so stopping mid-write never leaves a half written checkpoint
+        tmp = self.state_path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(self.state, f, indent=1)
+        os.replace(tmp, self.state_path)
+
+    def progress(self, job):
+        """
+        checkpoint of job, a fresh one if it was never run or its settings changed since
+        """
+        progress = self.state.get(job["name"])
+        if progress is not None and progress["job"] != job:
+            print(f"job {job['name']} changed since it was last run, starting it over")
+            progress = None
+        if progress is None:
+            self.state[job["name"]] = {"job": job, "status": "pending", "trace_run": None}
+        return self.state[job["name"]]
+
+    def run(self):
+        """
+        runs every job that isn't done yet, returns their reports
+        """
+        reports = []
+        t0 = time.monotonic()
+        for i, job in enumerate(self.jobs):
+            if self.progress(job)["status"] == "done":
+                print(f"job {i + 1}/{len(self.jobs)} {job['name']} already done, skipping")
+                continue
+            print(f"job {i + 1}/{len(self.jobs)} {job['name']}")
+            reports.append(self.run_job(job, t0))
+        self.report(reports, time.monotonic() - t0)
+        return reports
+
+    def run_job(self, job, t0):
+        """
+        moves to the job's origin, traces (unless skipped or already done) and sweeps, returns the job report
+        t0: start of the queue, report times are relative to it
+        """
+        kuka = self.kuka
+        name = job["name"]
+        progress = self.state[name]
+        report = {"name": name, "job": job, "started": time.monotonic() - t0,
+                  "date": datetime.datetime.now().isoformat(timespec="seconds"), "times": {}}
+        n_moves = kuka.n_moves
+        tracer.reset()
+        try:
+            self.move_to_origin(job["origin"])
+            kuka.prefix = name
+            kuka.n_sweep_points = job["n_sweep_points"]
+            kuka.surface_run = None
+            kuka.timeline = None
+
+            run_id = progress["trace_run"]
+            if run_id is None and job["skip_trace"] and job["register"]:
+                t = time.monotonic()
+                run_id = kuka.register(job["surface_run"])
+                report["times"]["register"] = time.monotonic() - t
+                report["registration"] = kuka.registration.to_dict()
+                if run_id is not None:
+                    self.checkpoint(name, status="traced", trace_run=run_id)
+            elif run_id is None and job["skip_trace"]:
+                run_id = job["surface_run"]
+            if run_id is None and (not job["skip_trace"] or job["register"]):
+                t = time.monotonic()
+                run_id = self.trace(job)
+                report["times"]["trace"] = time.monotonic() - t
+                self.checkpoint(name, status="traced", trace_run=run_id)
+
+            if job["n_sweep_points"] > 0:
+                t = time.monotonic()
+                kuka.sweep(run_id)
+                report["times"]["sweep"] = time.monotonic() - t
+                report["timeline"] = kuka.timeline.summary()
+                run_id = kuka.surface_run
+            status = "done"
+        except Exception as e:
+            traceback.print_exc()
+            print(f"job {name} failed: {e!r}, going on with the next job")
+            report["error"] = repr(e)
+            status = "failed"
+
+        report["status"] = status
+        report["finished"] = time.monotonic() - t0
+        report["surface_run"] = run_id if status == "done" else progress["trace_run"]
+        report["n_points"] = self.n_points(report["surface_run"])
+        report["n_moves"] = kuka.n_moves - n_moves
+        if tracer.enabled:
+            report["instrumentation"] = tracer.summary()
+            tracer.save(f"job_{name}")
+        self.checkpoint(name, status=status)
+        self.save_report(report)
+        return report
+
+    def move_to_origin(self, origin):
+        """
+        to the job's (0, 0) and down to z=0 where trace and sweep start, crossing over from another sample's origin
+        at job_travel_height (or higher if kuka already is) so the probe clears whatever is mounted in between
+        """
+        kuka = self.kuka
+        if tuple(origin) != tuple(kuka.origin):
+            travel = max(kuka.position[2], job_travel_height)
+            kuka.async_move(*kuka.position[:2], travel)
+            kuka.set_origin(*origin)
+            kuka.async_move(0, 0, travel)
+        if list(kuka.position) != [0, 0, 0]:
+            kuka.async_move(0, 0, 0)
+
+    def trace(self, job):
+        if job["trace_mode"] == "scan":
+            return self.kuka.scan(job["xspan"], job["yspan"], job["d"])
+        if job["trace_mode"] == "hybrid":
+            return self.kuka.hybrid_scan(job["xspan"], job["yspan"], job["d"])
+        return self.kuka.trace(job["xspan"], job["yspan"], job["d"], adaptive=job["trace_mode"] == "adaptive")
+
+    @staticmethod
+    def n_points(run_id):
+        if run_id is None:
+            return None
+        run = SurfaceStore().index["runs"].get(run_id)
+        return run["n_points"] if run is not None else None
+
+    def save_report(self, report):
+        os.makedirs(self.folder, exist_ok=True)
+        path = os.path.join(self.folder, f"{report['name']}.json")
+        with open(path, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"saved job report to {path}")
+
+    def report(self, reports, wall):
+        print(f"{'job':>16} {'status':>8} {'points':>7} {'trace':>8} {'sweep':>8} {'gap':>7} [s]")
+        previous = None
+        for report in reports:
+            times = report["times"]
+            # robot time between the end of one job and the start of the next
+            gap = report["started"] - previous if previous is not None else 0.
+            previous = report["finished"]
+            print(f"{report['name']:>16} {report['status']:>8} {report['n_points'] or '-':>7} "
+                  + " ".join(f"{times[k]:8.1f}" if k in times else "       -" for k in ("trace", "sweep"))
+                  + f" {gap:7.3f}")
+        n_done = sum(report["status"] == "done" for report in reports)
+        print(f"{n_done}/{len(reports)} jobs done in {wall:.1f}s, checkpoint in {self.state_path}")
+
+
+if __name__ == "__main__":
+    path = sys.argv[1] if len(sys.argv) > 1 else jobs_file
+    jobs = load_jobs(path)
+    print(f"{len(jobs)} jobs in {path}: " + ", ".join(job["name"] for job in jobs))
+
+    g_state = GlobalState()
+    kuka = Kuka(g_state)
+    labview = LabviewTCP(g_state)
+    receive_labview_data = Thread(target=labview.receive_data)
+    try:
+        receive_labview_data.start()
+        if move_model_calibrate:
+            print("calibrating move times")
+            kuka.calibrate_motion()
+        JobQueue.from_file(kuka, path).run()
+    finally:
+        kuka.disconnect()
+        g_state.end_labview_connection = True
@@ -1,31 +1,106 @@
 import socket
-from threading import Thread
+from threading import Lock
 import time
-import datetime
 import numpy as np
 import os
-import csv
 
-from config import xspan, yspan, d, zspan, dz, encoder_value_delta_threshold
-from config import n_sweep_points
-from config import KUKA_HOST, KUKA_PORT
+from config import xspan, yspan, d, zspan, encoder_value_delta_threshold
+from config import sweep_min_spacing
+from config import n_sweep_points, sweep_selection, sweep_optimize_order, sweep_clearance, sweep_pipeline
+from config import predict_start, trace_resume, trace_resume_max_age
+from config import trace_mode, adaptive_d_coarse, adaptive_d_min, adaptive_tolerance
+from config import scan_preload, scan_encoder_latency, scan_segment, scan_max_deflection, scan_recenter
+from config import KUKA_HOST, KUKA_PORT, kuka_move_ack, kuka_move_timeout, kuka_path_command
+from config import encoder_fresh_timeout, record_settle, settle_timeout, move_model_file, use_robot_link
 from global_state import GlobalState
+from instrumentation import tracer
+from labview_stream import SettlingDetector
+from probing import make_probe, measure_point_moves, move_steps
+from prediction import StartHeightPredictor
+from motion import MoveTimeModel, calibration_steps
+from robot_link import connect_link
+from scanning import serpentine_rows, trace_points, samples_to_profile, step_along, first_out_of_range
+from scanning import profile_slope, segment_length
+from adaptive import AdaptiveGrid
+from surface_store import SurfaceStore
+from surface_model import load_model
+from registration import probe_points, fit
+from sweep_selection import point_features, score_points, select_points
+from sweep_planning import ClearancePlanner, sweep_order, travel_costs, tour_length, report_travel
+from sweep_timeline import SweepTimeline
+
+
+def record_height(z, e0, encoder_value):
+    """
+    surface height from the robot z and how far the VCA is pushed in, clipped to zspan
+    """
+    encoder_deflection = (e0 - encoder_value) / 1000
+    print(f"{encoder_deflection = }")
+    z_record = z + encoder_deflection
+    if abs(z_record) > zspan:
+        z_record = zspan * np.sign(z_record)
+    return z_record
 
 
 class Kuka:
-    def __init__(self, g_state: GlobalState, no_connect = False):
+    def __init__(self, g_state: GlobalState, no_connect = False, host = KUKA_HOST, port = KUKA_PORT, link = use_robot_link):
         self.g_state = g_state
+        self.host = host
+        self.port = port
+        self.link = link  # attach to robot_link.py instead of connecting to kuka
+        self.position = [0, 0, 0]
+
+        # moves sent to kuka that have not been acknowledged with "reached" yet
+        self.move_ack = kuka_move_ack
+        self.use_path = kuka_path_command  # send move_path as one "path" message
+        self.pending_acks = 0
+        self.recv_buffer = b""
+        # {waypoint index: time "reached i" was received} for the last move_path
+        self.waypoint_reports = {}
+
+        # where the time goes, for benchmark.py
+        self.n_moves = 0
+        self.time_sleeping = 0.  # fixed sleeps
+        self.time_network = 0.   # waiting for "reached" from kuka
+        self.time_labview = 0.   # waiting for encoder values / labview_state
+        self.last_move_time = None  # [s] move sent -> "reached" of the last acknowledged move, for motion.py
+        # [s] how long a sweep waits for labview to report a sweep state, None: until someone switches it over
+        self.labview_state_timeout = 30
+
+        # sweep pipelining: the path to the next sweep point, sent the moment labview reports "finished" (see fire_path)
+        self.armed_path = None
+        self.armed_lock = Lock()
+        self.sweep_n = None      # index of the sweep point kuka is at / moving to
+        self.timeline = None     # SweepTimeline of the current / last sweep
+
+        # per sample settings, jobs.py changes them between samples
+        self.prefix = "surface_data"  # surface store prefix traces are saved under and sweeps load from
+        self.origin = (0, 0)          # [mm] added to x, y of every move sent, trace / sweep coordinates stay relative to it
+        self.n_sweep_points = n_sweep_points
+        self.surface_run = None       # run id the sweep loaded, its surface model is used for picking points
+        self.registration = None      # Registration of the last register()
+
+        self.probe = make_probe()
+        self.settling = SettlingDetector()
+        self.predictor = StartHeightPredictor() if predict_start else None
+        self.spacing = None  # [mm] trace grid spacing around the point being measured, None: d from config.py
+        self.motion = MoveTimeModel.load()
 
         if no_connect:
             return
 
         self.connect()
-        self.position = [0, 0, 0]
 
     def connect(self):
-        self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self.socket.connect((KUKA_HOST, KUKA_PORT))
-        print(f"Connected to KUKA robot at {KUKA_HOST}:{KUKA_PORT}")
+        if self.link:
+            # "exit" in disconnect only detaches from the daemon, the kuka program keeps running
+            self.socket = connect_link("kuka")
+            print("Connected to KUKA robot through the robot link")
+        else:
+            self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            self.socket.connect((self.host, self.port))
+            self.socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            print(f"Connected to KUKA robot at {self.host}:{self.port}")
         self.g_state.kuka_connected = True
         self.g_state.kuka_state = "idle"
 
@@ -37,187 +112,743 @@ class Kuka:
             self.g_state.kuka_connected = False
             self.g_state.kuka_state = None
 
-    def async_move(self, x: int, y: int, z: int, waiting_time=.5):
-        cmd = f"move {x} {y} {z}"
+    def send_command(self, cmd):
         self.socket.sendall((cmd + "\n").encode())
-        self.position = [x, y, z]
-        time.sleep(waiting_time)
+
+    def run_steps(self, steps):
+        """
+        runs a workflow written as a generator of steps and returns its result
+        a step is (method name, *args): the method is called on self, its result is sent back into the generator
+        and anything it raises is thrown into it
+        the workflows (async_move, trace, sweep, ...) are only written once, as the *_steps generators,
+        engine.AsyncKuka runs the same generators awaiting every step instead
+        """
+        try:
+            step = next(steps)
+            while True:
+                name, *args = step
+                try:
+                    result = getattr(self, name)(*args)
+                except BaseException as e:
+                    step = steps.throw(e)
+                else:
+                    step = steps.send(result)
+        except StopIteration as stop:
+            return stop.value
+
+    def async_move(self, x: int, y: int, z: int, waiting_time=None, fixed_wait=.5):
+        """
+        send a move and wait for kuka to report "reached"
+        when move_ack is off it sleeps waiting_time instead, by default the move time estimated by self.motion
+        (at least fixed_wait, the old fixed sleep for this move, while self.motion isn't calibrated)
+        """
+        return self.run_steps(self.async_move_steps(x, y, z, waiting_time, fixed_wait))
+
+    def async_move_steps(self, x, y, z, waiting_time=None, fixed_wait=.5):
+        with tracer.span("move", x=x, y=y, z=z):
+            duration = self.motion.duration(np.linalg.norm(np.subtract([x, y, z], self.position)))
+            t_sent = time.perf_counter()
+            yield ("send_command", f"move {x + self.origin[0]} {y + self.origin[1]} {z}")
+            self.position = [x, y, z]
+            self.n_moves += 1
+
+            if self.move_ack:
+                self.pending_acks += 1
+                yield ("wait_for_reached", self.motion.timeout(duration))
+                self.last_move_time = time.perf_counter() - t_sent
+                yield ("wait_for_fresh_encoder", time.monotonic())
+            else:
+                yield ("sleep", self.motion.wait(duration, fixed_wait) if waiting_time is None else waiting_time)
+
+    def calibrate_motion(self, path=move_model_file):
+        """
+        measures how long moves take and fits self.motion to them (see motion.py)
+        """
+        return self.run_steps(calibration_steps(self, path))
+
+    def set_origin(self, x, y):
+        """
+        moves the coordinate origin of the following moves to x, y [mm] in kuka's frame (nothing is sent),
+        self.position is shifted with it so it still says where kuka is
+        """
+        ox, oy = self.origin
+        self.position = [self.position[0] + ox - x, self.position[1] + oy - y, self.position[2]]
+        self.origin = (x, y)
+
+    def sleep(self, seconds):
+        t0 = time.perf_counter()
+        time.sleep(seconds)
+        self.time_sleeping += time.perf_counter() - t0
+
+    def wait_for_labview(self, predicate, timeout=None, name="labview wait"):
+        """
+        g_state.wait_for, counted in time_labview and timed as a span called name
+        """
+        t0 = time.perf_counter()
+        try:
+            with tracer.span(name, "labview"):
+                return self.g_state.wait_for(predicate, timeout)
+        finally:
+            self.time_labview += time.perf_counter() - t0
+
+    def wait_for_fresh_encoder(self, t0, timeout=encoder_fresh_timeout):
+        """
+        right after "reached" encoder_value can still be from before the move ended,
+        so wait for a sample received after t0 (if labview is streaming at all)
+        """
+        return self.run_steps(self.wait_for_fresh_encoder_steps(t0, timeout))
+
+    def wait_for_fresh_encoder_steps(self, t0, timeout=encoder_fresh_timeout):
+        if not self.g_state.labview_connected:
+            return True
+        return (yield ("wait_for_labview", lambda s: (s.encoder_buffer.last_time() or 0) > t0, timeout, "fresh encoder"))
+
+    def read_settled_encoder(self, t0, timeout=settle_timeout):
+        """
+        encoder_value to record once the VCA is in contact: waits until the samples received after t0 have settled
+        and returns their mean, after timeout the mean of the newest samples instead
+        with record_settle off (or no sample stream) it's the old fixed 1s wait and a single encoder_value
+        """
+        return self.run_steps(self.read_settled_encoder_steps(t0, timeout))
+
+    def read_settled_encoder_steps(self, t0, timeout=settle_timeout):
+        if not record_settle or not self.g_state.labview_connected:
+            yield ("sleep", 1)
+            return self.g_state.encoder_value
+
+        buffer = self.g_state.encoder_buffer
+        yield ("wait_for_labview", lambda s: self.settling.settled_value(buffer, t0) is not None, timeout, "settle")
+        value = self.settling.settled_value(buffer, t0)
+        if value is None:
+            noise = self.settling.noise(buffer, t0)
+            print(f"encoder didn't settle within {timeout}s, recording the newest samples"
+                  + (f" (std {noise:.1f}nm, settle_tolerance is {self.settling.tolerance}nm)" if noise is not None else ""))
+            value = self.settling.fallback_value(buffer, t0)
+        if value is None:
+            value = self.g_state.encoder_value
+        return value
+
+    def wait_for_reached(self, timeout=kuka_move_timeout):
+        """
+        block until every pending move has been acknowledged
+        raises TimeoutError after timeout, kuka is not where the next move assumes it is
+        """
+        return self.run_steps(self.wait_for_reached_steps(timeout))
+
+    def wait_for_reached_steps(self, timeout=kuka_move_timeout):
+        t0 = time.perf_counter()
+        deadline = time.monotonic() + timeout
+        try:
+            with tracer.span("kuka reached"):
+                while self.pending_acks > 0:
+                    line = yield ("read_line", deadline)
+                    if line is None:
+                        raise TimeoutError(f"no \"reached\" from kuka after {timeout}s ({self.pending_acks} moves pending)")
+                    self.handle_reply(line)
+        finally:
+            self.time_network += time.perf_counter() - t0
+
+    def handle_reply(self, line):
+        """
+        "reached" ends a move or path, "reached i" marks a dwell waypoint of the current path
+        """
+        parts = line.split()
+        if parts == ["reached"]:
+            self.pending_acks -= 1
+        elif len(parts) == 2 and parts[0] == "reached" and parts[1].isdigit():
+            self.waypoint_reports[int(parts[1])] = time.monotonic()
+        else:
+            print(f"kuka message not recognized: {line=}")
+
+    def path_command(self, waypoints):
+        """
+        waypoints: (x, y, z) or (x, y, z, dwell) each
+        returns the "path n x y z dwell ..." message and the waypoints padded to 4 values
+        """
+        waypoints = [tuple(w) + (0,) * (4 - len(w)) for w in waypoints]
+        ox, oy = self.origin
+        values = " ".join(f"{x + ox} {y + oy} {z} {dwell}" for x, y, z, dwell in waypoints)
+        return f"path {len(waypoints)} {values}", waypoints
+
+    def move_path(self, waypoints, waiting_time=None, fixed_wait=.5):
+        """
+        sends all waypoints in one message so kuka runs them back to back, without a wifi round trip per move
+        kuka stops for dwell seconds at waypoints with dwell > 0 and reports "reached i" when it gets there,
+        so encoder values for those points can be read from g_state.encoder_buffer afterwards
+        returns {waypoint index: time "reached i" was received}
+        waiting_time is per waypoint, only used when kuka_move_ack and use_path are off (None: estimated, see async_move)
+        """
+        return self.run_steps(self.move_path_steps(waypoints, waiting_time, fixed_wait))
+
+    def move_path_steps(self, waypoints, waiting_time=None, fixed_wait=.5):
+        cmd, waypoints = self.path_command(waypoints)
+        self.waypoint_reports = {}
+        if not self.use_path:
+            for i, (x, y, z, dwell) in enumerate(waypoints):
+                yield ("async_move", x, y, z, waiting_time, fixed_wait)
+                if dwell > 0:
+                    self.waypoint_reports[i] = time.monotonic()
+                    yield ("sleep", dwell)
+            return self.waypoint_reports
+
+        assert self.move_ack, "move_path needs kuka_move_ack to know when the path ends"
+        with tracer.span("path", waypoints=len(waypoints)):
+            duration = self.motion.path_duration(self.position, waypoints)
+            yield ("send_command", cmd)
+            self.position = list(waypoints[-1][:3])
+            self.n_moves += len(waypoints)
+            self.pending_acks += 1
+            yield from self.wait_for_path_steps(self.motion.timeout(duration, len(waypoints)))
+            yield ("wait_for_fresh_encoder", time.monotonic())
+
+        return self.waypoint_reports
+
+    def wait_for_path_steps(self, timeout):
+        """
+        wait_for_reached for a "path" message, a kuka program without the path command never answers it
+        """
+        try:
+            yield ("wait_for_reached", timeout)
+        except TimeoutError as e:
+            raise TimeoutError(f"kuka didn't finish a path within {timeout}s, if its program doesn't implement "
+                               f"\"path\" set kuka_path_command = False in config.py") from e
+
+    def read_line(self, deadline):
+        """
+        returns the next newline terminated message from kuka, or None if deadline passes first
+        """
+        while b"\n" not in self.recv_buffer:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return None
+            self.socket.settimeout(remaining)
+            try:
+                data = self.socket.recv(1024)
+            except socket.timeout:
+                return None
+            finally:
+                self.socket.settimeout(None)
+            if not data:
+                raise ConnectionError("kuka closed the connection")
+            self.recv_buffer += data
+
+        line, self.recv_buffer = self.recv_buffer.split(b"\n", 1)
+        return line.decode().strip().lower()
+
+    def in_contact(self, e0):
+        return abs(e0 - self.g_state.encoder_value) >= encoder_value_delta_threshold
 
     def wait_for_encoder_data(self):
+        return self.run_steps(self.wait_for_encoder_data_steps())
+
+    def wait_for_encoder_data_steps(self):
         self.g_state.encoder_value = None
 
-        while not self.g_state.labview_connected:
-            time.sleep(1)
+        yield ("wait_for_labview", lambda s: s.labview_connected)
 
         # wait for encoder_value to update to confirm labview comms are working
         print("waiting for encoder_value data stream...")
-        for _ in range(30):
-            if self.g_state.encoder_value is not None:
-                break
-            else:
-                time.sleep(1)
-        if self.g_state.encoder_value is None:
+        if not (yield ("wait_for_labview", lambda s: s.encoder_value is not None, 30)):
             print("encoder_value is not set. terminating connection to kuka")
-            self.disconnect()
-            return
-        else:
-            print("encoder_value is being updated properly.")
-
-        return
+            yield ("disconnect",)
+            raise ConnectionError("no encoder_value from labview")
+        print("encoder_value is being updated properly.")
 
     def wait_for_labview_state_data(self):
-        while not self.g_state.labview_connected:
-            time.sleep(1)
+        return self.run_steps(self.wait_for_labview_state_data_steps())
 
-        # wait for encoder_value to update to confirm labview comms are working
-        print("waiting for labview_state data stream...")
-        for _ in range(30):
-            if self.g_state.labview_state in ("finished", "start", "sweeping"):
-                break
-            else:
-                time.sleep(1)
-        if self.g_state.encoder_value is None:
+    def wait_for_labview_state_data_steps(self):
+        yield ("wait_for_labview", lambda s: s.labview_connected)
+
+        # wait for labview_state to update to confirm labview comms are working
+        if self.labview_state_timeout is None:
+            print("waiting for labview to be switched to sweep mode...")
+        else:
+            print("waiting for labview_state data stream...")
+        if not (yield ("wait_for_labview", lambda s: s.labview_state in ("finished", "start", "sweeping"),
+                       self.labview_state_timeout)):
             print("labview_state is not set. terminating connection to kuka")
-            self.disconnect()
-            return
+            yield ("disconnect",)
+            raise ConnectionError("no labview_state from labview")
+        print("labview_state is being updated properly.")
+
+    def measure_point(self, x, y, positions):
+        """
+        moves to x,y and probes down to the surface, starting just above the predicted surface if possible
+        returns (z, e0) from the probe
+        """
+        return self.run_steps(self.measure_point_steps(x, y, positions))
+
+    def measure_point_steps(self, x, y, positions):
+        with tracer.span("measure point", "probe", x=x, y=y):
+            return (yield from move_steps(measure_point_moves(self, x, y, positions)))
+
+    def open_trace_writer(self, grid):
+        """
+        RunWriter that journals every recorded point to surface_data/ as soon as it is measured
+        with trace_resume on, continues the last interrupted run with the same grid instead of starting a new one,
+        if its last point was recorded less than trace_resume_max_age ago
+        """
+        store = SurfaceStore()
+        run_id = store.interrupted(self.prefix, grid, trace_resume_max_age * 3600) if trace_resume else None
+        if run_id is None:
+            return store.begin_run(self.prefix, grid)
+
+        writer = store.resume_run(run_id)
+        print(f"resuming interrupted trace {run_id} at grid index {writer.next_index} ({len(writer.positions)} points recorded)")
+        return writer
+
+    def trace(self, xspan=xspan, yspan=yspan, d=d, adaptive=trace_mode == "adaptive"):
+        return self.run_steps(self.trace_steps(xspan, yspan, d, adaptive))
+
+    def trace_steps(self, xspan, yspan, d, adaptive):
+        self.g_state.kuka_state = "trace"
+        yield ("wait_for_encoder_data",)
+
+        grid = {"trace_mode": "adaptive" if adaptive else "probe", "xspan": xspan, "yspan": yspan, "d": d,
+                "probe": type(self.probe).__name__}
+        if adaptive:
+            grid.update(d_coarse=adaptive_d_coarse, d_min=adaptive_d_min, tolerance=adaptive_tolerance)
+        writer = self.open_trace_writer(grid)
+        positions = writer.positions
+        if adaptive:
+            adaptive_grid = AdaptiveGrid(xspan, yspan)
+            points = adaptive_grid.points(positions)
         else:
-            print("labview_state is being updated properly.")
+            points = trace_points(xspan, yspan, d)
+        try:
+            for i, (x, y) in enumerate(points):
+                if i < writer.next_index:
+                    continue
+                self.spacing = adaptive_grid.spacing if adaptive else d
+                print(f"moving to next point: {x}, {y} (x={x}/{xspan})")
+                z, e0 = yield ("measure_point", x, y, positions)
 
-        return
+                print("recording surface data")
+                with tracer.span("record", x=x, y=y):
+                    encoder_value = yield ("read_settled_encoder", time.monotonic())
+                    z_record = record_height(z, e0, encoder_value)
+                    print(f"record: {x},{y},{z_record}")
+                    writer.append(i, x, y, z_record, e0, encoder_value)
 
-    def trace(self):
-        self.g_state.kuka_state = "trace"
-        self.wait_for_encoder_data()
+                print("moving back up to z0")
+                yield ("async_move", x, y, 0, None, 1)
+        except BaseException:
+            writer.close()
+            raise
+        finally:
+            self.spacing = None
 
-        x = 0
-        y = 0
-        dy = d
-        assert yspan == 0 or dy > yspan
-        dx = d
-        positions = []
+        print(f"trace complete. {len(positions)} points, {xspan=}, {yspan=}")
+        run_id = writer.finish()
+        print(f"saved {self.prefix} as {run_id} in {os.getcwd()}")
+        yield ("async_move", 0, 0, 0, None, 5)
+        self.g_state.kuka_state = "trace done"
 
-        while x <= xspan: 
-            while y >= 0 and y <= yspan:
-                print(f"moving to next point: {x}, {y}")
-                self.async_move(x, y, 0)
+        return run_id
 
-                print(f"moving down to contact surface")
-                e0 = self.g_state.encoder_value
-                z = 0
-                while abs(e0 - self.g_state.encoder_value) < encoder_value_delta_threshold and abs(z) < zspan:
-                    z -= dz 
-                    self.async_move(x, y, z)
 
-                print("recording surface data")
-                time.sleep(1)
-                encoder_deflection = (e0 - self.g_state.encoder_value) / 1000
-                print(f"{encoder_deflection = }")
-                z_record = z + encoder_deflection
-                if abs(z_record) > zspan:
-                    z_record = zspan * np.sign(z_record)
-                print(f"record: {x},{y},{z_record}")
-                positions.append([x,y,z_record])
+    def register(self, run_id=None):
+        """
+        probes a few points of a stored trace (run_id, the most recent one with self.prefix if None) where they were,
+        fits how the sample moved since (registration.py) and saves the stored surface moved to match as a new run
+        returns the new run id, None if the fit is off by more than registration_tolerance (the sample needs a trace)
+        """
+        return self.run_steps(self.register_steps(run_id))
 
-                print("moving back up to z0")
-                self.async_move(x, y, 0, waiting_time = 1)
+    def register_steps(self, run_id):
+        stored = np.asarray(self.load_data(run_id=run_id))
+        self.g_state.kuka_state = "trace"
+        yield ("wait_for_encoder_data",)
+
+        probes = []
+        for x, y in probe_points(stored):
+            print(f"registration probe at {x}, {y}")
+            z, e0 = yield ("measure_point", x, y, probes)
+            with tracer.span("record", x=x, y=y):
+                z_record = record_height(z, e0, (yield ("read_settled_encoder", time.monotonic())))
+            probes.append([x, y, z_record])
+            yield ("async_move", x, y, 0, None, 1)
+        yield ("async_move", 0, 0, 0, None, 5)
+
+        run_id = self.save_registration(stored, probes)
+        self.g_state.kuka_state = "trace done"
+        return run_id
+
+    def save_registration(self, stored, probes):
+        """
+        fits the surface model of self.surface_run to the probes, saves stored moved by the fit if it is good enough
+        """
+        source = self.surface_run
+        self.registration = fit(self.load_surface_model(), probes)
+        print(f"registered {source} to {len(probes)} probes: {self.registration}")
+        problem = self.registration.problem()
+        if problem is not None:
+            print(f"{problem}, the sample has to be traced again")
+            return None
+        return self.save_data(self.registration.apply(stored),
+                              grid={"registered_from": source, **self.registration.to_dict()})
+
+    def scan(self, xspan=xspan, yspan=yspan, d=d):
+        """
+        continuous version of trace: probe the start of each row, press the VCA scan_preload further in,
+        then do the whole row as one move while recording every encoder sample labview sends
+        """
+        return self.run_steps(self.scan_steps(xspan, yspan, d))
+
+    def scan_steps(self, xspan, yspan, d):
+        assert self.move_ack, "scan needs kuka_move_ack to know when each row move ends"
+        self.g_state.kuka_state = "trace"
+        yield ("wait_for_encoder_data",)
 
-                if yspan > 0:
-                    y += dy
-                else:
+        positions = []
+        for start, end in serpentine_rows(xspan, yspan, d):
+            print(f"scanning row {start} -> {end}")
+            z, e0 = yield ("measure_point", *start, positions)
+            z_row = max(z - scan_preload, -zspan)
+            yield ("async_move", *start, z_row)
+
+            t_start = time.monotonic()
+            yield ("async_move", *end, z_row)
+            t_end = time.monotonic()
+            samples = self.g_state.encoder_buffer.since(t_start + scan_encoder_latency)
+            samples[:, 0] -= scan_encoder_latency
+
+            profile = samples_to_profile(samples, t_start, t_end, start, end, z_row, e0,
+                                         min_deflection=encoder_value_delta_threshold / 1000)
+            print(f"recorded {len(profile)}/{len(samples)} samples in contact, {t_end - t_start:.2f}s")
+            positions.extend(profile.tolist())
+
+            print("moving back up to z0")
+            yield ("async_move", *end, 0)
+
+        print(f"scan complete. {len(positions)} points")
+        run_id = self.save_data(positions, grid={"trace_mode": "scan", "xspan": xspan, "yspan": yspan, "d": d,
+                                                 "scan_preload": scan_preload})
+        yield ("async_move", 0, 0, 0)
+        self.g_state.kuka_state = "trace done"
+
+        return run_id
+
+    def hybrid_scan(self, xspan=xspan, yspan=yspan, d=d):
+        """
+        constant height scan with fallback probing: rows are scanned in scan_segment long moves with the VCA pressed in,
+        every encoder sample is a point at z + encoder deflection (like scan / slow_sweep.py, no descent per point)
+        between segments z follows the surface so the VCA stays near scan_preload, and when it left its usable range
+        during a segment (lost contact, or saturated past scan_max_deflection) kuka lifts, probes the surface where that
+        happened and carries on from there; if it leaves range again right away that point is probed and recorded
+        like trace does and the row goes on d further
+        """
+        return self.run_steps(self.hybrid_scan_steps(xspan, yspan, d))
+
+    def hybrid_scan_steps(self, xspan, yspan, d):
+        assert self.move_ack, "hybrid scan needs kuka_move_ack to know when each segment move ends"
+        self.g_state.kuka_state = "trace"
+        yield ("wait_for_encoder_data",)
+
+        min_deflection = encoder_value_delta_threshold / 1000
+        positions = []
+        n_rehomes = n_probed = 0
+        for start, end in serpentine_rows(xspan, yspan, d):
+            print(f"scanning row {start} -> {end}")
+            x, y = start
+            z_row = None  # None: re-home (probe the surface at x, y) before the next segment
+            slope = None  # [mm/mm] surface rise along the row at the end of the last segment
+            while True:
+                if z_row is None:
+                    z_surface, e0 = yield ("measure_point", x, y, positions)
+                    z_row = max(z_surface - scan_preload, -zspan)
+                    yield ("async_move", x, y, z_row)
+                    n_rehomes += 1
+
+                # kuka can't be stopped mid move, so the segment ends before the VCA runs out of travel at this slope
+                length = segment_length(z_surface - z_row, slope, min_deflection, scan_max_deflection, shortest=d)
+                x1, y1 = step_along((x, y), end, length)
+                t_start = time.monotonic()
+                yield ("async_move", x1, y1, z_row)
+                t_end = time.monotonic()
+                samples = self.g_state.encoder_buffer.since(t_start + scan_encoder_latency)
+                samples[:, 0] -= scan_encoder_latency
+                # every sample, so a VCA hanging free (deflection below min_deflection) ends the segment where it starts
+                profile = samples_to_profile(samples, t_start, t_end, (x, y), (x1, y1), z_row, e0, motion=self.motion)
+                i_out = first_out_of_range(profile[:, 2] - z_row, min_deflection, scan_max_deflection)
+
+                if i_out is None:
+                    positions.extend(profile.tolist())
+                    if (x1, y1) == tuple(end):
+                        break
+                    x, y = x1, y1
+                    if len(profile):
+                        z_surface = profile[-1, 2]
+                        slope = profile_slope(profile, scan_segment / 2)
+                    if abs(z_surface - scan_preload - z_row) > scan_recenter:
+                        z_row = max(z_surface - scan_preload, -zspan)
+                        yield ("async_move", x, y, z_row)
+                    continue
+
+                positions.extend(profile[:i_out].tolist())
+                slope = profile_slope(profile[:i_out + 1], scan_segment / 2)
+                x_out, y_out = (float(v) for v in profile[i_out, :2])
+                print(f"VCA out of range at {x_out:.2f}, {y_out:.2f}, re-homing z there")
+                yield ("async_move", x1, y1, 0)
+                z_row = None
+                if np.hypot(x_out - x, y_out - y) >= d:
+                    x, y = x_out, y_out
+                    continue
+
+                # out of range right where the segment started, probe this point instead of scanning it
+                z, e0 = yield ("measure_point", x, y, positions)
+                with tracer.span("record", x=x, y=y):
+                    positions.append([x, y, record_height(z, e0, (yield ("read_settled_encoder", time.monotonic())))])
+                n_probed += 1
+                yield ("async_move", x, y, 0)
+                if (x, y) == tuple(end):
                     break
+                x, y = step_along((x, y), end, d)
 
-            x += dx
-            print(f"x={x}/{xspan}")
-            dy *= -1
+            print("moving back up to z0")
+            yield ("async_move", *self.position[:2], 0)
 
-        print(f"trace complete. {x=}, {xspan=}, {y=}, {yspan=}")
-        self.save_data(positions)
-        self.async_move(0, 0, 0, waiting_time=5)
+        print(f"hybrid scan complete. {len(positions)} points, {n_rehomes} re-homes, {n_probed} points probed")
+        run_id = self.save_data(positions, grid={"trace_mode": "hybrid", "xspan": xspan, "yspan": yspan, "d": d,
+                                                 "scan_preload": scan_preload, "scan_segment": scan_segment,
+                                                 "scan_max_deflection": scan_max_deflection})
+        yield ("async_move", 0, 0, 0)
         self.g_state.kuka_state = "trace done"
-        self.g_state.encoder_data = None
 
-        return
+        return run_id
 
+    def sweep(self, run_id=None):
+        """
+        sweeps the points picked from run_id (the most recent trace with self.prefix if None)
+        """
+        return self.run_steps(self.sweep_steps(run_id))
 
-    def sweep(self):
-        positions = self.load_data()
+    def sweep_steps(self, run_id):
+        positions = self.load_data(run_id=run_id)
         x, y, z = self.position
         assert x==0 and y==0 and z <= 0
         self.g_state.kuka_state = "sweep"
-        self.wait_for_labview_state_data()
+        yield ("wait_for_labview_state_data",)
 
-        i_points = [int(i*(len(positions)-1)/(n_sweep_points-1)) for i in range(n_sweep_points)]
         z_offset = 50
         assert z_offset > 10
+        paths = self.sweep_paths(positions, z_offset)
+        n_points = len(paths) - 1
 
-        for n,i in enumerate(i_points):
-            x, y, z = positions[i]
-            if n > 0:
-                print(f"sweep point {n+1}/{len(i_points)}, moving kuka to {x}, {y}, {z}")
-                self.async_move(x, y, z_offset, waiting_time=1)
-            self.async_move(x, y, z, waiting_time=1)
-
-            print("waiting for labview to begin sweep")
-            while self.g_state.labview_state not in ("start", "sweeping"):
-                time.sleep(.1)
+        self.timeline = SweepTimeline()
+        self.g_state.add_listener(self.on_sweep_state)
+        try:
+            for n, path in enumerate(paths):
+                self.sweep_n = n
+                x, y, z = path[-1]
+                if n == n_points:
+                    print("moving back to starting position")
+                elif n == 0:
+                    print(f"sweep point 1/{n_points}, moving kuka to {x}, {y}, {z}")
+                else:
+                    print(f"sweep point {n+1}/{n_points}, moving kuka to {x}, {y}, {z} (transit at z={path[0][2]:.1f})")
+
+                if n == 0:
+                    self.timeline.mark(n, "move_sent")
+                    yield ("async_move", x, y, z, None, 1)
+                elif self.pipelined():
+                    # already sent by fire_path when the last sweep finished
+                    duration = self.motion.path_duration(paths[n - 1][-1], path)
+                    yield from self.wait_for_path_steps(self.motion.timeout(duration, len(path)))
+                else:
+                    self.timeline.mark(n, "move_sent")
+                    yield ("move_path", path, None, 1 if n < n_points else 2)
+                self.timeline.mark(n, "reached")
+                if n == n_points:
+                    break
 
-            print("waiting for labview to finish sweep...")
-            while self.g_state.labview_state != "finished":
-                time.sleep(.1)
+                self.g_state.sweep_ready = n
+                print("waiting for labview to begin sweep")
+                yield ("wait_for_labview", lambda s: s.labview_state in ("start", "sweeping"), None, "sweep start")
+                if self.pipelined():
+                    self.arm_path(paths[n + 1])
 
-            self.async_move(x, y, z_offset, waiting_time=1)
+                print("waiting for labview to finish sweep...")
+                yield ("wait_for_labview", lambda s: s.labview_state == "finished", None, "sweep")
+                self.fire_path()
+        finally:
+            self.g_state.remove_listener(self.on_sweep_state)
+            self.armed_path = None
+            self.sweep_n = None
+            self.g_state.sweep_ready = None
 
-        # move back to starting position
-        self.async_move(0, 0, z_offset, waiting_time = 2)
+        self.timeline.report()
         self.g_state.kuka_state = "sweep done"
 
         return
 
+    def sweep_paths(self, positions, z_offset):
+        """
+        every move of the sweep, computed before it starts: [(x, y, z)] to the first point,
+        then retract / transit / descend as one path to each of the others and finally back to (0, 0, z_offset)
+        """
+        plan = self.plan_sweep(positions, z_offset)
+        paths = []
+        x0, y0, _ = self.position
+        for n, (i, hop) in enumerate(plan):
+            x, y, z = (float(v) for v in positions[i])
+            if n == 0:
+                paths.append([(x, y, z)])
+            else:
+                paths.append([(x0, y0, hop), (x, y, hop), (x, y, z)])
+            x0, y0 = x, y
+        paths.append([(x0, y0, z_offset), (0, 0, z_offset)])
+        return paths
+
+    def pipelined(self):
+        """
+        sweep_pipeline needs the path command and "reached" acks, the path is sent from another thread and only
+        waited for here
+        """
+        return sweep_pipeline and self.use_path and self.move_ack
+
+    def arm_path(self, waypoints):
+        """
+        path to send the moment labview reports "finished"
+        """
+        with self.armed_lock:
+            self.armed_path = self.path_command(waypoints)
+
+    def fire_path(self):
+        """
+        sends the armed path if it hasn't gone out yet
+        called by on_sweep_state as soon as "finished" arrives (labview thread, no wait for this thread to wake up)
+        and by sweep once it sees "finished" itself, whichever comes first sends it
+        """
+        with self.armed_lock:
+            if self.armed_path is None:
+                return
+            cmd, waypoints = self.armed_path
+            self.armed_path = None
+            self.timeline.mark(self.sweep_n + 1, "move_sent")
+            self.waypoint_reports = {}
+            self.send_command(cmd)
+            self.position = list(waypoints[-1][:3])
+            self.n_moves += len(waypoints)
+            self.pending_acks += 1
+
+    def on_sweep_state(self, name, old, new):
+        """
+        g_state listener while sweeping: timestamps labview's state changes where they arrive and fires the armed path
+        """
+        n = self.sweep_n
+        if name != "labview_state" or new == old or n is None:
+            return
+        if new in ("start", "sweeping"):
+            self.timeline.mark(n, "start")
+        elif new == "finished" and self.timeline.has(n, "start"):
+            self.timeline.mark(n, "finished")
+            self.fire_path()
+
+
+    def sweep_points(self, positions):
+        """
+        indexes of the positions to sweep
+            "even": n_sweep_points evenly spaced through the trace
+            "features": the n_sweep_points best scoring for curvature / slope / height anomaly, sweep_min_spacing apart
+        """
+        if sweep_selection == "even":
+            n = self.n_sweep_points
+            return [int(i*(len(positions)-1)/(n-1)) for i in range(n)]
+        if sweep_selection != "features":
+            raise ValueError(f"unknown sweep_selection: {sweep_selection!r}, expected 'features' or 'even'")
+
+        features = point_features(self.load_surface_model(), positions)
+        scores = score_points(features)
+        i_points = select_points(positions, scores, self.n_sweep_points)
+        for i in i_points:
+            x, y, z = positions[i]
+            values = ", ".join(f"{name} {values[i]:.3g}" for name, values in features.items())
+            print(f"sweep point {x}, {y}, {z:.3f}: score {scores[i]:.2f} ({values})")
+        if len(i_points) < self.n_sweep_points:
+            print(f"only {len(i_points)} points are at least {sweep_min_spacing}mm apart, sweeping those")
+        return i_points
+
+    def plan_sweep(self, positions, z_offset):
+        """
+        sweep points as [(index into positions, transit height to get there from the previous point)] in visiting order
+        sweep_optimize_order: least travel order from where kuka is now to (0, 0, z_offset) at the end
+        sweep_clearance: transit heights just above the recorded surface (see ClearancePlanner), z_offset otherwise
+        the first point is moved to directly, its transit height is None
+        """
+        i_points = self.sweep_points(positions)
+        points = np.asarray(positions, dtype=float)[i_points]
+        n = len(points)
+        if sweep_clearance:
+            hops = ClearancePlanner(self.load_surface_model(), z_max=z_offset).hop_heights(points, points)
+        else:
+            hops = np.full((n, n), float(z_offset))
+
+        order = list(range(n))
+        if sweep_optimize_order:
+            order, before, after = sweep_order(points, self.position, (0, 0), z_offset, hops)
+            report_travel("least travel order", before, after)
+        if sweep_clearance:
+            before = tour_length(travel_costs(points, self.position, (0, 0), z_offset), order)
+            after = tour_length(travel_costs(points, self.position, (0, 0), z_offset, hops), order)
+            report_travel(f"transits above the surface instead of at {z_offset}mm", before, after)
+
+        return [(i_points[k], None if m == 0 else float(hops[order[m - 1], k])) for m, k in enumerate(order)]
+
+    def save_data(self, positions, prefix = None, grid = None):
+        """
+        adds the positions to the surface store in surface_data/ (see surface_store.py)
+        prefix: self.prefix if None
+        grid: trace params saved with them in the index
+        """
+        prefix = prefix or self.prefix
+        run_id = SurfaceStore().save(positions, prefix=prefix, grid=grid)
+        print(f"saved {prefix} as {run_id} in {os.getcwd()}")
+        return run_id
+
+    def load_data(self, prefix=None, run_id=None):
+        """
+        run_id (most recent run with prefix, self.prefix if None) from the surface store, as a read only (n, 3) array of x, y, z
+        csv files from before the store are imported the first time nothing is found
+        the run is remembered in self.surface_run for load_surface_model
+        """
+        prefix = prefix or self.prefix
+        store = SurfaceStore()
+        if run_id is None:
+            if store.latest(prefix) is None:
+                imported = store.import_folder()
+                if imported:
+                    print(f"imported {len(imported)} csv files into {store.index_path}")
+            run_id = store.latest(prefix)
+            if run_id is None:
+                raise FileNotFoundError(f"no {prefix} runs found")
+            print(f"loaded {prefix} from: {run_id}")
+        else:
+            print(f"loaded {run_id}")
+        self.surface_run = run_id
+        return store.load(run_id)
 
-    def save_data(self, positions, prefix = "surface_data"):
-        positions = np.array(positions)
-        epoch_time = time.time()
-        dt_object = datetime.datetime.fromtimestamp(epoch_time)
-        formatted_time = dt_object.strftime("%Y-%m-%d_%H-%M-%S")
-        filename = prefix + "_" + formatted_time
-        np.savetxt(f"surface_data/{filename}.csv", positions, delimiter=",", header="x,y,z", comments='', fmt="%.3f")
-        print(f"saved {prefix} in {os.getcwd()}")
-
-    def load_data(self, prefix="surface_data"):
-        csv_files = [
-            os.path.join("surface_data", f)
-            for f in os.listdir("surface_data")
-            if f.lower().endswith('.csv')
-            and os.path.isfile(os.path.join("surface_data", f))
-            and f.startswith(prefix)
-        ]
-        if not csv_files:
-            raise FileNotFoundError(f"no surface_data files found")
-
-        # Find the most recently modified CSV file
-        most_recent_file = max(csv_files, key=os.path.getmtime)
-        print(f"loaded {prefix} from: {most_recent_file}")
-
-        # Read the CSV file into a list of rows
-        with open(most_recent_file, mode='r', newline='', encoding='utf-8') as file:
-            reader = csv.reader(file)
-            data = list(reader)
-
-        positions = [[float(x), float(y), float(z)] for x,y,z in data[1:]]
-
-        return positions
+    def load_surface_model(self, prefix=None):
+        """
+        SurfaceModel (heightmap with z / normal / slope queries) of the run load_data loaded last,
+        or of the most recent run with prefix (self.prefix if None) if there is none
+        """
+        if self.surface_run is not None and prefix is None:
+            return load_model(run_id=self.surface_run)
+        return load_model(prefix=prefix or self.prefix)
 
 
 if __name__ == "__main__":
-    g_state = GlobalState
+    g_state = GlobalState()
 
     kuka = Kuka(g_state, no_connect=True)
     dummy_positions = []
     for i in range(400):
         dummy_positions.append([i, 2*i, 3*i])
-    kuka.save_data(dummy_positions, prefix="dummy_data")
-    positions = kuka.load_data(prefix="dummy_data")
-    kuka.sweep(positions)
+    run_id = kuka.save_data(dummy_positions, prefix="dummy_data")
+    print(f"saved {len(kuka.load_data(run_id=run_id))} points as {run_id}")
+    kuka.sweep(run_id)
 
 
     # kuka = Kuka(g_state)
@@ -1,18 +1,38 @@
 import socket
-from config import WIFI_HOST, WIFI_PORT, BUFFER_SIZE
+import time
+from config import WIFI_HOST, WIFI_PORT, labview_ready_signal, labview_mode_signal, use_robot_link, labview_framing
 from global_state import GlobalState
+from labview_stream import MessageParser
+from instrumentation import tracer
+from robot_link import connect_link
 
 class LabviewTCP:
-    def __init__(self, g_state: GlobalState):
+    def __init__(self, g_state: GlobalState, host = WIFI_HOST, port = WIFI_PORT, ready_signal = labview_ready_signal,
+                 link = use_robot_link, mode_signal = labview_mode_signal, framing = labview_framing):
         self.g_state = g_state
+        self.host = host
+        self.port = port
+        self.link = link  # attach to robot_link.py instead of waiting for labview to connect
+        self.ready_signal = ready_signal
+        self.mode_signal = mode_signal
+        self.framing = framing  # see MessageParser
+        self.conn = None
         self.connect()
+        self.g_state.add_listener(self.on_state_change)
 
     def connect(self):
+        if self.link:
+            self.conn = self.socket = connect_link("labview")
+            self.g_state.labview_connected = True
+            self.g_state.labview_state = None
+            print("Connected to labview through the robot link")
+            return
         try:
             self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            self.socket.bind((WIFI_HOST, WIFI_PORT))
+            self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            self.socket.bind((self.host, self.port))
             self.socket.listen(1)
-            print(f"Waiting for labview TCP connection on port {WIFI_PORT}...")
+            print(f"Waiting for labview TCP connection on port {self.port}...")
 
             conn, addr = self.socket.accept()
             self.conn = conn
@@ -25,36 +45,77 @@ class LabviewTCP:
 
 
     def disconnect(self):
-        g_state.end_labview_connection = True
+        self.g_state.end_labview_connection = True
+
+    def on_state_change(self, name, old, new):
+        """
+        passes the signals labview acts on to it (see labview_signal)
+        """
+        message = labview_signal(name, new, self.ready_signal, self.mode_signal)
+        if message is not None and self.conn is not None:
+            try:
+                self.conn.sendall(f"{message}\n".encode())
+            except OSError as e:
+                print(f"couldn't send {message} to labview: {e}")
 
     def receive_data(self):
+        parser = MessageParser(self.framing)
         try:
             while not self.g_state.end_labview_connection:
-                data = self.conn.recv(BUFFER_SIZE).decode()
-                # print(f"received: {data} from labview")
-                if isnum(data):
-                    self.g_state.encoder_value = float(data)
-                elif data.lower() in ("finished", "start", "sweeping"):
-                    self.g_state.labview_state = data.lower()
-                else:
-                    print(f"labview data not recognized: {data=}, {type(data)=}")
+                messages = parser.recv_from(self.conn)
+                t = time.monotonic()
+                for message in messages:
+                    handle_message(self.g_state, message, t)
         except Exception as e:
             print(f"Exception: {e}")
         finally:
             print("Ending labview TCP connection")
+            self.g_state.remove_listener(self.on_state_change)
+            if self.conn is not None:
+                self.conn.close()
+            self.socket.close()
             self.g_state.labview_connected = False
             self.g_state.labview_state = None
             self.g_state.encoder_value = None
 
-def isnum(data_string):
+def labview_signal(name, new, ready_signal, mode_signal):
+    """
+    message for labview when g_state name changes to new, None if there is nothing to tell it
+        ready_signal: "ready n" when kuka is in place at sweep point n, so it can start sweeping right away
+        mode_signal: "mode trace" / "mode sweep" when kuka starts a trace / sweep, so nobody has to switch labview over
+    """
+    if name == "sweep_ready" and new is not None and ready_signal:
+        return f"ready {new}"
+    if name == "kuka_state" and new in ("trace", "sweep") and mode_signal:
+        return f"mode {new}"
+    return None
+
+def handle_message(g_state: GlobalState, message: bytes, t):
+    """
+    updates g_state from one framed labview message received at time t
+    """
+    message = message.strip()
+    if not message:
+        return
+    # print(f"received: {message} from labview")
     try:
-        data = float(data_string)
-        return True
-    except:
-        return False
+        value = float(message)
+    except ValueError:
+        value = None
+
+    if value is not None:
+        tracer.count("encoder messages")
+        g_state.encoder_buffer.append(t, value)
+        g_state.encoder_value = value
+    elif message.lower() in (b"finished", b"start", b"sweeping"):
+        tracer.count("state messages")
+        g_state.labview_state = message.decode().lower()
+    else:
+        tracer.count("unrecognized messages")
+        print(f"labview data not recognized: {message=}")
 
 if __name__ == "__main__":
-    g_state = GlobalState
+    g_state = GlobalState()
     labview = LabviewTCP(g_state)
 
 
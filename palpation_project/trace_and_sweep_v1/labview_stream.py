@@ -0,0 +1,198 @@
+"""
+framing and storage for the labview data stream
+
+MessageParser splits the TCP byte stream into messages, so "123.4\nfinished\n" arriving in one
+recv is two messages instead of one unrecognized one
+SampleRingBuffer keeps a timestamped history of encoder values for window queries
+SettlingDetector tells from that history when the VCA has stopped moving
+"""
+
+import numpy as np
+
+from config import BUFFER_SIZE, labview_framing, encoder_buffer_size
+from config import settle_samples, settle_tolerance
+
+
+class MessageParser:
+    """
+    reads from the socket straight into one preallocated buffer with recv_into and splits it into messages
+        "newline": messages end in \\n, a partial message is kept until the rest arrives
+        "packet": old behaviour, whatever one recv returns is a message (still split on \\n if there are any)
+    """
+    def __init__(self, framing=labview_framing, size=4 * BUFFER_SIZE):
+        if framing not in ("newline", "packet"):
+            raise ValueError(f"unknown labview_framing: {framing!r}, expected 'newline' or 'packet'")
+        self.framing = framing
+        self.buffer = bytearray(size)
+        self.view = memoryview(self.buffer)
+        self.end = 0
+        self.discarding = False  # after an overflow: dropping the rest of the too long message, up to its delimiter
+
+    def recv_from(self, conn):
+        """
+        blocks for the next recv, returns the list of complete messages (bytes, without the delimiter)
+        """
+        if self.end == len(self.buffer):
+            print(f"labview message longer than {len(self.buffer)} bytes, dropping it")
+            self.end = 0
+            self.discarding = True
+
+        n = conn.recv_into(self.view[self.end:])
+        if n == 0:
+            raise ConnectionError("labview closed the connection")
+
+        messages = []
+        start = 0
+        stop = self.end + n
+        if self.discarding:
+            # the bytes up to the next delimiter are the tail of the dropped message, not a message of their own
+            i = self.buffer.find(b"\n", 0, stop)
+            if i == -1:
+                self.end = 0
+                return messages
+            start = self.end = i + 1
+            self.discarding = False
+        # only the new bytes can contain a delimiter that hasn't been seen yet
+        i = self.buffer.find(b"\n", max(self.end, start), stop)
+        while i != -1:
+            messages.append(bytes(self.view[start:i]))
+            start = i + 1
+            i = self.buffer.find(b"\n", start, stop)
+
+        if self.framing == "packet" and start < stop:
+            messages.append(bytes(self.view[start:stop]))
+            start = stop
+
+        # keep the partial message at the front of the buffer
+        remainder = stop - start
+        if remainder and start:
+            self.buffer[:remainder] = self.view[start:stop]
+        self.end = remainder
+
+        return messages
+
+
+class SampleRingBuffer:
+    """
+    fixed size numpy buffer of (timestamp, encoder_value) samples, oldest overwritten first
+    one writer (the labview thread) and any number of readers without locks:
+    count is only advanced after a sample is written, and readers drop anything overwritten while they copied
+    """
+    def __init__(self, capacity=encoder_buffer_size):
+        self.capacity = capacity
+        self.data = np.zeros((capacity, 2))
+        self.count = 0  # samples appended since the start, data[count % capacity] is written next
+
+    def append(self, t, value):
+        i = self.count % self.capacity
+        self.data[i, 0] = t
+        self.data[i, 1] = value
+        self.count += 1
+
+    def __len__(self):
+        return min(self.count, self.capacity)
+
+    def last_time(self):
+        """
+        timestamp of the newest sample, None if there are none
+        """
+        if self.count == 0:
+            return None
+        return self.data[(self.count - 1) % self.capacity, 0]
+
+    def latest(self, n=None):
+        """
+        copy of the last n samples (all of them if n is None), oldest first, shape (n, 2)
+        """
+        count = self.count
+        n = len(self) if n is None else min(n, count, self.capacity)
+        samples = self.data[np.arange(count - n, count) % self.capacity]
+
+        # the writer may have lapped the oldest samples while they were being copied
+        overwritten = self.count - self.capacity - (count - n)
+        if overwritten > 0:
+            samples = samples[overwritten:]
+        return samples
+
+    def since(self, t0):
+        """
+        every stored sample with timestamp >= t0, oldest first
+        only the result is copied: the stored samples are two sorted runs (before / after the write position),
+        binary searched for t0
+        """
+        count = self.count
+        n = min(count, self.capacity)
+        times = self.data[:, 0]
+        split = count % self.capacity if n == self.capacity else 0
+        # logical order is data[split:n] then data[:split]
+        i = np.searchsorted(times[split:n], t0)
+        if i == n - split:
+            i += np.searchsorted(times[:split], t0)
+        # samples appended since count was read are newer than t0 too, latest() takes them along
+        samples = self.latest(n - i + self.count - count)
+        return samples[np.searchsorted(samples[:, 0], t0):]
+
+    def window(self, seconds, now=None):
+        """
+        samples from the last `seconds` before now (defaults to the newest sample's timestamp)
+        """
+        if now is None:
+            now = self.last_time()
+            if now is None:
+                return self.data[:0]
+        samples = self.since(now - seconds)
+        return samples[:np.searchsorted(samples[:, 0], now, side="right")]
+
+    def window_mean(self, seconds, now=None):
+        """
+        mean encoder_value over the last `seconds`, None if there are no samples in it
+        """
+        samples = self.window(seconds, now)
+        if len(samples) == 0:
+            return None
+        return float(samples[:, 1].mean())
+
+
+class SettlingDetector:
+    """
+    the VCA has settled once the last n_samples encoder values (all received after t0) have
+    std <= tolerance and the means of their first and second half differ by <= tolerance (no slow drift)
+    """
+    def __init__(self, n_samples=settle_samples, tolerance=settle_tolerance):
+        assert n_samples >= 2
+        self.n_samples = n_samples
+        self.tolerance = tolerance
+
+    def settled_value(self, buffer: SampleRingBuffer, t0):
+        """
+        mean of the stable samples, None if the encoder hasn't settled since t0
+        """
+        samples = buffer.latest(self.n_samples)
+        if len(samples) < self.n_samples or samples[0, 0] < t0:
+            return None
+
+        values = samples[:, 1]
+        if values.std() > self.tolerance:
+            return None
+        half = self.n_samples // 2
+        if abs(values[half:].mean() - values[:half].mean()) > self.tolerance:
+            return None
+        return float(values.mean())
+
+    def noise(self, buffer: SampleRingBuffer, t0):
+        """
+        [nm] std of the newest samples since t0 (up to n_samples), None if there are fewer than 2
+        """
+        samples = buffer.since(t0)[-self.n_samples:]
+        if len(samples) < 2:
+            return None
+        return float(samples[:, 1].std())
+
+    def fallback_value(self, buffer: SampleRingBuffer, t0):
+        """
+        mean of the newest samples since t0 (up to n_samples), None if there are none
+        """
+        samples = buffer.since(t0)[-self.n_samples:]
+        if len(samples) == 0:
+            return None
+        return float(samples[:, 1].mean())
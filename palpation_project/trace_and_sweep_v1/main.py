@@ -1,11 +1,10 @@
 from threading import Thread
-import time
-import datetime
-import numpy as np
 
 from kuka import Kuka
 from labview import LabviewTCP
 from global_state import GlobalState
+from config import trace_mode, move_model_calibrate, skip_trace, register_surface
+from instrumentation import tracer
 
 
 print("are you on the laptop hotspot?")
@@ -16,7 +15,7 @@ g_state = GlobalState()
 kuka = Kuka(g_state)
 labview = LabviewTCP(g_state)
 
-kuka_trace = Thread(target=kuka.trace)
+kuka_trace = Thread(target={"scan": kuka.scan, "hybrid": kuka.hybrid_scan}.get(trace_mode, kuka.trace))
 kuka_sweep = Thread(target=kuka.sweep)
 receive_labview_data = Thread(target=labview.receive_data)
 
@@ -26,20 +25,32 @@ if __name__ == "__main__":
     try:
         receive_labview_data.start()
 
-        print("beginning trace")
-        kuka_trace.start()
+        if move_model_calibrate:
+            print("calibrating move times")
+            kuka.calibrate_motion()
 
-        while g_state.kuka_state != "trace done":
-            time.sleep(1)
+        retrace = not skip_trace
+        if skip_trace and register_surface:
+            print("registering the most recent surface data to where the sample is now")
+            retrace = kuka.register() is None
+        elif skip_trace:
+            print("skipping trace, sweeping the most recent surface data")
+        if retrace:
+            print("beginning trace")
+            kuka_trace.start()
 
-        input("press Enter to continue to sweep")
+            # wait in 1s slices so ctrl+c still works, state changes still wake this up immediately
+            while not g_state.wait_for(lambda s: s.kuka_state == "trace done", timeout=1):
+                pass
+
+            input("press Enter to continue to sweep")
 
         print("beginning sweep")
         kuka_sweep.start()
 
         try:
-            while g_state.kuka_state != "sweep done":
-                time.sleep(1)
+            while not g_state.wait_for(lambda s: s.kuka_state == "sweep done", timeout=1):
+                pass
         finally:
             pass
     except Exception as e:
@@ -48,3 +59,5 @@ if __name__ == "__main__":
     finally:
         kuka.disconnect()
         g_state.end_labview_connection = True
+        tracer.report()
+        tracer.save()
@@ -0,0 +1,57 @@
+"""
+same workflow as main.py, but on one asyncio event loop (engine.py) instead of three threads
+"""
+
+import asyncio
+
+from engine import AsyncKuka, AsyncLabview
+from global_state import GlobalState
+from config import trace_mode, move_model_calibrate, skip_trace, register_surface
+from instrumentation import tracer
+
+
+async def ainput(prompt):
+    # input() blocks, so it gets the loop's default executor instead of holding up the kuka/labview links
+    return await asyncio.get_running_loop().run_in_executor(None, input, prompt)
+
+
+async def main():
+    print("are you on the laptop hotspot?")
+    print("is the kuka program running?")
+    await ainput("press enter to continue")
+
+    g_state = GlobalState()
+    kuka = AsyncKuka(g_state)
+    labview = AsyncLabview(g_state)
+    await kuka.connect()
+    await labview.start()
+
+    try:
+        await ainput("press enter to begin trace")
+        if move_model_calibrate:
+            print("calibrating move times")
+            await kuka.calibrate_motion()
+        retrace = not skip_trace
+        if skip_trace and register_surface:
+            print("registering the most recent surface data to where the sample is now")
+            retrace = await kuka.register() is None
+        elif skip_trace:
+            print("skipping trace, sweeping the most recent surface data")
+        if retrace:
+            print("beginning trace")
+            await {"scan": kuka.scan, "hybrid": kuka.hybrid_scan}.get(trace_mode, kuka.trace)()
+            await ainput("press Enter to continue to sweep")
+        print("beginning sweep")
+        await kuka.sweep()
+    except Exception as e:
+        print("Exception:")
+        print(e)
+    finally:
+        await kuka.disconnect()
+        await labview.stop()
+        tracer.report()
+        tracer.save()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
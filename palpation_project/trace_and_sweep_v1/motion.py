@@ -0,0 +1,185 @@
+"""
+how long a kuka move takes: a fixed latency (wifi, motion planning) + a trapezoid velocity profile
+(accelerate at acceleration up to velocity, cruise, decelerate), short moves never reach full speed
+
+used for the waits after a move when kuka_move_ack is off (estimate * move_wait_margin instead of a fixed sleep,
+never shorter than the old fixed sleep until the model is calibrated)
+and for the "reached" timeouts, so long moves aren't cut off by kuka_move_timeout
+
+calibration_steps measures moves of different lengths on the real robot (or the dummy) and fits the model to them,
+the fit is saved to move_model_file and used instead of kuka_speed / kuka_acceleration / kuka_latency from then on
+    python trace_and_sweep_v1/motion.py      (or move_model_calibrate = True in config.py to do it at the start of main.py)
+"""
+
+import json
+import os
+import numpy as np
+
+from config import xspan, kuka_speed, kuka_acceleration, kuka_latency, move_wait_margin, move_model_file
+from config import kuka_move_timeout
+
+CALIBRATION_DISTANCES = [.5, 1, 2, 5, 10, 20, 40, 80]  # [mm], capped at the trace length
+CALIBRATION_REPEATS = 2
+
+
+class MoveTimeModel:
+    def __init__(self, velocity=kuka_speed, acceleration=kuka_acceleration, latency=kuka_latency, margin=move_wait_margin,
+                 calibrated=False):
+        self.velocity = velocity
+        self.acceleration = acceleration
+        self.latency = latency
+        self.margin = margin
+        self.calibrated = calibrated  # fitted to measured moves, False for the config.py guesses
+
+    @staticmethod
+    def profile_time(distance, velocity, acceleration):
+        """
+        [s] time to cover distance [mm] from standstill to standstill, broadcasts over all three
+        """
+        distance = np.abs(distance)
+        full_speed = distance >= velocity**2 / acceleration
+        return np.where(full_speed, distance / velocity + velocity / acceleration, 2 * np.sqrt(distance / acceleration))
+
+    def duration(self, distance):
+        """
+        [s] estimated time from sending a move of distance [mm] until kuka is there
+        """
+        return self.latency + self.profile_time(distance, self.velocity, self.acceleration)
+
+    def fraction_done(self, elapsed, total, distance):
+        """
+        how much of a move of distance [mm] is done elapsed [s] after it was sent, when "reached" came total [s] after:
+        latency first, then the trapezoid profile stretched to the rest of total, broadcasts over elapsed
+        """
+        moving = max(total - self.latency, 1e-9)
+        profile = float(self.profile_time(distance, self.velocity, self.acceleration))
+        if distance <= 0 or profile <= 0:
+            return np.clip((np.asarray(elapsed, dtype=float) - self.latency) / moving, 0, 1)
+        t = np.clip((np.asarray(elapsed, dtype=float) - self.latency) / moving, 0, 1) * profile
+        a = self.acceleration
+        v = min(self.velocity, np.sqrt(distance * a))
+        t_accelerating = v / a
+        covered = np.where(t < t_accelerating, a * t**2 / 2,
+                           np.where(t <= profile - t_accelerating, v**2 / (2 * a) + v * (t - t_accelerating),
+                                    distance - a * (profile - t)**2 / 2))
+        return covered / distance
+
+    def wait(self, duration, fixed_wait=0.):
+        """
+        [s] how long to sleep after a move estimated to take duration when kuka doesn't report "reached"
+        uncalibrated, the estimate is never trusted below fixed_wait (the fixed sleep the move had before this model)
+        """
+        wait = duration * self.margin
+        return wait if self.calibrated else max(wait, fixed_wait)
+
+    def path_duration(self, start, waypoints):
+        """
+        [s] estimated time of a path, latency once, kuka stops at every waypoint (dwell included)
+        """
+        points = np.array([start] + [w[:3] for w in waypoints], dtype=float)
+        distances = np.linalg.norm(np.diff(points, axis=0), axis=1)
+        dwell = sum(w[3] for w in waypoints if len(w) > 3)
+        return self.latency + float(self.profile_time(distances, self.velocity, self.acceleration).sum()) + dwell
+
+    def timeout(self, duration, n_moves=1):
+        """
+        [s] how long to wait for "reached" for n_moves estimated to take duration, at least kuka_move_timeout each
+        """
+        return max(kuka_move_timeout * n_moves, 3 * duration)
+
+    @classmethod
+    def fit(cls, distances, times, margin=move_wait_margin):
+        """
+        least squares fit of velocity, acceleration and latency to measured move times
+        velocity and acceleration by grid search (log spaced, then zoomed in around the best twice),
+        latency is then the mean remaining time
+        """
+        distances = np.asarray(distances, dtype=float)
+        times = np.asarray(times, dtype=float)
+        v_range, a_range = (1, 5000), (1, 1e7)
+        for _ in range(3):
+            velocities = np.geomspace(*v_range, 100)[:, None, None]
+            accelerations = np.geomspace(*a_range, 100)[None, :, None]
+            profile = cls.profile_time(distances, velocities, accelerations)
+            latency = np.clip((times - profile).mean(axis=-1, keepdims=True), 0, None)
+            error = ((latency + profile - times)**2).sum(axis=-1)
+            i, j = np.unravel_index(np.argmin(error), error.shape)
+            v, a = velocities[i, 0, 0], accelerations[0, j, 0]
+            v_step, a_step = velocities[1, 0, 0] / velocities[0, 0, 0], accelerations[0, 1, 0] / accelerations[0, 0, 0]
+            v_range, a_range = (v / v_step, v * v_step), (a / a_step, a * a_step)
+        return cls(float(v), float(a), float(latency[i, j, 0]), margin, calibrated=True)
+
+    def to_dict(self):
+        return {"velocity": self.velocity, "acceleration": self.acceleration, "latency": self.latency}
+
+    def save(self, path=move_model_file):
+        with open(path, "w") as f:
+            json.dump(self.to_dict(), f, indent=2)
+
+    @classmethod
+    def load(cls, path=move_model_file):
+        """
+        the calibrated model if path exists, otherwise the one from config.py
+        """
+        if path is None or not os.path.isfile(path):
+            return cls()
+        with open(path) as f:
+            return cls(**json.load(f), calibrated=True)
+
+    def __repr__(self):
+        return (f"MoveTimeModel(velocity={self.velocity:.1f} mm/s, acceleration={self.acceleration:.0f} mm/s^2, "
+                f"latency={self.latency * 1000:.0f} ms)")
+
+
+def calibration_moves(span=xspan, distances=CALIBRATION_DISTANCES, repeats=CALIBRATION_REPEATS):
+    """
+    (x, y, z) moves out along x from (0, 0, 0) and back, at z=0 like the moves between trace points
+    """
+    for distance in distances:
+        if distance > max(span, distances[0]):
+            break
+        for _ in range(repeats):
+            yield distance, 0, 0
+            yield 0, 0, 0
+
+
+def fit_calibration(samples, path=move_model_file):
+    """
+    samples: [(distance, seconds)], fits and saves the model and prints how well it fits
+    """
+    distances, times = np.array(samples).T
+    model = MoveTimeModel.fit(distances, times)
+    errors = model.duration(distances) - times
+    print(f"calibrated {model} from {len(samples)} moves, max error {np.abs(errors).max() * 1000:.0f} ms")
+    if path is not None:
+        model.save(path)
+        print(f"saved move model to {path}")
+    return model
+
+
+def calibration_steps(kuka, path=move_model_file):
+    """
+    times calibration_moves on kuka (needs kuka_move_ack) and fits MoveTimeModel to them, kuka uses it from then on
+    kuka steps (see Kuka.run_steps), run by kuka.calibrate_motion
+    """
+    assert kuka.move_ack, "calibrating needs kuka_move_ack to know when moves end"
+    yield ("async_move", 0, 0, 0)
+    samples = []
+    for target in calibration_moves():
+        distance = float(np.linalg.norm(np.subtract(target, kuka.position)))
+        yield ("async_move", *target)
+        # only the move -> "reached" round trip, not the wait for a fresh encoder value after it
+        samples.append((distance, kuka.last_move_time))
+    kuka.motion = fit_calibration(samples, path)
+    return kuka.motion
+
+
+if __name__ == "__main__":
+    from kuka import Kuka
+    from global_state import GlobalState
+
+    kuka = Kuka(GlobalState())
+    try:
+        kuka.calibrate_motion()
+    finally:
+        kuka.disconnect()
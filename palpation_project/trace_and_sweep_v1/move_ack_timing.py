@@ -0,0 +1,87 @@
+"""
+compares wall-clock time of the trace move sequence with fixed sleeps vs move time estimates (motion.py)
+vs "reached" acks,
+and sweep transitions (retract, transit, descend) as separate moves vs one "path" message
+runs against dummy_kuka_server, no robot or labview needed
+"""
+
+import time
+
+from kuka import Kuka
+from global_state import GlobalState
+from dummy_kuka_server import DummyKukaServer, LATENCY
+from config import xspan, d, dz
+from motion import MoveTimeModel
+
+n_points = 5         # points to time (sleep mode is slow), result is scaled up to the full trace
+descent_steps = 10   # typical number of dz steps before contact
+
+
+def trace_moves(kuka: Kuka, fixed_sleep):
+    # same moves as Kuka.trace, without needing encoder data
+    # fixed_sleep: the old waiting_times (.5s per move, 1s after the record), else waits estimated by kuka.motion
+    for i in range(n_points):
+        x = i * d
+        kuka.async_move(x, 0, 0, waiting_time=.5 if fixed_sleep else None)
+        z = 0
+        for _ in range(descent_steps):
+            z -= dz
+            kuka.async_move(x, 0, z, waiting_time=.5 if fixed_sleep else None)
+        kuka.async_move(x, 0, 0, waiting_time=1 if fixed_sleep else None)
+
+
+def time_trace(mode):
+    server = DummyKukaServer(port=0)
+    server.start()
+    kuka = Kuka(GlobalState(), host=server.host, port=server.port)
+    kuka.move_ack = mode == "reached ack"
+    # what calibrating against the dummy gives (constant speed, fixed latency)
+    kuka.motion = MoveTimeModel(velocity=server.speed, acceleration=1e7, latency=LATENCY, calibrated=True)
+
+    t0 = time.perf_counter()
+    trace_moves(kuka, fixed_sleep=mode == "fixed sleep")
+    # let the last move finish so both modes end with the robot in place
+    while server.n_moves < n_points * (descent_steps + 2):
+        time.sleep(.001)
+    elapsed = time.perf_counter() - t0
+
+    kuka.disconnect()
+    return elapsed
+
+
+def time_sweep_transitions(use_path, latency):
+    server = DummyKukaServer(port=0, latency=latency)
+    server.start()
+    kuka = Kuka(GlobalState(), host=server.host, port=server.port)
+    kuka.use_path = True  # the dummy server implements "path"
+
+    t0 = time.perf_counter()
+    for i in range(1, n_points):
+        x0, x = (i - 1) * d * 10, i * d * 10
+        path = [(x0, 0, 50), (x, 0, 50), (x, 0, -5)]
+        if use_path:
+            kuka.move_path(path)
+        else:
+            for waypoint in path:
+                kuka.async_move(*waypoint)
+    elapsed = time.perf_counter() - t0
+
+    kuka.disconnect()
+    return elapsed / (n_points - 1)
+
+
+if __name__ == "__main__":
+    n_trace_points = int(xspan / d) + 1
+    results = {}
+    for mode in ("fixed sleep", "move model", "reached ack"):
+        elapsed = time_trace(mode)
+        results[mode] = elapsed
+        print(f"{mode}: {elapsed / n_points:.3f} s/point, ~{elapsed / n_points * n_trace_points:.1f} s per {n_trace_points} point trace")
+
+    print(f"speedup over fixed sleeps: move model {results['fixed sleep'] / results['move model']:.1f}x, "
+          f"reached ack {results['fixed sleep'] / results['reached ack']:.1f}x")
+
+    for latency in (LATENCY, .15):
+        separate = time_sweep_transitions(False, latency)
+        path = time_sweep_transitions(True, latency)
+        print(f"sweep transition with {latency}s per message: separate moves {separate:.3f} s, one path {path:.3f} s")
@@ -0,0 +1,61 @@
+"""
+predicts where the surface is at the next trace point from the points already recorded,
+so the descent can start just above it instead of at z=0
+"""
+
+import numpy as np
+
+from config import d, zspan, predict_margin, predict_radius, predict_max_uncertainty
+
+
+class StartHeightPredictor:
+    def __init__(self, margin=predict_margin, radius=predict_radius * d, max_uncertainty=predict_max_uncertainty, z0=0):
+        self.margin = margin
+        self.radius = radius
+        self.max_uncertainty = max_uncertainty
+        self.z0 = z0
+
+    def predict(self, positions, x, y, spacing=None):
+        """
+        returns (z_surface, uncertainty) from recorded points within radius of x,y
+        spacing: [mm] grid spacing around x,y (adaptive traces change it), the radius is predict_radius spacings then
+            1 neighbor: its height, uncertainty = distance to it (assumes slopes under 45 deg)
+            2+ neighbors: least squares plane fit (a line fit for single row traces),
+                uncertainty = worst fit residual or distance of the prediction from the nearest point
+        returns (None, None) if there are no neighbors
+        """
+        if len(positions) == 0:
+            return None, None
+
+        points = np.asarray(positions, dtype=float)
+        distances = np.hypot(points[:, 0] - x, points[:, 1] - y)
+        near = distances <= (self.radius if spacing is None else predict_radius * spacing)
+        if not near.any():
+            return None, None
+
+        points = points[near]
+        distances = distances[near]
+        z_nearest = points[np.argmin(distances), 2]
+        if len(points) == 1:
+            return z_nearest, distances[0]
+
+        # z = a + b*(x - x_n) + c*(y - y_n), lstsq handles the collinear (single row) case
+        A = np.column_stack([np.ones(len(points)), points[:, 0] - x, points[:, 1] - y])
+        coeffs, _, _, _ = np.linalg.lstsq(A, points[:, 2], rcond=None)
+        z_surface = coeffs[0]
+        residual = np.abs(A @ coeffs - points[:, 2]).max()
+        uncertainty = max(residual, abs(z_surface - z_nearest))
+
+        return z_surface, uncertainty
+
+    def start_height(self, positions, x, y, spacing=None):
+        """
+        height to move to before probing: margin + uncertainty above the predicted surface
+        falls back to z0 when there is no prediction or it is too uncertain
+        """
+        z_surface, uncertainty = self.predict(positions, x, y, spacing)
+        if z_surface is None or uncertainty > self.max_uncertainty:
+            return self.z0
+
+        z_start = z_surface + self.margin + uncertainty
+        return float(np.clip(z_start, -zspan, self.z0))
@@ -0,0 +1,54 @@
+"""
+compares probing strategies, with and without start height prediction, on a simulated surface (most recent recorded trace)
+reports moves per point, simulated robot time per point, and max error of the recorded height
+robot time is given for a wired link and for hotspot wifi, where the per-move latency dominates
+"""
+
+import os
+
+from probing import LinearProbe, BisectProbe
+from prediction import StartHeightPredictor
+from sim_surface import SimSurface, SimKuka
+from config import dz, probe_coarse_dz, probe_resolution
+from dummy_kuka_server import LATENCY
+
+WIFI_LATENCY = .15  # [s] rough per-move round trip over the labview laptop hotspot
+
+os.chdir(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+
+def run(probe, surface: SimSurface, latency=LATENCY, predictor=None):
+    kuka = SimKuka(surface, latency=latency)
+    kuka.probe = probe
+    kuka.predictor = predictor
+    positions = []
+    max_error = 0
+    for x, y, z_true in surface.positions:
+        z, e0 = kuka.measure_point(x, y, positions)
+        # same record as Kuka.trace
+        z_record = z + (e0 - kuka.g_state.encoder_value) / 1000
+        positions.append([x, y, z_record])
+        max_error = max(max_error, abs(z_record - z_true))
+        kuka.async_move(x, y, 0)
+
+    n_points = len(surface.positions)
+    return kuka.n_moves / n_points, kuka.move_time / n_points, max_error
+
+
+if __name__ == "__main__":
+    surface = SimSurface.most_recent()
+    print(f"{len(surface.positions)} points, z from {surface.positions[:, 2].min()} to {surface.positions[:, 2].max()}")
+
+    probes = {
+        f"linear dz={dz}": LinearProbe(dz=dz),
+        f"linear dz={dz / 4}": LinearProbe(dz=dz / 4),
+        f"bisect coarse_dz={probe_coarse_dz} resolution={probe_resolution}": BisectProbe(),
+        f"bisect coarse_dz={probe_coarse_dz} resolution={probe_resolution / 4}": BisectProbe(resolution=probe_resolution / 4),
+    }
+    for name, probe in probes.items():
+        for predictor in (None, StartHeightPredictor()):
+            moves, move_time, max_error = run(probe, surface, predictor=predictor)
+            _, wifi_time, _ = run(probe, surface, latency=WIFI_LATENCY, predictor=predictor)
+            if predictor is not None:
+                name = "    + predicted start"
+            print(f"{name}: {moves:.1f} moves/point, {move_time:.2f} s/point ({wifi_time:.2f} s/point on wifi), max error {max_error:.3f} mm")
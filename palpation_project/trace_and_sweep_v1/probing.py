@@ -0,0 +1,139 @@
+"""
+probing strategies for finding the surface at one x,y point during trace
+
+every probe assumes kuka is already at x, y, z_start above the surface and returns (z, e0):
+    z  - height kuka is left at, in contact with the surface
+    e0 - encoder_value with the VCA free, to compute encoder_deflection against
+
+probe logic is written as generators that yield the (x, y, z) moves to make and return (z, e0),
+so the same strategy runs on the blocking Kuka and on the asyncio engine (move_steps, see Kuka.run_steps)
+"""
+
+from config import zspan, dz, probe_mode, probe_coarse_dz, probe_resolution
+from instrumentation import tracer
+
+
+class LinearProbe:
+    """
+    step down by dz until the encoder detects the surface
+    O(depth/dz) moves per point
+    """
+    def __init__(self, dz=dz, zspan=zspan):
+        self.dz = dz
+        self.zspan = zspan
+
+    def moves(self, kuka, x, y, z_start=0):
+        e0 = kuka.g_state.encoder_value
+        z = z_start
+        while not kuka.in_contact(e0) and abs(z) < self.zspan:
+            z -= self.dz
+            yield x, y, z
+
+        return z, e0
+
+    def probe(self, kuka, x, y, z_start=0):
+        return run_moves(kuka, self.moves(kuka, x, y, z_start))
+
+
+class BisectProbe:
+    """
+    step down by coarse_dz until contact, retract to the last free height,
+    then bisect between free and contact heights until they are within resolution
+    O(depth/coarse_dz + log2(coarse_dz/resolution)) moves per point
+    """
+    def __init__(self, coarse_dz=probe_coarse_dz, resolution=probe_resolution, zspan=zspan):
+        assert coarse_dz > resolution > 0
+        self.coarse_dz = coarse_dz
+        self.resolution = resolution
+        self.zspan = zspan
+
+    def moves(self, kuka, x, y, z_start=0):
+        e0 = kuka.g_state.encoder_value
+        z_free = z_start
+        z = z_start
+        while not kuka.in_contact(e0) and z > -self.zspan:
+            z_free = z
+            z = max(z - self.coarse_dz, -self.zspan)
+            yield x, y, z
+
+        if not kuka.in_contact(e0):
+            # reached zspan without finding the surface
+            return z, e0
+
+        # retract so e0 is re-read with the VCA free
+        z_contact = z
+        yield x, y, z_free
+        e0 = kuka.g_state.encoder_value
+
+        while z_free - z_contact > self.resolution:
+            z_mid = (z_free + z_contact) / 2
+            yield x, y, z_mid
+            if kuka.in_contact(e0):
+                z_contact = z_mid
+            else:
+                z_free = z_mid
+
+        if kuka.position[2] != z_contact:
+            yield x, y, z_contact
+
+        return z_contact, e0
+
+    def probe(self, kuka, x, y, z_start=0):
+        return run_moves(kuka, self.moves(kuka, x, y, z_start))
+
+
+def measure_point_moves(kuka, x, y, positions):
+    """
+    moves to x,y and probes down to the surface with kuka.probe,
+    starting just above the surface predicted by kuka.predictor if possible
+    returns (z, e0) from the probe
+    """
+    yield x, y, 0
+    e_free = kuka.g_state.encoder_value
+
+    z_start = 0
+    if kuka.predictor is not None:
+        z_start = kuka.predictor.start_height(positions, x, y, kuka.spacing)
+    if z_start < 0:
+        print(f"moving down to predicted start height {z_start:.2f}")
+        yield x, y, z_start
+        if kuka.in_contact(e_free):
+            print("already touching surface at predicted start height, starting from z0")
+            yield x, y, 0
+            z_start = 0
+
+    return (yield from kuka.probe.moves(kuka, x, y, z_start))
+
+
+def move_steps(moves):
+    """
+    the moves a probe generator yields as kuka.async_move steps (see Kuka.run_steps), returns the generator's result
+    each move and the probe's check after it is timed as a "probe step" span
+    """
+    try:
+        target = next(moves)
+        while True:
+            with tracer.span("probe step", "probe", z=target[2]):
+                yield ("async_move", *target)
+                target = moves.send(None)
+    except StopIteration as stop:
+        return stop.value
+
+
+def run_moves(kuka, moves):
+    """
+    makes every move a probe generator yields with kuka.async_move, returns the generator's result
+    """
+    return kuka.run_steps(move_steps(moves))
+
+
+PROBES = {
+    "linear": LinearProbe,
+    "bisect": BisectProbe,
+}
+
+
+def make_probe(mode=probe_mode):
+    if mode not in PROBES:
+        raise ValueError(f"unknown probe_mode: {mode!r}, expected one of {list(PROBES)}")
+    return PROBES[mode]()
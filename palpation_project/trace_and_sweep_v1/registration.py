@@ -0,0 +1,180 @@
+"""
+surface registration: where a re-mounted sample is now, from a few probed points and its stored dense trace,
+so the sweep can use the stored surface instead of tracing the sample again (register_surface in config.py)
+
+the sample is taken to have moved rigidly, turned by theta in the xy plane about (0, 0) and shifted by tx, ty, tz
+    x, y new = R(theta) @ (x, y stored) + (tx, ty),    z new = z stored + tz
+fit tries every theta / tx / ty on a grid at once (tz is the mean height difference for each) and refines the best
+with damped gauss-newton on the surface model's gradient, the rms height residual of the probes says how well it fits
+
+on a line trace (all probes on one line) only the shift along the line and tz are fitted, theta and the sideways
+offset are held at 0, a weak pull towards no move at all settles what is left
+the fit stays within registration_max_offset / registration_max_rotation, a fit that ends on one of those bounds,
+is ill-conditioned (the probes don't pin it down) or is off by more than registration_tolerance isn't used
+"""
+
+import numpy as np
+
+from config import registration_points, registration_max_offset, registration_max_rotation, registration_tolerance
+from surface_model import SurfaceModel
+
+OFFSET_STEP = .5     # [mm] grid search spacing of tx, ty
+ROTATION_STEP = 1    # [deg] grid search spacing of theta
+REFINE_ITERATIONS = 50
+PRIOR = 1e-3         # [mm per mm / rad] pull of theta / tx / ty towards 0, picks the smallest move among equally good ones
+MAX_CONDITION = 1e4  # fits with a larger condition (see condition) aren't used
+
+
+class Registration:
+    def __init__(self, theta, tx, ty, tz, residuals, condition=1., at_bound=False):
+        self.theta = float(theta)  # [rad]
+        self.tx = float(tx)        # [mm]
+        self.ty = float(ty)
+        self.tz = float(tz)
+        self.residuals = np.asarray(residuals, dtype=float)  # [mm] probed z - registered surface z
+        self.rms = float(np.sqrt(np.mean(self.residuals**2)))
+        self.max_residual = float(np.abs(self.residuals).max())
+        self.condition = float(condition)  # of the fit, see condition()
+        self.at_bound = at_bound           # the fit ended on a max_offset / max_rotation bound
+
+    def problem(self, tolerance=registration_tolerance):
+        """
+        why the fit can't be used (the sample has to be traced again), None if it can
+        """
+        if self.at_bound:
+            return "the fit ended on the registration_max_offset / registration_max_rotation bound"
+        if not self.condition <= MAX_CONDITION:
+            return f"the probes don't pin the fit down (condition {self.condition:.3g})"
+        if self.rms > tolerance:
+            return f"rms residual is over registration_tolerance ({tolerance}mm)"
+        return None
+
+    def apply(self, positions):
+        """
+        stored (n, 3) x, y, z moved to where the sample is now
+        """
+        x, y, z = np.asarray(positions, dtype=float).reshape(-1, 3).T
+        c, s = np.cos(self.theta), np.sin(self.theta)
+        return np.column_stack([c * x - s * y + self.tx, s * x + c * y + self.ty, z + self.tz])
+
+    def to_dict(self):
+        return {"theta": np.degrees(self.theta), "tx": self.tx, "ty": self.ty, "tz": self.tz,
+                "rms": self.rms, "max_residual": self.max_residual, "condition": self.condition, "at_bound": self.at_bound}
+
+    def __repr__(self):
+        return (f"Registration(theta={np.degrees(self.theta):.2f} deg, tx={self.tx:.2f}, ty={self.ty:.2f}, "
+                f"tz={self.tz:.2f} mm, rms {self.rms:.3f} mm, max {self.max_residual:.3f} mm)")
+
+
+def probe_points(positions, n=registration_points):
+    """
+    (x, y) of n stored points to probe, spread out by farthest point sampling
+    points in the outer 10% of the trace are left out so they are still on the sample after it moved a bit
+    """
+    xy = np.asarray(positions, dtype=float).reshape(-1, 3)[:, :2]
+    low, high = xy.min(axis=0), xy.max(axis=0)
+    margin = (high - low) * .1
+    inside = np.all((xy >= low + margin) & (xy <= high - margin), axis=1)
+    candidates = xy[inside] if inside.sum() >= n else xy
+
+    chosen = [int(np.argmax(np.linalg.norm(candidates - candidates.mean(axis=0), axis=1)))]
+    distance = np.linalg.norm(candidates - candidates[chosen[0]], axis=1)
+    while len(chosen) < min(n, len(candidates)):
+        chosen.append(int(np.argmax(distance)))
+        distance = np.minimum(distance, np.linalg.norm(candidates - candidates[chosen[-1]], axis=1))
+    return [tuple(float(v) for v in candidates[i]) for i in chosen]
+
+
+def to_stored(probes, theta, tx, ty):
+    """
+    x, y of the probes (n, 3) in the stored surface's frame, theta / tx / ty broadcast against the probes
+    """
+    dx, dy = probes[..., 0] - tx, probes[..., 1] - ty
+    c, s = np.cos(theta), np.sin(theta)
+    return c * dx + s * dy, -s * dx + c * dy
+
+
+def residuals_and_jacobian(model: SurfaceModel, probes, params):
+    """
+    probed z - tz - stored z for params (theta, tx, ty, tz) followed by the PRIOR terms, and its (n + 3, 4) derivative
+    """
+    theta, tx, ty, tz = params
+    x, y = to_stored(probes, theta, tx, ty)
+    residuals = probes[:, 2] - tz - model.height(x, y)
+    gx, gy = model.gradient(x, y)
+    c, s = np.cos(theta), np.sin(theta)
+    jacobian = np.column_stack([gy * x - gx * y, gx * c - gy * s, gx * s + gy * c, -np.ones(len(probes))])
+    prior = PRIOR * np.eye(3, 4)
+    return np.concatenate([residuals, prior @ params]), np.vstack([jacobian, prior])
+
+
+def fit(model: SurfaceModel, probes, max_offset=registration_max_offset, max_rotation=registration_max_rotation):
+    """
+    Registration of the stored surface model to the probed (n, 3) points
+    probes on one line (a line trace) can't tell a turn from a sideways shift, so then only the shift along the line
+    and tz are fitted and theta / the sideways offset stay 0
+    """
+    probes = np.asarray(probes, dtype=float).reshape(-1, 3)
+    if len(probes) < 3:
+        raise ValueError(f"registration needs at least 3 probed points, got {len(probes)}")
+
+    # fitted parameters q, (theta, tx, ty, tz) = basis @ q
+    xy = probes[:, :2] - probes[:, :2].mean(axis=0)
+    _, spread, directions = np.linalg.svd(xy, full_matrices=False)
+    offsets = np.arange(-max_offset, max_offset + OFFSET_STEP / 2, OFFSET_STEP)
+    if spread[1] <= 1e-6 * max(spread[0], 1):
+        ux, uy = directions[0]
+        basis = np.array([[0, 0], [ux, 0], [uy, 0], [0, 1]])
+        bounds = np.array([max_offset, np.inf])
+        margins = np.array([OFFSET_STEP / 2, 0])
+        grid = offsets.reshape(-1, 1)
+    else:
+        basis = np.eye(4)
+        bounds = np.array([np.radians(max_rotation), max_offset, max_offset, np.inf])
+        margins = np.array([np.radians(ROTATION_STEP) / 2, OFFSET_STEP / 2, OFFSET_STEP / 2, 0])
+        thetas = np.radians(np.arange(-max_rotation, max_rotation + ROTATION_STEP / 2, ROTATION_STEP))
+        grid = np.column_stack([v.ravel() for v in np.meshgrid(thetas, offsets, offsets, indexing="ij")])
+
+    # grid search, every candidate in one go: (candidates, 1) against (n,) probes
+    theta, tx, ty = (v.reshape(-1, 1) for v in (grid @ basis[:3, :-1].T).T)
+    x, y = to_stored(probes, theta, tx, ty)
+    dz = probes[:, 2] - model.height(x, y)
+    cost = dz.var(axis=1) + PRIOR**2 * (theta**2 + tx**2 + ty**2)[:, 0] / len(probes)
+    best = int(np.argmin(cost))
+    q = np.append(grid[best], dz[best].mean())
+
+    def evaluate(q):
+        residuals, jacobian = residuals_and_jacobian(model, probes, basis @ q)
+        return residuals, jacobian @ basis
+
+    # levenberg-marquardt, steps that leave the search bounds count as not better
+    residuals, jacobian = evaluate(q)
+    damping = 1e-3
+    for _ in range(REFINE_ITERATIONS):
+        a = jacobian.T @ jacobian
+        step = np.linalg.solve(a + damping * np.diag(np.diag(a)), -jacobian.T @ residuals)
+        new_residuals, new_jacobian = evaluate(q + step)
+        if np.all(np.abs(q + step) <= bounds) and (new_residuals**2).sum() < (residuals**2).sum():
+            q, residuals, jacobian = q + step, new_residuals, new_jacobian
+            damping /= 10
+            if np.abs(step).max() < 1e-6:
+                break
+        else:
+            damping *= 10
+            if damping > 1e6:
+                break
+
+    return Registration(*(basis @ q), residuals[:len(probes)], condition=condition(jacobian[:len(probes)]),
+                        at_bound=bool(np.any(np.abs(q) >= bounds - margins)))
+
+
+def condition(jacobian):
+    """
+    condition number of JᵀJ with every column scaled to length 1 (so mm and rad compare), without the PRIOR rows
+    large means some combination of the parameters barely changes the residuals: the probes don't pin it down
+    """
+    norms = np.linalg.norm(jacobian, axis=0)
+    if np.any(norms < 1e-9):
+        return np.inf
+    scaled = jacobian / norms
+    return float(np.linalg.cond(scaled.T @ scaled))
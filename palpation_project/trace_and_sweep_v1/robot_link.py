@@ -0,0 +1,405 @@
+"""
+robot link daemon: one long running process that owns the kuka and labview connections,
+so main.py / main_async.py / other scripts attach to it in milliseconds instead of reconnecting every run
+and the kuka program doesn't have to be restarted between runs
+
+    python trace_and_sweep_v1/robot_link.py            (leave it running, then use_robot_link = True in config.py)
+
+kuka side: connects to KUKA_HOST:KUKA_PORT, reconnects with exponential backoff (up to robot_link_backoff_max)
+    when the connection drops, a dead connection is found by tcp keepalive (robot_link_keepalive) without sending the
+    kuka program anything; with robot_link_heartbeat_command set that is also sent after robot_link_heartbeat seconds
+    idle while no client is attached, no reply within robot_link_timeout counts as a dead connection
+    the link is never torn down for a missing heartbeat while a client is attached
+labview side: listens on WIFI_PORT like main.py does, a dead connection is found by tcp keepalive as on the kuka side
+    (labview may send nothing for a long time, e.g. during a sweep, and can't reconnect on its own, so silence never
+    drops it), then the daemon waits for labview to connect again
+    whatever labview sends is passed on to clients as it arrives, so both labview_framing settings work through the link
+
+clients attach through two local sockets (unix sockets in robot_link_dir, localhost tcp ports robot_link_ports
+where there are none, e.g. windows), with the same line protocols as the real connections:
+    kuka    - one client at a time, it gets "attached" first, then lines are passed to kuka and its replies back,
+              "exit" only detaches the client (kuka keeps running the program)
+              a second client, or any client while kuka is disconnected, gets "busy" / "no kuka" and is closed
+    labview - every client gets every line labview sends, lines from clients go to labview
+"""
+
+import argparse
+import asyncio
+import os
+import socket
+import tempfile
+import time
+from collections import deque
+
+from config import KUKA_HOST, KUKA_PORT, WIFI_HOST, WIFI_PORT, BUFFER_SIZE
+from config import robot_link_dir, robot_link_ports, robot_link_heartbeat, robot_link_timeout, robot_link_backoff_max
+from config import robot_link_keepalive, robot_link_heartbeat_command
+
+LINKS = ["kuka", "labview"]
+BACKOFF_START = .5  # [s] first reconnect delay, doubled after every failed attempt
+
+
+def link_address(name, link_dir=robot_link_dir):
+    """
+    where the daemon listens for name ("kuka" or "labview"): a unix socket path, or ("localhost", port) without AF_UNIX
+    """
+    if hasattr(socket, "AF_UNIX"):
+        return os.path.join(link_dir or tempfile.gettempdir(), f"robot_link_{name}.sock")
+    return "localhost", robot_link_ports[LINKS.index(name)]
+
+
+def connect_link(name, link_dir=robot_link_dir):
+    """
+    blocking socket attached to the daemon's name link
+    """
+    address = link_address(name, link_dir)
+    if isinstance(address, str):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    else:
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    try:
+        sock.connect(address)
+    except OSError as e:
+        sock.close()
+        raise ConnectionError(f"robot link {name} not reachable at {address}, is robot_link.py running? ({e})")
+    if name == "kuka":
+        greeting = b""
+        while not greeting.endswith(b"\n"):
+            data = sock.recv(1)
+            if not data:
+                break
+            greeting += data
+        try:
+            check_greeting(greeting)
+        except ConnectionError:
+            sock.close()
+            raise
+    return sock
+
+
+async def open_link(name, link_dir=robot_link_dir):
+    """
+    asyncio (reader, writer) attached to the daemon's name link
+    """
+    address = link_address(name, link_dir)
+    try:
+        if isinstance(address, str):
+            reader, writer = await asyncio.open_unix_connection(address)
+        else:
+            reader, writer = await asyncio.open_connection(*address)
+    except OSError as e:
+        raise ConnectionError(f"robot link {name} not reachable at {address}, is robot_link.py running? ({e})")
+    if name == "kuka":
+        try:
+            check_greeting(await reader.readline())
+        except ConnectionError:
+            writer.close()
+            raise
+    return reader, writer
+
+
+def check_greeting(line):
+    if line.strip() != b"attached":
+        reason = line.strip().decode() or "connection closed"
+        raise ConnectionError(f"robot link refused the kuka client: {reason}")
+
+
+def enable_keepalive(sock, idle=robot_link_keepalive, interval=1, count=5):
+    """
+    tcp keepalive on sock: after idle seconds without traffic the OS probes the other end every interval seconds,
+    reads fail once count probes went unanswered (windows has a fixed probe count)
+    """
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+    if hasattr(socket, "SIO_KEEPALIVE_VALS"):
+        sock.ioctl(socket.SIO_KEEPALIVE_VALS, (1, int(idle * 1000), int(interval * 1000)))
+        return
+    for option, value in (("TCP_KEEPIDLE", idle), ("TCP_KEEPALIVE", idle), ("TCP_KEEPINTVL", interval), ("TCP_KEEPCNT", count)):
+        if hasattr(socket, option):
+            sock.setsockopt(socket.IPPROTO_TCP, getattr(socket, option), max(int(value), 1))
+
+
+def is_reply(line):
+    """
+    lines that end a kuka command: "reached" after a move / path, "x y z a b c" after send_coordinates
+    """
+    parts = line.split()
+    if parts == [b"reached"]:
+        return True
+    if len(parts) != 6:
+        return False
+    try:
+        [float(p) for p in parts]
+        return True
+    except ValueError:
+        return False
+
+
+def expects_reply(line):
+    return line.split()[:1] in ([b"move"], [b"path"], [b"send_coordinates"])
+
+
+class RobotLink:
+    def __init__(self, kuka_host=KUKA_HOST, kuka_port=KUKA_PORT, labview_host=WIFI_HOST, labview_port=WIFI_PORT,
+                 link_dir=robot_link_dir, heartbeat=robot_link_heartbeat, timeout=robot_link_timeout,
+                 backoff_max=robot_link_backoff_max, heartbeat_command=robot_link_heartbeat_command):
+        self.kuka_host = kuka_host
+        self.kuka_port = kuka_port
+        self.labview_host = labview_host
+        self.labview_port = labview_port
+        self.link_dir = link_dir
+        self.heartbeat = heartbeat
+        self.heartbeat_command = heartbeat_command
+        self.timeout = timeout
+        self.backoff_max = backoff_max
+
+        self.kuka = None            # writer to kuka while connected
+        self.kuka_client = None     # writer of the attached kuka client
+        self.expected = deque()     # who gets each reply kuka still owes: a client writer or "heartbeat"
+        self.heartbeat_sent = None  # when the pending heartbeat went out
+        self.kuka_last = 0.         # last time anything was sent to / received from kuka
+        self.n_reconnects = 0
+        self.n_heartbeats = 0
+
+        self.labview = None         # writer to labview while connected
+        self.labview_clients = set()
+        self.servers = []
+        self.done = False
+
+    async def start(self):
+        for name, handler in (("kuka", self.serve_kuka_client), ("labview", self.serve_labview_client)):
+            address = link_address(name, self.link_dir)
+            if isinstance(address, str):
+                self.remove_stale(address)
+                server = await asyncio.start_unix_server(handler, address)
+            else:
+                server = await asyncio.start_server(handler, *address)
+            self.servers.append(server)
+            print(f"robot link: {name} clients attach at {address}")
+        self.servers.append(await asyncio.start_server(self.serve_labview, self.labview_host, self.labview_port))
+        print(f"robot link: waiting for labview on port {self.labview_port}")
+
+    @staticmethod
+    def remove_stale(path):
+        """
+        removes a socket file left behind by a daemon that didn't shut down cleanly, refuses if one is still running
+        """
+        if not os.path.exists(path):
+            return
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            probe.connect(path)
+        except OSError:
+            os.remove(path)
+            return
+        finally:
+            probe.close()
+        raise RuntimeError(f"another robot link is already running at {path}")
+
+    async def run(self):
+        await self.start()
+        try:
+            await asyncio.gather(self.kuka_loop(), self.heartbeat_loop())
+        finally:
+            await self.stop()
+
+    async def stop(self):
+        self.done = True
+        if self.kuka is not None:
+            # the only place the daemon ends the kuka program
+            self.kuka.write(b"exit\n")
+            await self.kuka.drain()
+            self.kuka.close()
+        for server in self.servers:
+            server.close()
+        for name in LINKS:
+            address = link_address(name, self.link_dir)
+            if isinstance(address, str) and os.path.exists(address):
+                os.remove(address)
+        print("robot link stopped")
+
+    # kuka
+
+    async def kuka_loop(self):
+        """
+        keeps kuka connected: connect, pass replies on until the connection drops, wait, reconnect
+        """
+        delay = BACKOFF_START
+        while not self.done:
+            try:
+                reader, writer = await asyncio.wait_for(asyncio.open_connection(self.kuka_host, self.kuka_port), self.timeout)
+            except (OSError, asyncio.TimeoutError) as e:
+                print(f"robot link: kuka not reachable at {self.kuka_host}:{self.kuka_port} ({e!r}), retrying in {delay:.1f}s")
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, self.backoff_max)
+                continue
+
+            writer.get_extra_info("socket").setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            enable_keepalive(writer.get_extra_info("socket"))
+            print(f"robot link: connected to kuka at {self.kuka_host}:{self.kuka_port}")
+            delay = BACKOFF_START
+            self.kuka = writer
+            self.kuka_last = time.monotonic()
+            try:
+                while True:
+                    line = await reader.readline()
+                    if not line:
+                        break
+                    self.kuka_last = time.monotonic()
+                    self.route_kuka_reply(line)
+            except OSError as e:
+                print(f"robot link: kuka connection error: {e}")
+            finally:
+                print("robot link: kuka connection lost")
+                self.kuka = None
+                self.expected.clear()
+                self.heartbeat_sent = None
+                self.n_reconnects += 1
+                writer.close()
+                # the attached client can't know what happened to its last move, make it notice
+                self.detach_kuka_client()
+
+    def route_kuka_reply(self, line):
+        owner = self.kuka_client
+        if is_reply(line.strip()) and self.expected:
+            owner = self.expected.popleft()
+        if owner == "heartbeat":
+            self.heartbeat_sent = None
+        elif owner is not None and owner is self.kuka_client:
+            owner.write(line)
+
+    async def heartbeat_loop(self):
+        """
+        sends heartbeat_command while kuka is idle and no client is attached, only then can a missing reply close the link
+        """
+        if self.heartbeat_command is None:
+            return
+        while not self.done:
+            await asyncio.sleep(min(self.heartbeat, self.timeout) / 4)
+            if self.kuka is None or self.kuka_client is not None:
+                continue
+            t = time.monotonic()
+            if self.heartbeat_sent is not None:
+                if t - self.heartbeat_sent > self.timeout:
+                    print(f"robot link: no heartbeat reply from kuka for {self.timeout}s, reconnecting")
+                    self.kuka.close()
+            elif not self.expected and t - self.kuka_last > self.heartbeat:
+                self.expected.append("heartbeat")
+                self.heartbeat_sent = t
+                self.kuka_last = t
+                self.n_heartbeats += 1
+                self.kuka.write(f"{self.heartbeat_command}\n".encode())
+
+    async def heartbeat_replied(self):
+        """
+        waits for the reply to a heartbeat still on its way, so it can't be taken for a client's reply
+        False if none came within timeout
+        """
+        while self.heartbeat_sent is not None and self.kuka is not None:
+            if time.monotonic() - self.heartbeat_sent > self.timeout:
+                return False
+            await asyncio.sleep(.01)
+        return True
+
+    async def serve_kuka_client(self, reader, writer):
+        if self.kuka_client is not None or self.kuka is None:
+            writer.write(b"busy\n" if self.kuka is not None else b"no kuka\n")
+            writer.close()
+            return
+        self.kuka_client = writer
+        if not await self.heartbeat_replied():
+            # not attached yet, so dropping the link here doesn't cut off anyone's moves
+            print(f"robot link: no heartbeat reply from kuka for {self.timeout}s, reconnecting")
+            self.kuka.close()
+            self.kuka_client = None
+            writer.write(b"no kuka\n")
+            writer.close()
+            return
+        writer.write(b"attached\n")
+        print("robot link: kuka client attached")
+        try:
+            while True:
+                line = await reader.readline()
+                if not line or line.strip().lower() == b"exit":
+                    break
+                if self.kuka is None:
+                    print("robot link: kuka not connected, dropping client")
+                    break
+                if expects_reply(line.strip().lower()):
+                    self.expected.append(writer)
+                self.kuka_last = time.monotonic()
+                self.kuka.write(line if line.endswith(b"\n") else line + b"\n")
+        except OSError:
+            pass
+        finally:
+            if self.kuka_client is writer:
+                self.detach_kuka_client()
+
+    def detach_kuka_client(self):
+        if self.kuka_client is not None:
+            print("robot link: kuka client detached")
+            self.kuka_client.close()
+            self.kuka_client = None
+
+    # labview
+
+    async def serve_labview(self, reader, writer):
+        """
+        labview connected to the daemon, the newest connection replaces an older one
+        """
+        if self.labview is not None:
+            print("robot link: labview connected again, dropping the old connection")
+            self.labview.close()
+        self.labview = writer
+        enable_keepalive(writer.get_extra_info("socket"))
+        print(f"robot link: labview connected from {writer.get_extra_info('peername')}")
+        try:
+            while True:
+                data = await reader.read(BUFFER_SIZE)
+                if not data:
+                    break
+                for client in list(self.labview_clients):
+                    if client.is_closing():
+                        self.labview_clients.discard(client)
+                    else:
+                        client.write(data)
+        except OSError as e:
+            print(f"robot link: labview connection error: {e}")
+        finally:
+            print("robot link: labview connection lost, waiting for it to connect again")
+            writer.close()
+            if self.labview is writer:
+                self.labview = None
+
+    async def serve_labview_client(self, reader, writer):
+        self.labview_clients.add(writer)
+        print(f"robot link: labview client attached ({len(self.labview_clients)} attached)")
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                if self.labview is not None:
+                    self.labview.write(line)
+        except OSError:
+            pass
+        finally:
+            self.labview_clients.discard(writer)
+            writer.close()
+            print("robot link: labview client detached")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="keeps the kuka and labview connections open for clients to attach to")
+    parser.add_argument("--kuka-host", default=KUKA_HOST)
+    parser.add_argument("--kuka-port", type=int, default=KUKA_PORT)
+    parser.add_argument("--labview-port", type=int, default=WIFI_PORT)
+    parser.add_argument("--link-dir", default=robot_link_dir, help="folder for the client sockets (one per daemon)")
+    args = parser.parse_args()
+
+    link = RobotLink(kuka_host=args.kuka_host, kuka_port=args.kuka_port, labview_port=args.labview_port,
+                     link_dir=args.link_dir)
+    try:
+        asyncio.run(link.run())
+    except KeyboardInterrupt:
+        pass
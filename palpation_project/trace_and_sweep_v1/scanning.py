@@ -0,0 +1,113 @@
+"""
+helpers for continuous scanning: one linear move per row (or per segment of a row) while labview streams encoder samples
+each sample is matched to where the robot was when it was received, assuming constant speed along the move
+"""
+
+import numpy as np
+
+from config import xspan, yspan, d, scan_segment, scan_segment_margin
+
+
+def serpentine_rows(xspan=xspan, yspan=yspan, d=d):
+    """
+    row start/end points in the same order trace visits points:
+    rows along y stepping x by d (alternating direction), or a single row along x for line traces (yspan = 0)
+    """
+    if yspan == 0:
+        return [((0, 0), (xspan, 0))]
+
+    rows = []
+    x = 0
+    while x <= xspan:
+        if len(rows) % 2 == 0:
+            rows.append(((x, 0), (x, yspan)))
+        else:
+            rows.append(((x, yspan), (x, 0)))
+        x += d
+    return rows
+
+
+def trace_points(xspan=xspan, yspan=yspan, d=d):
+    """
+    grid points of a trace in serpentine order, d apart along each of the serpentine_rows
+    """
+    for (x0, y0), (x1, y1) in serpentine_rows(xspan, yspan, d):
+        length = max(abs(x1 - x0), abs(y1 - y0))
+        for t in np.arange(0, length + d / 2, d) / max(length, d):
+            yield float(x0 + t * (x1 - x0)), float(y0 + t * (y1 - y0))
+
+
+def samples_to_profile(samples, t_start, t_end, start, end, z, e0, min_deflection=None, motion=None):
+    """
+    samples: (timestamp, encoder_value) pairs received while the robot moved from start to end at height z
+    t_start, t_end: when the move was sent and when kuka reported "reached"
+    motion: MoveTimeModel for where the robot was at each sample (latency, acceleration), constant speed if None
+    returns array of [x, y, z + encoder_deflection] for every sample taken during the move,
+    dropping samples where encoder_deflection < min_deflection (VCA lost contact with the surface),
+    every sample is kept with min_deflection None (hybrid scans check the range on them, see first_out_of_range)
+    """
+    samples = np.asarray(samples, dtype=float).reshape(-1, 2)
+    t, encoder_value = samples[:, 0], samples[:, 1]
+    during_move = (t >= t_start) & (t <= t_end)
+    t, encoder_value = t[during_move], encoder_value[during_move]
+
+    if motion is None:
+        frac = (t - t_start) / (t_end - t_start)
+    else:
+        frac = motion.fraction_done(t - t_start, t_end - t_start, float(np.hypot(end[0] - start[0], end[1] - start[1])))
+    x = start[0] + frac * (end[0] - start[0])
+    y = start[1] + frac * (end[1] - start[1])
+    encoder_deflection = (e0 - encoder_value) / 1000
+    profile = np.column_stack([x, y, z + encoder_deflection])
+    if min_deflection is None:
+        return profile
+    return profile[encoder_deflection >= min_deflection]
+
+
+def step_along(position, end, distance):
+    """
+    (x, y) distance further from position towards end, end itself if that's closer
+    """
+    position, end = np.asarray(position, dtype=float), np.asarray(end, dtype=float)
+    remaining = np.linalg.norm(end - position)
+    if remaining <= distance:
+        return float(end[0]), float(end[1])
+    x, y = position + (end - position) * distance / remaining
+    return float(x), float(y)
+
+
+def profile_slope(profile, window):
+    """
+    [mm/mm] rise of the surface per mm along the last window mm of a segment's profile, None if too few samples
+    """
+    profile = np.asarray(profile, dtype=float).reshape(-1, 3)
+    if len(profile) < 3:
+        return None
+    s = np.hypot(profile[:, 0] - profile[-1, 0], profile[:, 1] - profile[-1, 1])
+    tail = s <= window
+    if tail.sum() < 3 or np.ptp(s[tail]) < window / 4:
+        return None
+    # s grows backwards from the last sample, so the rise along the move is minus the fitted slope
+    return -float(np.polyfit(s[tail], profile[tail, 2], 1)[0])
+
+
+def segment_length(deflection, slope, min_deflection, max_deflection, shortest=d, longest=scan_segment,
+                   margin=scan_segment_margin):
+    """
+    [mm] how far the next segment can go before the VCA would leave min_deflection..max_deflection
+    deflection: VCA deflection where it starts, slope: [mm/mm] surface rise along the row (None: not known)
+    only margin of the travel left is used since the slope changes along the way, but never less than shortest
+    """
+    if slope is None or slope == 0:
+        return longest
+    travel = max_deflection - deflection if slope > 0 else deflection - min_deflection
+    return float(np.clip(margin * travel / abs(slope), shortest, longest))
+
+
+def first_out_of_range(deflection, min_deflection, max_deflection):
+    """
+    index of the first encoder deflection outside min_deflection..max_deflection
+    (VCA lost contact or saturated), None if they are all in range
+    """
+    out = np.flatnonzero((deflection < min_deflection) | (deflection > max_deflection))
+    return int(out[0]) if len(out) else None
@@ -0,0 +1,89 @@
+"""
+simulated surface and robot for testing trace logic without the kuka or labview
+
+SimSurface gives the true surface height at any x,y from a recorded surface (surface store run or csv)
+SimKuka is a Kuka whose moves update encoder_value from that surface instead of going over TCP
+"""
+
+import os
+import numpy as np
+
+from kuka import Kuka
+from surface_store import SurfaceStore
+from global_state import GlobalState
+from dummy_kuka_server import SPEED, LATENCY
+
+
+class SimSurface:
+    def __init__(self, positions):
+        self.positions = np.asarray(positions, dtype=float)
+        x, y, _ = self.positions.T
+        # recorded traces are mostly single lines, interpolate along whichever axis varies
+        if np.ptp(y) == 0:
+            self.axis = 0
+        elif np.ptp(x) == 0:
+            self.axis = 1
+        else:
+            self.axis = None
+        if self.axis is not None:
+            order = np.argsort(self.positions[:, self.axis])
+            self.line = self.positions[order]
+
+    @classmethod
+    def from_csv(cls, path):
+        return cls(np.loadtxt(path, delimiter=",", skiprows=1, ndmin=2))
+
+    @classmethod
+    def most_recent(cls, folder="surface_data", prefix="surface_data", min_points=10):
+        store = SurfaceStore(folder)
+        for run in reversed(store.runs(prefix)):
+            if run["n_points"] >= min_points:
+                return cls(store.load(run["run_id"]))
+
+        # csv files that haven't been imported into the store
+        files = [
+            os.path.join(folder, f)
+            for f in os.listdir(folder)
+            if f.startswith(prefix) and f.lower().endswith(".csv")
+        ]
+        # filenames end in the save time, so sorting by name is chronological (mtimes aren't after a git checkout)
+        for path in sorted(files, reverse=True):
+            surface = cls.from_csv(path)
+            if len(surface.positions) >= min_points:
+                return surface
+        raise FileNotFoundError(f"no {prefix} files with at least {min_points} points in {folder}")
+
+    def height(self, x, y):
+        if self.axis is not None:
+            q = (x, y)[self.axis]
+            return float(np.interp(q, self.line[:, self.axis], self.line[:, 2]))
+        d2 = (self.positions[:, 0] - x)**2 + (self.positions[:, 1] - y)**2
+        return float(self.positions[np.argmin(d2), 2])
+
+
+class SimKuka(Kuka):
+    """
+    encoder_value = e0 - (surface - z) * 1000 while the VCA is pressed into the surface
+    move_time adds up the time the real robot would have spent moving (see dummy_kuka_server)
+    """
+    def __init__(self, surface: SimSurface, e0=50000., speed=SPEED, latency=LATENCY):
+        super().__init__(GlobalState(), no_connect=True)
+        self.surface = surface
+        self.e0 = e0
+        self.speed = speed
+        self.latency = latency
+        self.move_time = 0.
+        self.g_state.labview_connected = True
+        self.g_state.encoder_value = e0
+
+    def async_move(self, x, y, z, waiting_time=None, fixed_wait=.5):
+        distance = np.linalg.norm(np.subtract([x, y, z], self.position))
+        self.move_time += self.latency + distance / self.speed
+        self.n_moves += 1
+        self.position = [x, y, z]
+        self.update_encoder()
+
+    def update_encoder(self):
+        x, y, z = self.position
+        compression = max(self.surface.height(x, y) - z, 0)
+        self.g_state.encoder_value = self.e0 - compression * 1000
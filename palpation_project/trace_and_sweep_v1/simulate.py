@@ -0,0 +1,66 @@
+"""
+runs main.py unchanged against dummy_kuka_server and dummy_labview_client, no robot or labview needed
+
+the dummy labview streams encoder values from the most recent recorded surface and switches to sweep mode
+when kuka_state becomes "sweep" (labview_mode_signal is turned on for the simulation), so runs with skip_trace
+or register_surface that never ask to continue to sweep get there too
+output goes to sim_output/surface_data so simulated surfaces don't get mixed up with real ones
+"""
+
+import builtins
+import os
+import runpy
+
+# point the kuka connection at the dummy server before anything imports kuka.py
+import config
+config.KUKA_HOST = 'localhost'
+# python sends "mode sweep" when kuka_state becomes "sweep", the dummy labview switches over on it
+config.labview_mode_signal = True
+# the dummy labview client ends every message with \n
+config.labview_framing = "newline"
+
+from dummy_kuka_server import DummyKukaServer
+from dummy_labview_client import DummyLabviewClient
+from sim_surface import SimSurface
+
+SIM_SPEED = 500          # [mm/s] dummy kuka speed, 10x the default for faster than real time runs
+SIM_LATENCY = .002       # [s] dummy kuka latency per move
+SIM_SURFACE_FILE = None  # surface_data csv to simulate, None for the most recent recorded surface
+AUTO_CONTINUE = True     # answer main.py's "press enter" prompts automatically
+SIM_OUTPUT = "sim_output"
+
+
+def main():
+    here = os.path.dirname(os.path.abspath(__file__))
+    if SIM_SURFACE_FILE is None:
+        surface = SimSurface.most_recent(folder=os.path.join(here, "..", "surface_data"))
+    else:
+        surface = SimSurface.from_csv(SIM_SURFACE_FILE)
+
+    kuka_server = DummyKukaServer(host=config.KUKA_HOST, port=config.KUKA_PORT, speed=SIM_SPEED, latency=SIM_LATENCY)
+    kuka_server.start()
+    labview = DummyLabviewClient(kuka_server, surface, port=config.WIFI_PORT)
+    labview.start()
+
+    real_input = builtins.input
+    def sim_input(prompt=""):
+        if AUTO_CONTINUE:
+            print(prompt)
+        else:
+            real_input(prompt)
+        return ""
+    builtins.input = sim_input
+
+    os.makedirs(os.path.join(SIM_OUTPUT, "surface_data"), exist_ok=True)
+    os.chdir(SIM_OUTPUT)
+    try:
+        runpy.run_path(os.path.join(here, "main.py"), run_name="__main__")
+    finally:
+        builtins.input = real_input
+        labview.done = True
+
+    print(f"simulation done: {kuka_server.n_moves} kuka moves, {labview.n_sent} labview messages, {labview.n_sweeps} sweeps")
+
+
+if __name__ == "__main__":
+    main()
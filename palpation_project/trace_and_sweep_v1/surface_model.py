@@ -0,0 +1,208 @@
+"""
+gridded heightmap of a traced surface, so anything can ask "what is z at x, y?" (sweep planning, clearance moves, analytics)
+
+SurfaceModel turns the scattered [x, y, z] trace points into heights on a regular grid (resolution apart):
+    - every point is put on its nearest node of a grid with the trace's own spacing (mean if several land on the same node)
+    - nodes without a point are filled from their neighbors, then relaxed towards the average of their 4 neighbors
+      (laplace interpolation) while the measured nodes stay fixed
+    - that grid is interpolated bilinearly down to resolution
+    - line traces (all points on one x or y line) are interpolated linearly along the line
+queries are bilinear on the grid and take arrays, so thousands of points cost about as much as one
+
+load_model builds the model for a surface store run once and caches it, in memory and as surface_data/<run id>.model_<resolution>.npz
+"""
+
+import os
+import numpy as np
+
+from config import surface_model_resolution, surface_model_iterations
+from surface_store import SurfaceStore
+
+
+class SurfaceModel:
+    def __init__(self, x_grid, y_grid, heights):
+        """
+        heights[j, i] is z at (x_grid[i], y_grid[j]), both grids evenly spaced with at least 2 values
+        use from_points to build one from trace points
+        """
+        self.x_grid = np.asarray(x_grid, dtype=float)
+        self.y_grid = np.asarray(y_grid, dtype=float)
+        self.heights = np.asarray(heights, dtype=float)
+        self.dx = self.x_grid[1] - self.x_grid[0]
+        self.dy = self.y_grid[1] - self.y_grid[0]
+        self.slope_y, self.slope_x = np.gradient(self.heights, self.dy, self.dx)
+        # laplacian, > 0 in dips, < 0 on bumps and ridges
+        self.laplacian = np.gradient(self.slope_x, self.dx, axis=1) + np.gradient(self.slope_y, self.dy, axis=0)
+
+    @classmethod
+    def from_points(cls, positions, resolution=surface_model_resolution, iterations=surface_model_iterations):
+        points = np.asarray(positions, dtype=float).reshape(-1, 3)
+        if len(points) == 0:
+            raise ValueError("no points to build a surface model from")
+        x, y, z = points.T
+        x_grid = cls.axis(x, resolution)
+        y_grid = cls.axis(y, resolution)
+
+        if np.ptp(y) == 0 or np.ptp(x) == 0:
+            # line trace, interpolate along the line and repeat it across the other axis
+            along, grid = (x, x_grid) if np.ptp(y) == 0 else (y, y_grid)
+            order = np.argsort(along)
+            line = np.interp(grid, along[order], z[order])
+            heights = np.tile(line, (2, 1)) if np.ptp(y) == 0 else np.tile(line[:, None], (1, 2))
+            return cls(x_grid, y_grid, heights)
+
+        # fill on the trace's own lattice first (d for uniform traces, d_min for adaptive ones), so measured nodes
+        # aren't isolated in a fine grid, then refine to resolution bilinearly
+        step = cls.lattice_step(x, y, resolution)
+        x_lattice, y_lattice = cls.axis(x, step), cls.axis(y, step)
+        coarse = cls(x_lattice, y_lattice, cls.fill(x, y, z, x_lattice, y_lattice, iterations))
+        if step == resolution:
+            return coarse
+        x_fine, y_fine = np.meshgrid(x_grid, y_grid)
+        return cls(x_grid, y_grid, coarse.height(x_fine, y_fine))
+
+    @staticmethod
+    def axis(values, resolution):
+        """
+        grid from min to max of values, resolution apart, at least 2 nodes
+        """
+        n = max(int(np.ceil(np.ptp(values) / resolution - 1e-9)) + 1, 2)
+        return values.min() + np.arange(n) * resolution
+
+    @staticmethod
+    def lattice_step(x, y, resolution):
+        """
+        smallest spacing between distinct x or y values of the points, at least resolution
+        """
+        steps = [np.diff(u).min() for u in (np.unique(np.round(x, 6)), np.unique(np.round(y, 6))) if len(u) > 1]
+        return max(min(steps), resolution)
+
+    @staticmethod
+    def fill(x, y, z, x_grid, y_grid, iterations):
+        """
+        heights on the grid from scattered points: nearest node, grow into empty nodes, then laplace relaxation
+        """
+        shape = (len(y_grid), len(x_grid))
+        i = np.clip(np.rint((x - x_grid[0]) / (x_grid[1] - x_grid[0])).astype(int), 0, shape[1] - 1)
+        j = np.clip(np.rint((y - y_grid[0]) / (y_grid[1] - y_grid[0])).astype(int), 0, shape[0] - 1)
+        total = np.zeros(shape)
+        count = np.zeros(shape)
+        np.add.at(total, (j, i), z)
+        np.add.at(count, (j, i), 1)
+        known = count > 0
+        heights = np.where(known, total / np.maximum(count, 1), 0.)
+
+        # grow: every empty node next to a filled one gets the mean of its filled neighbors
+        filled = known.copy()
+        while not filled.all():
+            h = np.pad(np.where(filled, heights, 0.), 1)
+            f = np.pad(filled, 1).astype(float)
+            neighbor_sum = h[:-2, 1:-1] + h[2:, 1:-1] + h[1:-1, :-2] + h[1:-1, 2:]
+            neighbor_count = f[:-2, 1:-1] + f[2:, 1:-1] + f[1:-1, :-2] + f[1:-1, 2:]
+            grow = ~filled & (neighbor_count > 0)
+            heights[grow] = neighbor_sum[grow] / neighbor_count[grow]
+            filled |= grow
+
+        # relax: empty nodes move to the mean of their 4 neighbors (edges mirrored), measured nodes stay
+        for _ in range(iterations):
+            h = np.pad(heights, 1, mode="edge")
+            mean = (h[:-2, 1:-1] + h[2:, 1:-1] + h[1:-1, :-2] + h[1:-1, 2:]) / 4
+            heights = np.where(known, heights, mean)
+        return heights
+
+    def cell(self, x, y):
+        """
+        indexes of the grid cell containing x, y and the position inside it (0..1), points outside are clamped to the edge
+        """
+        fx = np.clip((np.asarray(x, dtype=float) - self.x_grid[0]) / self.dx, 0, len(self.x_grid) - 1)
+        fy = np.clip((np.asarray(y, dtype=float) - self.y_grid[0]) / self.dy, 0, len(self.y_grid) - 1)
+        i = np.minimum(fx.astype(int), len(self.x_grid) - 2)
+        j = np.minimum(fy.astype(int), len(self.y_grid) - 2)
+        return i, j, fx - i, fy - j
+
+    def bilinear(self, grid, x, y):
+        i, j, tx, ty = self.cell(x, y)
+        return ((1 - tx) * (1 - ty) * grid[j, i] + tx * (1 - ty) * grid[j, i + 1]
+                + (1 - tx) * ty * grid[j + 1, i] + tx * ty * grid[j + 1, i + 1])
+
+    def height(self, x, y):
+        """
+        z at x, y, arrays in, array out (scalars in, float out)
+        """
+        return self.bilinear(self.heights, x, y)
+
+    def gradient(self, x, y):
+        """
+        (dz/dx, dz/dy) at x, y
+        """
+        return self.bilinear(self.slope_x, x, y), self.bilinear(self.slope_y, x, y)
+
+    def normal(self, x, y):
+        """
+        unit surface normal (pointing up, +z) at x, y, shape (..., 3)
+        """
+        gx, gy = self.gradient(x, y)
+        n = np.stack([-gx, -gy, np.ones_like(gx)], axis=-1)
+        return n / np.linalg.norm(n, axis=-1, keepdims=True)
+
+    def slope(self, x, y):
+        """
+        [deg] angle between the surface and the xy plane at x, y
+        """
+        gx, gy = self.gradient(x, y)
+        return np.degrees(np.arctan(np.hypot(gx, gy)))
+
+    def curvature(self, x, y):
+        """
+        [1/mm] mean curvature (laplacian of z) at x, y, positive in dips, negative on bumps
+        """
+        return self.bilinear(self.laplacian, x, y)
+
+    def smoothed(self, radius):
+        """
+        SurfaceModel of the mean height within +-radius [mm] of every grid node (box filter)
+        """
+        rx = max(int(round(radius / self.dx)), 1)
+        ry = max(int(round(radius / self.dy)), 1)
+        # box sums from a summed area table, edges padded with the edge heights
+        h = np.pad(self.heights, ((ry + 1, ry), (rx + 1, rx)), mode="edge")
+        h[0, :] = 0
+        h[:, 0] = 0
+        table = h.cumsum(axis=0).cumsum(axis=1)
+        ny, nx = self.heights.shape
+        box = (table[2 * ry + 1:, 2 * rx + 1:] - table[:ny, 2 * rx + 1:]
+               - table[2 * ry + 1:, :nx] + table[:ny, :nx])
+        return SurfaceModel(self.x_grid, self.y_grid, box / ((2 * rx + 1) * (2 * ry + 1)))
+
+    def save(self, path):
+        np.savez(path, x_grid=self.x_grid, y_grid=self.y_grid, heights=self.heights)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            return cls(data["x_grid"], data["y_grid"], data["heights"])
+
+
+_models = {}
+
+
+def load_model(run_id=None, prefix="surface_data", folder="surface_data", resolution=surface_model_resolution):
+    """
+    SurfaceModel of a surface store run (the most recent one with prefix if run_id is None)
+    runs never change once saved, so the model is only built the first time and then comes from the cache
+    """
+    store = SurfaceStore(folder)
+    if run_id is None:
+        run_id = store.latest(prefix)
+        if run_id is None:
+            raise FileNotFoundError(f"no {prefix} runs found")
+
+    key = (os.path.abspath(folder), run_id, resolution)
+    if key not in _models:
+        path = os.path.join(folder, f"{run_id}.model_{resolution}.npz")
+        if os.path.isfile(path):
+            _models[key] = SurfaceModel.load(path)
+        else:
+            _models[key] = SurfaceModel.from_points(store.load(run_id), resolution)
+            _models[key].save(path)
+    return _models[key]
@@ -0,0 +1,364 @@
+"""
+indexed binary storage for recorded surfaces (replaces one csv per trace in surface_data/)
+
+surface_data/index.json is the manifest: one entry per run (run id, save time, grid params, point count)
+and the latest run id for every prefix, so "most recent surface" is one lookup instead of
+listing the folder and checking every file's mtime
+each run's points are in surface_data/<run id>.npy as an (n, 3) float array of x, y, z,
+loaded memory mapped so even a dense scan is not parsed at all
+
+a trace in progress is journaled to surface_data/<run id>.journal.csv, one line per point written and
+fsynced as soon as the point is recorded, and listed under "partial" in the index until it finishes
+an interrupted trace can be picked up again from the journal (RunWriter, SurfaceStore.resume_run)
+
+index.json is only changed under a lock file (index.json.lock), re-read and written back in one go,
+so several processes saving to the same folder (jobs.py next to main.py, benchmark.py, ...) keep each other's runs
+
+old csv files can be imported, and runs exported back to csv for excel (into surface_exports/, not the store folder,
+so an export is never imported again as a new run):
+    python surface_store.py import [folder]
+    python surface_store.py export <run id> [path]
+    python surface_store.py list [folder]
+"""
+
+import datetime
+import json
+import os
+import sys
+import time
+import numpy as np
+
+INDEX_FILE = "index.json"
+INDEX_VERSION = 1
+LOCK_TIMEOUT = 10   # [s] give up waiting for another process's index lock after this long
+STALE_LOCK = 60     # [s] a lock file this old is left over from a crash and taken over
+EXPORT_FOLDER = "surface_exports"
+JOURNAL_COLUMNS = ["index", "x", "y", "z", "e0", "encoder_value", "time"]
+# grid params that decide which points a trace visits, a run is only resumed if these match
+RESUME_KEYS = ["trace_mode", "xspan", "yspan", "d", "d_coarse", "d_min", "tolerance"]
+
+
+class RunWriter:
+    """
+    appends every recorded point of a trace to its journal right away, so a crash loses at most the point in progress
+    positions: [x, y, z] of every point recorded so far (including the ones from before a resume)
+    next_index: grid index of the first point that still has to be measured
+    """
+    def __init__(self, store, run_id, positions=None, next_index=0):
+        self.store = store
+        self.run_id = run_id
+        self.path = os.path.join(store.folder, store.index["partial"][run_id]["journal"])
+        self.positions = positions if positions is not None else []
+        self.next_index = next_index
+        self.last_append = None  # time of the last point journaled by this writer
+        self.file = open(self.path, "a", encoding="utf-8")
+
+    def append(self, index, x, y, z, e0=None, encoder_value=None):
+        self.last_append = time.time()
+        values = [index, x, y, z, e0, encoder_value, self.last_append]
+        self.file.write(",".join("" if v is None else str(v) for v in values) + "\n")
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.positions.append([x, y, z])
+        self.next_index = index + 1
+
+    def close(self):
+        """
+        closes the journal and notes when the last point was written in the run's partial index entry
+        """
+        if self.file.closed:
+            return
+        self.file.close()
+        if self.last_append is not None:
+            def note_last_append(index):
+                if self.run_id in index["partial"]:
+                    index["partial"][self.run_id]["last_append"] = self.last_append
+            self.store.update_index(note_last_append)
+
+    def finish(self):
+        """
+        moves the run from partial to a normal run (.npy + index entry), the journal is kept
+        returns the run id
+        """
+        self.close()
+        return self.store.finish_run(self.run_id, self.positions)
+
+
+class IndexLock:
+    """
+    lock file next to index.json, created exclusively so only one process holds it (works on windows too)
+    """
+    def __init__(self, path, timeout=LOCK_TIMEOUT):
+        self.path = path
+        self.timeout = timeout
+
+    def __enter__(self):
+        deadline = time.monotonic() + self.timeout
+        while True:
+            try:
+                os.close(os.open(self.path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+                return self
+            except FileExistsError:
+                pass
+            try:
+                if time.time() - os.path.getmtime(self.path) > STALE_LOCK:
+                    print(f"removing stale lock {self.path}")
+                    os.remove(self.path)
+                    continue
+            except FileNotFoundError:
+                continue
+            if time.monotonic() > deadline:
+                raise TimeoutError(f"{self.path} is held by another process, remove it if nothing else is saving")
+            time.sleep(.01)
+
+    def __exit__(self, *exc):
+        os.remove(self.path)
+
+
+class SurfaceStore:
+    def __init__(self, folder="surface_data"):
+        self.folder = folder
+        self.index_path = os.path.join(folder, INDEX_FILE)
+        self.index = self.read_index()
+
+    def read_index(self):
+        if not os.path.isfile(self.index_path):
+            return {"version": INDEX_VERSION, "runs": {}, "latest": {}, "partial": {}}
+        with open(self.index_path, encoding="utf-8") as f:
+            index = json.load(f)
+        if index.get("version") != INDEX_VERSION:
+            raise ValueError(f"{self.index_path} has version {index.get('version')}, expected {INDEX_VERSION}")
+        index.setdefault("partial", {})
+        return index
+
+    def write_index(self):
+        # write then rename, so a crash mid-write never leaves a half written index
+        tmp = self.index_path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self.index, f, indent=1)
+        os.replace(tmp, self.index_path)
+
+    def update_index(self, change):
+        """
+        re-reads index.json, applies change(index) and writes it back while holding the index lock,
+        so runs other processes added since this store was created are kept
+        self.index is the merged index afterwards, returns what change returned
+        """
+        os.makedirs(self.folder, exist_ok=True)
+        with IndexLock(self.index_path + ".lock"):
+            self.index = self.read_index()
+            result = change(self.index)
+            self.write_index()
+        return result
+
+    def runs(self, prefix=None):
+        """
+        manifest entries, oldest first, only those starting with prefix if given
+        """
+        runs = sorted(self.index["runs"].values(), key=lambda run: run["timestamp"])
+        if prefix is not None:
+            runs = [run for run in runs if run["prefix"] == prefix]
+        return runs
+
+    def new_run_id(self, prefix, timestamp):
+        formatted_time = datetime.datetime.fromtimestamp(timestamp).strftime("%Y-%m-%d_%H-%M-%S")
+        run_id = f"{prefix}_{formatted_time}"
+        n = 2
+        while run_id in self.index["runs"] or run_id in self.index["partial"]:
+            run_id = f"{prefix}_{formatted_time}_{n}"
+            n += 1
+        return run_id
+
+    def save(self, positions, prefix="surface_data", grid=None, timestamp=None, source=None, run_id=None, journal=None):
+        """
+        positions: (n, 3) x, y, z
+        grid: trace params worth keeping with the data (xspan, yspan, d, ...)
+        journal: journal file of the run, when it finishes a partial one
+        returns the run id
+        """
+        positions = np.asarray(positions, dtype=float).reshape(-1, 3)
+        if timestamp is None:
+            timestamp = time.time()
+
+        def add_run(index):
+            # the run id is picked under the lock, so two processes saving at once can't both take it
+            new_id = run_id if run_id is not None else self.new_run_id(prefix, timestamp)
+            filename = new_id + ".npy"
+            tmp = os.path.join(self.folder, filename + ".tmp")
+            with open(tmp, "wb") as f:
+                np.save(f, positions)
+            os.replace(tmp, os.path.join(self.folder, filename))
+
+            run = {
+                "run_id": new_id,
+                "prefix": prefix,
+                "time": datetime.datetime.fromtimestamp(timestamp).isoformat(timespec="seconds"),
+                "timestamp": timestamp,
+                "file": filename,
+                "n_points": len(positions),
+                "grid": grid or {},
+            }
+            if source is not None:
+                run["source"] = source
+            if journal is not None:
+                run["journal"] = journal
+            index["partial"].pop(new_id, None)
+            index["runs"][new_id] = run
+            latest = index["latest"].get(prefix)
+            if latest is None or timestamp >= index["runs"][latest]["timestamp"]:
+                index["latest"][prefix] = new_id
+            return new_id
+
+        return self.update_index(add_run)
+
+    def latest(self, prefix="surface_data"):
+        """
+        run id of the most recent run with this prefix, None if there are none
+        """
+        return self.index["latest"].get(prefix)
+
+    def load(self, run_id, mmap=True):
+        """
+        (n, 3) array of x, y, z, read only and memory mapped unless mmap is False
+        """
+        run = self.index["runs"][run_id]
+        return np.load(os.path.join(self.folder, run["file"]), mmap_mode="r" if mmap else None)
+
+    def begin_run(self, prefix="surface_data", grid=None):
+        """
+        starts a journaled run, returns its RunWriter
+        """
+        timestamp = time.time()
+
+        def add_partial(index):
+            run_id = self.new_run_id(prefix, timestamp)
+            journal = run_id + ".journal.csv"
+            with open(os.path.join(self.folder, journal), "w", encoding="utf-8") as f:
+                f.write(",".join(JOURNAL_COLUMNS) + "\n")
+            index["partial"][run_id] = {
+                "run_id": run_id,
+                "prefix": prefix,
+                "time": datetime.datetime.fromtimestamp(timestamp).isoformat(timespec="seconds"),
+                "timestamp": timestamp,
+                "journal": journal,
+                "grid": grid or {},
+            }
+            return run_id
+
+        return RunWriter(self, self.update_index(add_partial))
+
+    def interrupted(self, prefix="surface_data", grid=None, max_age=None):
+        """
+        run id of the most recent unfinished run with this prefix and the same RESUME_KEYS grid params, None if there is none
+        max_age: [s] runs interrupted (last point journaled) longer ago than this don't count
+        """
+        grid = grid or {}
+        oldest = time.time() - max_age if max_age is not None else 0
+        runs = [
+            run for run in self.index["partial"].values()
+            if run["prefix"] == prefix and all(run["grid"].get(k) == grid.get(k) for k in RESUME_KEYS)
+            and self.last_append(run) >= oldest
+        ]
+        if not runs:
+            return None
+        return max(runs, key=self.last_append)["run_id"]
+
+    def last_append(self, run):
+        """
+        when the partial run last journaled a point: the journal's mtime (every point is fsynced, so this holds
+        after a crash too) or the time noted when its writer closed, its start if neither is there
+        """
+        path = os.path.join(self.folder, run["journal"])
+        mtime = os.path.getmtime(path) if os.path.isfile(path) else 0
+        return max(run["timestamp"], run.get("last_append", 0), mtime)
+
+    def resume_run(self, run_id):
+        """
+        RunWriter continuing an unfinished run after its last completely written point
+        """
+        path = os.path.join(self.folder, self.index["partial"][run_id]["journal"])
+        with open(path, "rb") as f:
+            data = f.read()
+        # a crash mid-write can leave half a line at the end, drop it so appends start on a fresh line
+        end = data.rfind(b"\n") + 1
+        if end < len(data):
+            with open(path, "r+b") as f:
+                f.truncate(end)
+
+        positions = []
+        next_index = 0
+        for line in data[:end].decode("utf-8").splitlines()[1:]:
+            index, x, y, z = line.split(",")[:4]
+            positions.append([float(x), float(y), float(z)])
+            next_index = int(index) + 1
+        return RunWriter(self, run_id, positions, next_index)
+
+    def finish_run(self, run_id, positions):
+        run = self.index["partial"][run_id]
+        return self.save(positions, prefix=run["prefix"], grid=run["grid"], timestamp=run["timestamp"], run_id=run_id,
+                         journal=run["journal"])
+
+    def import_csv(self, path, prefix=None):
+        """
+        adds a surface_data csv (x,y,z with a header line) as a run, keeping its save time
+        the timestamp comes from the name (<prefix>_%Y-%m-%d_%H-%M-%S.csv), the file mtime if it has none
+        returns the run id, or None if the csv was already imported
+        """
+        name = os.path.basename(path)
+        if any(run.get("source") == name for run in self.index["runs"].values()):
+            return None
+
+        stem = os.path.splitext(name)[0]
+        try:
+            # the time is the last 19 characters of the name, the prefix is everything before the "_"
+            timestamp = datetime.datetime.strptime(stem[-19:], "%Y-%m-%d_%H-%M-%S").timestamp()
+            name_prefix = stem[:-20]
+        except ValueError:
+            timestamp = os.path.getmtime(path)
+            name_prefix = stem.rstrip("_")
+        positions = np.loadtxt(path, delimiter=",", skiprows=1, ndmin=2)
+        return self.save(positions, prefix=prefix or name_prefix, timestamp=timestamp, source=name)
+
+    def import_folder(self, folder=None):
+        """
+        imports every csv in folder (defaults to the store folder) that isn't in the store yet
+        """
+        folder = self.folder if folder is None else folder
+        self.index = self.read_index()
+        imported = []
+        for f in sorted(os.listdir(folder)):
+            if f.lower().endswith(".csv") and not f.endswith(".journal.csv"):
+                run_id = self.import_csv(os.path.join(folder, f))
+                if run_id is not None:
+                    imported.append(run_id)
+        return imported
+
+    def export_csv(self, run_id, path=None):
+        """
+        writes a run in the old csv format, returns the path
+        path: EXPORT_FOLDER/<run id>.csv if None, outside the store folder so import_folder doesn't pick it up again
+        """
+        if path is None:
+            os.makedirs(EXPORT_FOLDER, exist_ok=True)
+            path = os.path.join(EXPORT_FOLDER, run_id + ".csv")
+        np.savetxt(path, self.load(run_id), delimiter=",", header="x,y,z", comments='', fmt="%.3f")
+        return path
+
+
+if __name__ == "__main__":
+    command = sys.argv[1] if len(sys.argv) > 1 else "list"
+    if command == "import":
+        store = SurfaceStore(sys.argv[2] if len(sys.argv) > 2 else "surface_data")
+        imported = store.import_folder()
+        print(f"imported {len(imported)} csv files into {store.index_path}")
+    elif command == "export":
+        store = SurfaceStore()
+        print(f"exported to {store.export_csv(sys.argv[2], sys.argv[3] if len(sys.argv) > 3 else None)}")
+    elif command == "list":
+        store = SurfaceStore(sys.argv[2] if len(sys.argv) > 2 else "surface_data")
+        for run in store.runs():
+            print(f"{run['run_id']}: {run['n_points']} points, {run['time']}, {run['grid']}")
+        for run in store.index["partial"].values():
+            print(f"{run['run_id']}: unfinished, {run['time']}, {run['grid']}")
+    else:
+        print(f"unknown command {command!r}, expected import, export or list")
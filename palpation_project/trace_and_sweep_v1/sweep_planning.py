@@ -0,0 +1,163 @@
+"""
+plans the robot path between sweep points
+
+sweep_order picks the order to visit the chosen points in, so the total travel is as short as possible:
+up to EXACT_MAX_POINTS points every order is tried, above that it's a nearest neighbor tour from the start,
+then 2-opt (reverse any stretch of the tour that makes it shorter) until nothing improves
+the start and end of the sweep are fixed
+every transition is retract, transit, descend, so its length is (hop - z_a) + xy distance + (hop - z_b)
+
+ClearancePlanner gives the hop (transit) height for each transition from the surface model, instead of always z_offset:
+the highest surface point under the straight line between the two points plus a margin
+"""
+
+import itertools
+import numpy as np
+
+from config import kuka_speed, sweep_clearance_margin
+from surface_model import SurfaceModel
+
+EXACT_MAX_POINTS = 7  # 7! = 5040 orders
+CLEARANCE_FLOOR = 2   # [mm] hard minimum clearance over the surface, whatever sweep_clearance_margin is set to
+
+
+class ClearancePlanner:
+    """
+    hop height = highest point of the surface model under the straight line between the two points + margin,
+    at least margin above both end points, at most z_max
+    transits that leave the traced area go to z_max, the surface there is unknown
+    """
+    def __init__(self, model: SurfaceModel, z_max, margin=sweep_clearance_margin):
+        self.model = model
+        self.z_max = z_max
+        self.margin = max(margin, CLEARANCE_FLOOR)
+
+    def hop_heights(self, a, b):
+        """
+        hop height between every point of a (n, 3) and every point of b (m, 3), returns (n, m)
+        """
+        a = np.asarray(a, dtype=float).reshape(-1, 3)
+        b = np.asarray(b, dtype=float).reshape(-1, 3)
+        dx = b[None, :, 0] - a[:, None, 0]
+        dy = b[None, :, 1] - a[:, None, 1]
+
+        # surface samples along every segment, closer together than the model grid
+        resolution = min(self.model.dx, self.model.dy)
+        n_samples = max(int(np.ceil(np.hypot(dx, dy).max(initial=0) / resolution)) + 1, 2)
+        t = np.linspace(0, 1, n_samples)
+        xs = a[:, None, 0, None] + dx[..., None] * t
+        ys = a[:, None, 1, None] + dy[..., None] * t
+        surface = self.model.height(xs, ys).max(axis=-1)
+
+        ends = np.maximum(a[:, None, 2], b[None, :, 2])
+        hop = np.minimum(np.maximum(surface, ends) + self.margin, self.z_max)
+
+        x_grid, y_grid = self.model.x_grid, self.model.y_grid
+        inside = ((xs >= x_grid[0] - 1e-9) & (xs <= x_grid[-1] + 1e-9)
+                  & (ys >= y_grid[0] - 1e-9) & (ys <= y_grid[-1] + 1e-9)).all(axis=-1)
+        return np.where(inside, hop, self.z_max)
+
+    def hop_height(self, a, b):
+        return float(self.hop_heights(a, b)[0, 0])
+
+
+def transit_lengths(a, b, hops):
+    """
+    [mm] length of the retract / transit / descend path between every point of a (n, 3) and every point of b (m, 3)
+    hops: transit height, scalar or (n, m)
+    returns (n, m)
+    """
+    a = np.asarray(a, dtype=float).reshape(-1, 3)
+    b = np.asarray(b, dtype=float).reshape(-1, 3)
+    xy = np.hypot(a[:, None, 0] - b[None, :, 0], a[:, None, 1] - b[None, :, 1])
+    return (hops - a[:, None, 2]) + xy + (hops - b[None, :, 2])
+
+
+def travel_costs(points, start, end, z_offset, hops=None):
+    """
+    (n + 2, n + 2) symmetric matrix of travel lengths between the n points, the start (index n) and the end (index n + 1)
+    start: where kuka is, it moves straight to the first point
+    end: where kuka goes after the last point, at z_offset
+    hops: (n, n) transit heights between the points, z_offset for all if None
+    """
+    points = np.asarray(points, dtype=float).reshape(-1, 3)
+    n = len(points)
+    cost = np.zeros((n + 2, n + 2))
+    cost[:n, :n] = transit_lengths(points, points, z_offset if hops is None else hops)
+    cost[n, :n] = cost[:n, n] = np.linalg.norm(points - np.asarray(start, dtype=float), axis=1)
+    end = np.asarray(end, dtype=float)
+    cost[n + 1, :n] = cost[:n, n + 1] = (z_offset - points[:, 2]) + np.hypot(points[:, 0] - end[0], points[:, 1] - end[1])
+    return cost
+
+
+def tour_length(cost, order):
+    n = len(cost) - 2
+    tour = [n] + list(order) + [n + 1]
+    return float(cost[tour[:-1], tour[1:]].sum())
+
+
+def nearest_neighbor(cost):
+    n = len(cost) - 2
+    order = []
+    left = set(range(n))
+    current = n
+    while left:
+        candidates = np.fromiter(left, dtype=int)
+        current = int(candidates[np.argmin(cost[current, candidates])])
+        order.append(current)
+        left.remove(current)
+    return order
+
+
+def two_opt(cost, order):
+    """
+    keeps reversing the stretch tour[i..j] whenever that shortens the tour, until no reversal does
+    the start and end nodes are never moved
+    """
+    n = len(cost) - 2
+    tour = np.array([n] + list(order) + [n + 1])
+    improved = True
+    while improved:
+        improved = False
+        for i in range(1, len(tour) - 2):
+            # gain of reversing tour[i..j] for every j at once
+            j = np.arange(i + 1, len(tour) - 1)
+            a, b = tour[i - 1], tour[i]
+            c, d = tour[j], tour[j + 1]
+            gain = cost[a, b] + cost[c, d] - cost[a, c] - cost[b, d]
+            best = int(np.argmax(gain))
+            if gain[best] > 1e-9:
+                tour[i:j[best] + 1] = tour[i:j[best] + 1][::-1].copy()
+                improved = True
+    return [int(k) for k in tour[1:-1]]
+
+
+def exact_order(cost):
+    n = len(cost) - 2
+    orders = np.array(list(itertools.permutations(range(n))), dtype=int).reshape(-1, n)
+    tours = np.column_stack([np.full(len(orders), n), orders, np.full(len(orders), n + 1)])
+    lengths = cost[tours[:, :-1], tours[:, 1:]].sum(axis=1)
+    return [int(k) for k in orders[np.argmin(lengths)]]
+
+
+def sweep_order(points, start, end, z_offset, hops=None):
+    """
+    order (indexes into points) that visits every point with the least travel
+    returns (order, travel before [mm], travel after [mm]), before is for the points in the order given
+    """
+    if len(points) < 2:
+        return list(range(len(points))), 0., 0.
+    cost = travel_costs(points, start, end, z_offset, hops)
+    before = tour_length(cost, range(len(points)))
+    if len(points) <= EXACT_MAX_POINTS:
+        order = exact_order(cost)
+    else:
+        order = two_opt(cost, nearest_neighbor(cost))
+    after = tour_length(cost, order)
+    if after > before:
+        order, after = list(range(len(points))), before
+    return order, before, after
+
+
+def report_travel(name, before, after, speed=kuka_speed):
+    print(f"{name}: sweep travel {before:.0f} mm -> {after:.0f} mm, about {(before - after) / speed:.1f}s saved at {speed} mm/s")
@@ -0,0 +1,60 @@
+"""
+picks which traced points to sweep (sweep_selection = "features"), instead of spacing them evenly through the trace
+
+every traced point gets a score from features of the surface model at that point:
+    curvature - |laplacian of z|, bumps, dips and edges of a nodule
+    slope     - steepness [deg]
+    anomaly   - |z - mean height within sweep_anomaly_radius|, how far the point sticks out from its surroundings
+each feature is scaled by its 95th percentile over the trace so the weights are comparable,
+then the best scoring points are taken greedily, skipping any closer than sweep_min_spacing to one already taken
+"""
+
+import numpy as np
+
+from config import sweep_min_spacing, sweep_anomaly_radius
+from config import sweep_weight_curvature, sweep_weight_slope, sweep_weight_anomaly
+from surface_model import SurfaceModel
+
+
+def point_features(model: SurfaceModel, points, anomaly_radius=sweep_anomaly_radius):
+    """
+    {feature name: (n,) values} for the (n, 3) points
+    """
+    points = np.asarray(points, dtype=float).reshape(-1, 3)
+    x, y, z = points.T
+    return {
+        "curvature": np.abs(model.curvature(x, y)),
+        "slope": model.slope(x, y),
+        "anomaly": np.abs(z - model.smoothed(anomaly_radius).height(x, y)),
+    }
+
+
+def score_points(features, weights=None):
+    """
+    weighted sum of the features, each divided by its 95th percentile (features that are 0 everywhere count for nothing)
+    """
+    if weights is None:
+        weights = {"curvature": sweep_weight_curvature, "slope": sweep_weight_slope, "anomaly": sweep_weight_anomaly}
+    score = 0.
+    for name, values in features.items():
+        scale = np.percentile(values, 95) if len(values) else 0
+        if scale > 0:
+            score = score + weights.get(name, 0) * values / scale
+    return np.broadcast_to(score, len(next(iter(features.values())))).astype(float)
+
+
+def select_points(points, scores, n, min_spacing=sweep_min_spacing):
+    """
+    indexes of up to n points, best score first, no two closer than min_spacing in xy
+    """
+    points = np.asarray(points, dtype=float).reshape(-1, 3)
+    chosen = []
+    for i in np.argsort(-scores, kind="stable"):
+        if len(chosen) == n:
+            break
+        if chosen:
+            distances = np.hypot(points[chosen, 0] - points[i, 0], points[chosen, 1] - points[i, 1])
+            if distances.min() < min_spacing:
+                continue
+        chosen.append(int(i))
+    return chosen
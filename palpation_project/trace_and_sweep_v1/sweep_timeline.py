@@ -0,0 +1,84 @@
+"""
+per stage timeline of a sweep, to see where the time between sweeps goes
+
+for every sweep point the events are (time.monotonic):
+    move_sent - the move / path to the point went out to kuka
+    reached   - kuka reported "reached"
+    start     - labview reported "start" (or "sweeping")
+    finished  - labview reported "finished"
+the move home after the last point is one more entry with only move_sent and reached
+
+stages per point:
+    transit  reached - move_sent     robot moving, labview idle
+    wait     start - reached         robot in place, waiting for labview to start the sweep
+    sweep    finished - start        labview sweeping, robot still
+    handoff  next move_sent - finished   both idle, until the next move goes out
+the idle gap between two sweeps (no sweep running) is handoff + transit + wait
+"""
+
+import time
+
+STAGES = [("transit", "move_sent", "reached"), ("wait", "reached", "start"), ("sweep", "start", "finished")]
+
+
+class SweepTimeline:
+    def __init__(self):
+        self.t0 = time.monotonic()
+        self.points = []
+
+    def mark(self, n, event, t=None):
+        """
+        records event for point n, only the first time (labview and kuka threads may both report it)
+        """
+        while len(self.points) <= n:
+            self.points.append({})
+        self.points[n].setdefault(event, time.monotonic() if t is None else t)
+
+    def has(self, n, event):
+        return n < len(self.points) and event in self.points[n]
+
+    def stages(self):
+        """
+        [{stage: seconds}] per point, stages with missing events are left out
+        """
+        result = []
+        for n, events in enumerate(self.points):
+            stage = {name: events[b] - events[a] for name, a, b in STAGES if a in events and b in events}
+            if n + 1 < len(self.points) and "finished" in events and "move_sent" in self.points[n + 1]:
+                stage["handoff"] = self.points[n + 1]["move_sent"] - events["finished"]
+            result.append(stage)
+        return result
+
+    def idle_gaps(self):
+        """
+        [s] time between the end of each sweep and the start of the next one
+        """
+        return [b["start"] - a["finished"] for a, b in zip(self.points, self.points[1:])
+                if "finished" in a and "start" in b]
+
+    def summary(self):
+        stages = self.stages()
+        totals = {}
+        for stage in stages:
+            for name, seconds in stage.items():
+                totals[name] = totals.get(name, 0.) + seconds
+        gaps = self.idle_gaps()
+        return {
+            "stages": stages,
+            "totals": totals,
+            "idle_gaps": gaps,
+            "mean_idle_gap": sum(gaps) / len(gaps) if gaps else None,
+            "wall": max((t for events in self.points for t in events.values()), default=self.t0) - self.t0,
+        }
+
+    def report(self):
+        summary = self.summary()
+        print("sweep timeline [s]:   transit     wait    sweep  handoff")
+        for n, stage in enumerate(summary["stages"]):
+            name = "home" if n == len(summary["stages"]) - 1 and "start" not in self.points[n] else f"point {n + 1}"
+            values = " ".join(f"{stage[s]:8.3f}" if s in stage else "       -" for s in ("transit", "wait", "sweep", "handoff"))
+            print(f"    {name:>10}: {values}")
+        if summary["idle_gaps"]:
+            print(f"idle between sweeps: mean {summary['mean_idle_gap']:.3f}s, max {max(summary['idle_gaps']):.3f}s, "
+                  f"handoff total {summary['totals'].get('handoff', 0.):.3f}s")
+        return summary
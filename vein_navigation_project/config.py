@@ -1,3 +1,6 @@
 # for kuka tcp connection
 KUKA_HOST = '172.31.1.147'   # KUKA iiwa robot IP address
 KUKA_PORT = 30007           # KUKA listening port
+# attach to a running robot link daemon instead (python palpation_project/trace_and_sweep_v1/robot_link.py --kuka-port 30007
+# --link-dir <folder>): path of its robot_link_kuka.sock, or ("localhost", port) on windows, None connects directly
+ROBOT_LINK = None
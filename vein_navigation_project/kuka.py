@@ -6,7 +6,7 @@ import socket
 import time
 import sys
 
-from config import KUKA_HOST, KUKA_PORT
+from config import KUKA_HOST, KUKA_PORT, ROBOT_LINK
 
 class KukaState:
     IDLE = 0
@@ -20,9 +20,18 @@ class Kuka:
         self.position = [0, 0, 0]
 
     def connect(self):
-        self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self.socket.connect((KUKA_HOST, KUKA_PORT))
-        print(f"Connected to KUKA robot at {KUKA_HOST}:{KUKA_PORT}")
+        if ROBOT_LINK is not None:
+            self.socket = socket.socket(socket.AF_UNIX if isinstance(ROBOT_LINK, str) else socket.AF_INET, socket.SOCK_STREAM)
+            self.socket.connect(ROBOT_LINK)
+            # the daemon answers "attached", or "busy" / "no kuka" and closes
+            greeting = self.socket.recv(64).strip().decode()
+            if greeting != "attached":
+                raise ConnectionError(f"robot link refused the connection: {greeting or 'closed'}")
+            print(f"Connected to KUKA robot through the robot link at {ROBOT_LINK}")
+        else:
+            self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            self.socket.connect((KUKA_HOST, KUKA_PORT))
+            print(f"Connected to KUKA robot at {KUKA_HOST}:{KUKA_PORT}")
         self.kuka_connected = True
         self.kuka_state = KukaState.IDLE
 